@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Add Performance Indexes
+=======================
+
+db.create_all() only creates indexes together with new tables, so the
+composite indexes declared in models.py (``__table_args__``) never reach a
+database whose tables already exist. create_missing_indexes() compares the
+model indexes with what the database has and creates the missing ones:
+
+- PostgreSQL: CREATE INDEX CONCURRENTLY, so list pages keep working while a
+  large table is indexed
+- MySQL: plain CREATE INDEX, which InnoDB builds online
+- SQLite: CREATE INDEX
+
+It runs at startup from app.py and can be run by hand:
+
+    python add_performance_indexes.py
+"""
+
+import logging
+
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateIndex
+
+
+def create_missing_indexes(engine, metadata):
+    """Create model-declared indexes missing from existing tables; returns their names"""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    dialect = engine.dialect.name
+    created = []
+
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables or not table.indexes:
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda i: i.name):
+            if index.name in existing:
+                continue
+            sql = str(CreateIndex(index).compile(dialect=engine.dialect))
+            try:
+                if dialect == 'postgresql':
+                    # CONCURRENTLY cannot run inside a transaction block
+                    sql = sql.replace('CREATE INDEX', 'CREATE INDEX CONCURRENTLY', 1)
+                    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                        conn.exec_driver_sql(sql)
+                else:
+                    with engine.begin() as conn:
+                        conn.exec_driver_sql(sql)
+                created.append(index.name)
+                logging.info(f"✅ Created index {index.name} on {table.name}")
+            except Exception as e:
+                # Another worker may be creating the same index at startup
+                if "already exists" in str(e).lower() or "duplicate key name" in str(e).lower():
+                    logging.info(f"✓ Index {index.name} already exists")
+                else:
+                    logging.warning(f"Could not create index {index.name} on {table.name}: {e}")
+                    if dialect == 'postgresql':
+                        # A failed concurrent build leaves an INVALID index behind
+                        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                            conn.exec_driver_sql(f"DROP INDEX CONCURRENTLY IF EXISTS {index.name}")
+    return created
+
+
+if __name__ == "__main__":
+    from app import app, db
+
+    with app.app_context():
+        names = create_missing_indexes(db.engine, db.metadata)
+        print(f"✅ Created {len(names)} indexes" + (f": {', '.join(names)}" if names else ""))
@@ -109,6 +109,59 @@ app.config['SAP_B1_USERNAME'] = os.environ.get('SAP_B1_USERNAME', 'manager')
 app.config['SAP_B1_PASSWORD'] = os.environ.get('SAP_B1_PASSWORD', '1422')
 app.config['SAP_B1_COMPANY_DB'] = os.environ.get('SAP_B1_COMPANY_DB',
                                                  'EINV-TESTDB-LIVE-HUST')
+# Logged-in Service Layer sessions kept per worker for reuse across requests
+app.config['SAP_SESSION_POOL_SIZE'] = int(os.environ.get('SAP_SESSION_POOL_SIZE', '4'))
+# Service Layer request timeout (seconds) and retry policy for transient failures
+app.config['SAP_REQUEST_TIMEOUT'] = int(os.environ.get('SAP_REQUEST_TIMEOUT', '60'))
+app.config['SAP_REQUEST_RETRIES'] = int(os.environ.get('SAP_REQUEST_RETRIES', '3'))
+app.config['SAP_RETRY_BACKOFF'] = float(os.environ.get('SAP_RETRY_BACKOFF', '0.5'))
+# Maximum GETs packed into one Service Layer $batch call
+app.config['SAP_BATCH_MAX_REQUESTS'] = int(os.environ.get('SAP_BATCH_MAX_REQUESTS', '50'))
+# Parallel Service Layer calls allowed per worker process for fan-out lookups
+app.config['SAP_MAX_CONCURRENCY'] = int(os.environ.get('SAP_MAX_CONCURRENCY', '4'))
+# Records requested per page when reading Service Layer collections
+app.config['SAP_PAGE_SIZE'] = int(os.environ.get('SAP_PAGE_SIZE', '500'))
+# Shared SAP master data cache across workers: memory, sqlite (SAP_CACHE_URL = file path) or redis (SAP_CACHE_URL = redis:// URL)
+app.config['SAP_CACHE_BACKEND'] = os.environ.get('SAP_CACHE_BACKEND', 'memory')
+app.config['SAP_CACHE_URL'] = os.environ.get('SAP_CACHE_URL')
+app.config['SAP_CACHE_L1_TTL'] = int(os.environ.get('SAP_CACHE_L1_TTL', '30'))
+# Let identical concurrent SAP reads share one Service Layer call
+app.config['SAP_COALESCE_READS'] = os.environ.get('SAP_COALESCE_READS', 'true').lower() == 'true'
+# How often (seconds) scans pick up bin_locations changes from other workers
+app.config['BIN_DIRECTORY_REFRESH_SECONDS'] = int(os.environ.get('BIN_DIRECTORY_REFRESH_SECONDS', '60'))
+# How often (seconds) item lookups pick up items mirror changes from other workers
+app.config['ITEM_DIRECTORY_REFRESH_SECONDS'] = int(os.environ.get('ITEM_DIRECTORY_REFRESH_SECONDS', '60'))
+# Incremental master data sync: only fetch rows changed since the last sync,
+# with a full reconciliation pass every SAP_FULL_SYNC_HOURS
+app.config['SAP_DELTA_SYNC'] = os.environ.get('SAP_DELTA_SYNC', 'true').lower() == 'true'
+app.config['SAP_FULL_SYNC_HOURS'] = int(os.environ.get('SAP_FULL_SYNC_HOURS', '168'))
+# Rows per multi-row INSERT ... ON CONFLICT statement in the master data syncs
+app.config['SYNC_UPSERT_CHUNK_SIZE'] = int(os.environ.get('SYNC_UPSERT_CHUNK_SIZE', '1000'))
+# Master data sync scheduler: 'thread' runs queued/periodic syncs inside the
+# web workers, 'off' leaves them to the standalone `python sync_scheduler.py`
+app.config['SAP_SYNC_SCHEDULER'] = os.environ.get('SAP_SYNC_SCHEDULER', 'thread')
+app.config['SAP_SYNC_INTERVAL_MINUTES'] = int(os.environ.get('SAP_SYNC_INTERVAL_MINUTES', '60'))  # 0 disables periodic runs
+app.config['SAP_SYNC_POLL_SECONDS'] = int(os.environ.get('SAP_SYNC_POLL_SECONDS', '15'))
+# Split full bin syncs per warehouse and fetch the warehouses concurrently
+app.config['SAP_BIN_SYNC_PARALLEL'] = os.environ.get('SAP_BIN_SYNC_PARALLEL', 'true').lower() == 'true'
+# Rows per page in the document list views and list APIs (?page_size= is capped at the max)
+app.config['LIST_PAGE_SIZE'] = int(os.environ.get('LIST_PAGE_SIZE', '50'))
+app.config['LIST_PAGE_SIZE_MAX'] = int(os.environ.get('LIST_PAGE_SIZE_MAX', '200'))
+# Fail requests that exceed their view's query budget instead of only logging it (dev/test)
+app.config['QUERY_BUDGET_STRICT'] = os.environ.get('QUERY_BUDGET_STRICT', 'false').lower() == 'true'
+# Document numbers each worker reserves per round trip (unused ones are skipped on restart)
+app.config['DOC_NUMBER_BLOCK_SIZE'] = int(os.environ.get('DOC_NUMBER_BLOCK_SIZE', '10'))
+# SAP posting outbox dispatcher: 'thread' posts approved documents from the
+# web workers, 'off' leaves them to the standalone `python sap_outbox.py`
+app.config['SAP_OUTBOX_DISPATCHER'] = os.environ.get('SAP_OUTBOX_DISPATCHER', 'thread')
+app.config['SAP_OUTBOX_POLL_SECONDS'] = int(os.environ.get('SAP_OUTBOX_POLL_SECONDS', '5'))
+app.config['SAP_OUTBOX_MAX_ATTEMPTS'] = int(os.environ.get('SAP_OUTBOX_MAX_ATTEMPTS', '5'))
+app.config['SAP_OUTBOX_RETRY_BACKOFF_SECONDS'] = int(os.environ.get('SAP_OUTBOX_RETRY_BACKOFF_SECONDS', '30'))  # doubles per attempt
+# Idempotency keys on SAP postings (WMS-GRN-12 in NumAtCard, WMS-TR-7 in
+# JournalMemo) - use a distinct prefix per WMS instance sharing a company DB
+app.config['SAP_POSTING_KEY_PREFIX'] = os.environ.get('SAP_POSTING_KEY_PREFIX', 'WMS')
+# Wait after a post with an unknown outcome (timeout) before checking SAP and retrying
+app.config['SAP_POSTING_SETTLE_SECONDS'] = int(os.environ.get('SAP_POSTING_SETTLE_SECONDS', '120'))
 
 with app.app_context():
     # Import models to create tables
@@ -156,7 +209,47 @@ with app.app_context():
             logging.info("✅ SQLite schema migration completed")
         else:
             logging.info("✓ Using PostgreSQL - schema managed by SQLAlchemy")
-            
+
+        # sap_sync_state.checkpoint was added after the table was first created
+        try:
+            db.session.execute(text("ALTER TABLE sap_sync_state ADD COLUMN checkpoint TEXT"))
+            db.session.commit()
+            logging.info("✅ Added 'checkpoint' column to sap_sync_state")
+        except Exception as e:
+            db.session.rollback()
+            if "duplicate column" in str(e).lower() or "already exists" in str(e).lower():
+                logging.info("✓ 'checkpoint' column already exists")
+            else:
+                logging.debug(f"Checkpoint column: {e}")
+
+        # items.sales_unit was added after the items mirror was first created
+        try:
+            db.session.execute(text("ALTER TABLE items ADD COLUMN sales_unit VARCHAR(20)"))
+            db.session.commit()
+            logging.info("✅ Added 'sales_unit' column to items")
+        except Exception as e:
+            db.session.rollback()
+            if "duplicate column" in str(e).lower() or "already exists" in str(e).lower():
+                logging.info("✓ 'sales_unit' column already exists")
+            else:
+                logging.debug(f"Sales unit column: {e}")
+
+        # sap_sync_runs.active_slot was added after the table was first created
+        try:
+            db.session.execute(text("ALTER TABLE sap_sync_runs ADD COLUMN active_slot INTEGER"))
+            db.session.commit()
+            logging.info("✅ Added 'active_slot' column to sap_sync_runs")
+        except Exception as e:
+            db.session.rollback()
+            if "duplicate column" in str(e).lower() or "already exists" in str(e).lower():
+                logging.info("✓ 'active_slot' column already exists")
+            else:
+                logging.debug(f"Active slot column: {e}")
+
+        # create_all() skips indexes on tables that already exist
+        from add_performance_indexes import create_missing_indexes
+        create_missing_indexes(db.engine, db.metadata)
+
     except Exception as e:
         logging.warning(f"Schema migration warning: {e}")
 
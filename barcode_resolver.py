@@ -0,0 +1,197 @@
+"""
+Barcode Resolver
+================
+
+Works out what a scanned string refers to. Every barcode the WMS knows
+about - supplier and WMS-generated barcodes on GRN lines, printed barcode
+labels and SAP item barcodes from the items mirror - is kept in the
+barcode_index table, so a scan is resolved to item, batch and origin
+document with one indexed query. QR label payloads carry their data inline
+and need no query at all.
+
+GRN lines and labels are indexed by ORM event listeners as they are
+written; SAP item barcodes are indexed by SAPIntegration.sync_items.
+"""
+
+import logging
+import re
+from datetime import datetime
+
+from sqlalchemy import event, select
+
+from app import db
+from bulk_upsert import bulk_upsert
+from item_directory import item_directory
+from models import BarcodeIndex, BarcodeLabel, GRNDocument, GRNItem, ItemMaster
+
+# WMS-{ItemCode}-{8 hex digits}, see add_grn_item / print_label
+WMS_BARCODE = re.compile(r'^WMS-(.+)-([0-9A-F]{8})$')
+
+# Document-bound sources win over the plain SAP item barcode
+SOURCE_PRIORITY = {'grn_generated': 0, 'wms_label': 1, 'grn_supplier': 2, 'sap_item': 3}
+
+
+def _result(barcode, item_code, source, batch_number=None, serial_number=None,
+            document_type=None, document_id=None, document_number=None):
+    item = item_directory.lookup(item_code) if item_code else None
+    return {
+        'barcode': barcode,
+        'item_code': item_code,
+        'item_name': item['ItemName'] if item else None,
+        'batch_number': batch_number,
+        'serial_number': serial_number,
+        'source': source,
+        'document_type': document_type,
+        'document_id': document_id,
+        'document_number': document_number
+    }
+
+
+def resolve(scanned):
+    """Resolve a scanned string to item, batch and origin document; None if unknown"""
+    scanned = (scanned or '').strip()
+    if not scanned:
+        return None
+
+    # QR label payload: ItemCode|DocumentNumber|ItemName|BatchNumber
+    if '|' in scanned:
+        parts = scanned.split('|')
+        if len(parts) >= 4 and parts[0]:
+            batch_number = parts[3] if parts[3] and parts[3] != 'N/A' else None
+            return _result(scanned, parts[0], 'qr_label', batch_number=batch_number,
+                           document_number=parts[1] or None)
+
+    entries = BarcodeIndex.query.filter_by(barcode=scanned).all()
+    if entries:
+        entry = min(entries, key=lambda e: (SOURCE_PRIORITY.get(e.source, 9), -e.id))
+        return _result(scanned, entry.item_code, entry.source,
+                       batch_number=entry.batch_number,
+                       serial_number=entry.serial_number,
+                       document_type=entry.document_type,
+                       document_id=entry.document_id,
+                       document_number=entry.document_number)
+
+    # WMS barcodes generated without being saved (e.g. /api/generate_barcode)
+    match = WMS_BARCODE.match(scanned)
+    if match:
+        return _result(scanned, match.group(1), 'wms_pattern')
+
+    # Plain item code
+    if item_directory.lookup(scanned):
+        return _result(scanned, scanned, 'item_code')
+    return None
+
+
+def _replace_entry(connection, source, source_id, entry=None):
+    """Point (source, source_id) at entry's barcode, or drop it when there is none"""
+    table = BarcodeIndex.__table__
+    connection.execute(table.delete().where(table.c.source == source,
+                                            table.c.source_id == source_id))
+    if entry and entry.get('barcode'):
+        now = datetime.utcnow()
+        connection.execute(table.insert().values(source=source, source_id=source_id,
+                                                 created_at=now, updated_at=now, **entry))
+
+
+@event.listens_for(GRNItem, 'after_insert')
+@event.listens_for(GRNItem, 'after_update')
+def _index_grn_item(mapper, connection, target):
+    po_number = connection.execute(
+        select(GRNDocument.po_number).where(GRNDocument.id == target.grn_document_id)).scalar()
+    for source, barcode in (('grn_supplier', target.supplier_barcode),
+                            ('grn_generated', target.generated_barcode)):
+        _replace_entry(connection, source, str(target.id), {
+            'barcode': barcode,
+            'item_code': target.item_code,
+            'batch_number': target.batch_number,
+            'serial_number': target.serial_number,
+            'document_type': 'GRN',
+            'document_id': target.grn_document_id,
+            'document_number': po_number
+        })
+
+
+@event.listens_for(GRNItem, 'after_delete')
+def _unindex_grn_item(mapper, connection, target):
+    for source in ('grn_supplier', 'grn_generated'):
+        _replace_entry(connection, source, str(target.id))
+
+
+@event.listens_for(BarcodeLabel, 'after_insert')
+@event.listens_for(BarcodeLabel, 'after_update')
+def _index_barcode_label(mapper, connection, target):
+    _replace_entry(connection, 'wms_label', str(target.id), {
+        'barcode': target.barcode,
+        'item_code': target.item_code
+    })
+
+
+@event.listens_for(BarcodeLabel, 'after_delete')
+def _unindex_barcode_label(mapper, connection, target):
+    _replace_entry(connection, 'wms_label', str(target.id))
+
+
+def index_item_barcodes(rows):
+    """Index SAP item barcodes from items mirror rows (caller commits)"""
+    table = BarcodeIndex.__table__
+    without = [row['item_code'] for row in rows if not row.get('barcode')]
+    if without:
+        db.session.execute(table.delete().where(table.c.source == 'sap_item',
+                                                table.c.source_id.in_(without)))
+    bulk_upsert('barcode_index', ({
+        'barcode': row['barcode'],
+        'item_code': row['item_code'],
+        'source': 'sap_item',
+        'source_id': row['item_code']
+    } for row in rows if row.get('barcode')), ['source', 'source_id'])
+
+
+def rebuild_index():
+    """Index every existing GRN line, label and mirrored item barcode (idempotent)"""
+    def grn_rows():
+        query = db.session.query(GRNItem, GRNDocument.po_number).join(
+            GRNDocument, GRNItem.grn_document_id == GRNDocument.id)
+        for grn_item, po_number in query.yield_per(1000):
+            for source, barcode in (('grn_supplier', grn_item.supplier_barcode),
+                                    ('grn_generated', grn_item.generated_barcode)):
+                if barcode:
+                    yield {
+                        'barcode': barcode,
+                        'item_code': grn_item.item_code,
+                        'batch_number': grn_item.batch_number,
+                        'serial_number': grn_item.serial_number,
+                        'source': source,
+                        'source_id': str(grn_item.id),
+                        'document_type': 'GRN',
+                        'document_id': grn_item.grn_document_id,
+                        'document_number': po_number
+                    }
+
+    def label_rows():
+        for label in BarcodeLabel.query.yield_per(1000):
+            yield {
+                'barcode': label.barcode,
+                'item_code': label.item_code,
+                'batch_number': None,
+                'serial_number': None,
+                'source': 'wms_label',
+                'source_id': str(label.id),
+                'document_type': None,
+                'document_id': None,
+                'document_number': None
+            }
+
+    def item_rows():
+        for item in ItemMaster.query.filter(ItemMaster.barcode.isnot(None)).yield_per(1000):
+            yield {
+                'barcode': item.barcode,
+                'item_code': item.item_code,
+                'source': 'sap_item',
+                'source_id': item.item_code
+            }
+
+    count = sum(bulk_upsert('barcode_index', rows(), ['source', 'source_id'])
+                for rows in (grn_rows, label_rows, item_rows))
+    db.session.commit()
+    logging.info(f"🏷️ Indexed {count} barcodes")
+    return count
@@ -0,0 +1,107 @@
+"""
+Local Bin Directory
+===================
+
+In-memory BinCode -> AbsEntry / warehouse / active index over the
+bin_locations table that SAPIntegration.sync_bins maintains, so a bin scan
+is resolved with a dictionary lookup instead of a BinLocations query to SAP.
+"""
+
+import logging
+import threading
+import time
+
+from app import app, db
+from models import BinLocation
+
+
+class BinDirectory:
+    """Bin code index loaded from bin_locations and refreshed incrementally"""
+
+    def __init__(self, refresh_interval=60):
+        self.refresh_interval = refresh_interval
+        self._bins = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._high_water = None
+        self._checked_at = 0.0
+
+    def _query(self, changed_since=None):
+        query = db.session.query(BinLocation.bin_code,
+                                 BinLocation.warehouse_code,
+                                 BinLocation.sap_abs_entry,
+                                 BinLocation.is_active,
+                                 BinLocation.updated_at)
+        if changed_since is not None:
+            # >= so rows sharing the high-water timestamp are never missed
+            query = query.filter(BinLocation.updated_at >= changed_since)
+        return query.all()
+
+    def _apply(self, rows, replace=False):
+        bins = {} if replace else None
+        with self._lock:
+            target = bins if replace else self._bins
+            for row in rows:
+                target[row.bin_code] = {
+                    'BinCode': row.bin_code,
+                    'AbsEntry': row.sap_abs_entry,
+                    'Warehouse': row.warehouse_code,
+                    'Active': row.is_active is not False
+                }
+                if row.updated_at and (self._high_water is None
+                                       or row.updated_at > self._high_water):
+                    self._high_water = row.updated_at
+            if replace:
+                self._bins = bins
+            self._loaded = True
+            self._checked_at = time.monotonic()
+
+    def load(self):
+        """Load the whole directory from bin_locations"""
+        self._high_water = None
+        rows = self._query()
+        self._apply(rows, replace=True)
+        logging.info(f"📍 Loaded {len(rows)} bins into the local bin directory")
+
+    def refresh(self):
+        """Pick up bin_locations rows changed since the last load or refresh"""
+        if not self._loaded:
+            return self.load()
+        rows = self._query(self._high_water)
+        self._apply(rows)
+        if rows:
+            logging.info(f"📍 Refreshed {len(rows)} bins in the local bin directory")
+
+    def lookup(self, bin_code):
+        """Resolve a scanned bin code locally; None if unknown or without an AbsEntry"""
+        if not self._loaded or time.monotonic() - self._checked_at >= self.refresh_interval:
+            try:
+                self.refresh()
+            except Exception as e:
+                # Don't retry on every scan while the table is unreachable
+                self._checked_at = time.monotonic()
+                logging.warning(f"Local bin directory unavailable: {str(e)}")
+
+        entry = self._bins.get(bin_code)
+        if entry and entry['AbsEntry'] is not None:
+            return entry
+        return None
+
+    def remember(self, bin_code, abs_entry, warehouse_code, active=True):
+        """Keep a bin resolved from SAP so the next scan of it stays local"""
+        if not bin_code or abs_entry is None:
+            return
+        with self._lock:
+            self._bins[bin_code] = {
+                'BinCode': bin_code,
+                'AbsEntry': abs_entry,
+                'Warehouse': warehouse_code,
+                'Active': active
+            }
+
+    def __len__(self):
+        return len(self._bins)
+
+
+bin_directory = BinDirectory(
+    refresh_interval=app.config.get('BIN_DIRECTORY_REFRESH_SECONDS', 60))
@@ -0,0 +1,106 @@
+"""
+Bulk Upsert
+===========
+
+Dialect-aware multi-row upsert for the SAP master data syncs. Rows are
+written as one INSERT ... VALUES (...), (...) statement per chunk with the
+database's own conflict clause (ON CONFLICT for PostgreSQL and SQLite,
+ON DUPLICATE KEY UPDATE for MySQL), so syncing N records costs about
+N / chunk_size round trips instead of one or two per record.
+
+Nothing is committed here - callers commit, either once so a whole sync is
+a single transaction, or from on_chunk to make progress durable chunk by
+chunk.
+"""
+
+from app import app, db
+
+# Bound parameters a single statement may carry, per dialect
+MAX_PARAMETERS = {
+    'sqlite': 999,
+    'postgresql': 65535,
+    'mysql': 65535
+}
+
+
+def _now(dialect):
+    return 'CURRENT_TIMESTAMP' if dialect == 'sqlite' else 'NOW()'
+
+
+def _upsert_sql(dialect, table, columns, key_columns, update_columns, row_count, timestamps):
+    now = _now(dialect)
+    insert_columns = list(columns) + (['created_at', 'updated_at'] if timestamps else [])
+    values = []
+    for i in range(row_count):
+        placeholders = [f":{column}_{i}" for column in columns]
+        if timestamps:
+            placeholders += [now, now]
+        values.append(f"({', '.join(placeholders)})")
+
+    sql = f"INSERT INTO {table} ({', '.join(insert_columns)}) VALUES {', '.join(values)}"
+
+    if dialect == 'mysql':
+        assignments = [f"{column} = VALUES({column})" for column in update_columns]
+        if timestamps:
+            assignments.append(f"updated_at = {now}")
+        return f"{sql} ON DUPLICATE KEY UPDATE {', '.join(assignments)}"
+
+    # PostgreSQL and SQLite (3.24+) share the ON CONFLICT syntax
+    assignments = [f"{column} = EXCLUDED.{column}" for column in update_columns]
+    if timestamps:
+        assignments.append(f"updated_at = {now}")
+    return (f"{sql} ON CONFLICT ({', '.join(key_columns)}) "
+            f"DO UPDATE SET {', '.join(assignments)}")
+
+
+def bulk_upsert(table, rows, key_columns, update_columns=None, chunk_size=None, timestamps=True,
+                on_chunk=None):
+    """Insert or update rows (dicts with the same keys) in multi-row chunks.
+
+    key_columns must carry a unique constraint. update_columns defaults to
+    every non-key column. With timestamps, created_at/updated_at are set to
+    the database time on insert and updated_at on update. rows may be any
+    iterable, so large syncs stream through in chunks. on_chunk(rows) is
+    called after each chunk is written. Returns the number of rows written.
+    """
+    dialect = db.engine.dialect.name
+    chunk_size = chunk_size or app.config.get('SYNC_UPSERT_CHUNK_SIZE', 1000)
+
+    written = 0
+    chunk = []
+    columns = None
+    for row in rows:
+        if columns is None:
+            columns = list(row.keys())
+            if update_columns is None:
+                update_columns = [c for c in columns if c not in key_columns]
+            # Stay under the dialect's bound parameter limit
+            chunk_size = max(1, min(chunk_size,
+                                    MAX_PARAMETERS.get(dialect, 999) // len(columns)))
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            written += _write_chunk(dialect, table, columns, key_columns,
+                                    update_columns, chunk, timestamps)
+            if on_chunk:
+                on_chunk(chunk)
+            chunk = []
+
+    if chunk:
+        written += _write_chunk(dialect, table, columns, key_columns,
+                                update_columns, chunk, timestamps)
+        if on_chunk:
+            on_chunk(chunk)
+    return written
+
+
+def _write_chunk(dialect, table, columns, key_columns, update_columns, chunk, timestamps):
+    # A key repeated within one statement is an error on PostgreSQL - last one wins
+    chunk = list({tuple(row.get(k) for k in key_columns): row for row in chunk}.values())
+    sql = _upsert_sql(dialect, table, columns, key_columns, update_columns,
+                      len(chunk), timestamps)
+    params = {}
+    for i, row in enumerate(chunk):
+        for column in columns:
+            params[f"{column}_{i}"] = row.get(column)
+    db.session.execute(db.text(sql), params)
+    return len(chunk)
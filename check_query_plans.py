@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Check Query Plans
+=================
+
+Runs EXPLAIN on the hot list / lookup queries and reports whether each one
+uses the index models.py declares for it. Run it after deploying to a new
+database or after schema changes:
+
+    python check_query_plans.py
+
+Exits with status 1 when a query would not use its index. On PostgreSQL
+sequential scans are disabled for the check, and on MySQL an index listed in
+possible_keys counts, because on small tables both planners rightly prefer
+a full scan - the point is that the index is usable once the table grows.
+"""
+
+import sys
+from datetime import datetime
+
+from sqlalchemy import func, tuple_
+
+from app import app, db
+from models import (BarcodeLabel, GRNDocument, GRNItem, InventoryCount, InventoryTransfer,
+                    PickList)
+
+
+def hot_queries():
+    """(description, expected index, query) for the queries behind the list pages"""
+    def keyset(query, model):
+        # The shape keyset_pagination.keyset_page produces for a later page
+        return query.filter(tuple_(model.created_at, model.id) < tuple_(datetime(2100, 1, 1), 1)).order_by(
+            model.created_at.desc(), model.id.desc()).limit(51)
+
+    queries = []
+    for model in (GRNDocument, InventoryTransfer, PickList, InventoryCount):
+        table = model.__tablename__
+        queries.append((f"{table} by user, newest first", f"ix_{table}_user_created",
+                        keyset(model.query.filter_by(user_id=1), model)))
+        queries.append((f"{table} by status, newest first", f"ix_{table}_status_created",
+                        keyset(model.query.filter_by(status='submitted'), model)))
+    queries.append(("grn_items received quantity per item", 'ix_grn_items_document_item',
+                     db.session.query(func.sum(GRNItem.received_quantity)).filter(
+                         GRNItem.item_code == 'ITEM', GRNItem.grn_document_id == 1)))
+    queries.append(("barcode_labels by barcode", 'ix_barcode_labels_barcode',
+                     BarcodeLabel.query.filter_by(barcode='WMS-ITEM-00000000')))
+    queries.append(("barcode_labels newest first", 'ix_barcode_labels_created',
+                     keyset(BarcodeLabel.query, BarcodeLabel)))
+    return queries
+
+
+def explain(query):
+    """Plan text for a query on the current database"""
+    dialect = db.engine.dialect
+    sql = str(query.statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+    if dialect.name == 'sqlite':
+        rows = db.session.execute(db.text(f"EXPLAIN QUERY PLAN {sql}")).fetchall()
+        return '\n'.join(str(row[-1]) for row in rows)
+    if dialect.name == 'mysql':
+        rows = db.session.execute(db.text(f"EXPLAIN {sql}")).mappings().fetchall()
+        return '\n'.join(f"key={row['key']} possible_keys={row['possible_keys']} type={row['type']}"
+                         for row in rows)
+    rows = db.session.execute(db.text(f"EXPLAIN {sql}")).fetchall()
+    return '\n'.join(row[0] for row in rows)
+
+
+def check_query_plans(verbose=False):
+    """EXPLAIN every hot query; returns the descriptions of those not using their index"""
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(db.text("SET LOCAL enable_seqscan = off"))
+
+    missing = []
+    for description, index_name, query in hot_queries():
+        plan = explain(query)
+        uses_index = index_name in plan
+        print(f"{'✅' if uses_index else '❌'} {description}: "
+              f"{index_name if uses_index else 'expected ' + index_name}")
+        if verbose or not uses_index:
+            for line in plan.splitlines():
+                print(f"      {line}")
+        if not uses_index:
+            missing.append(description)
+    db.session.rollback()
+    return missing
+
+
+if __name__ == "__main__":
+    with app.app_context():
+        missing = check_query_plans(verbose='-v' in sys.argv)
+        if missing:
+            print(f"❌ {len(missing)} queries are not using their index - "
+                  f"run python add_performance_indexes.py")
+            sys.exit(1)
+        print("✅ All hot queries use their indexes")
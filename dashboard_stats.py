@@ -0,0 +1,77 @@
+"""
+Dashboard Statistics
+====================
+
+Per-user document counts for the dashboard, computed with one UNION ALL
+statement (a per-status COUNT(*) over each document table) and kept in the
+'dashboard_stats' TTL cache. A user's entry is dropped after any commit that
+inserts, updates or deletes one of their documents, so the counts are fresh
+for the user who changed something and at most a TTL old otherwise.
+"""
+
+from sqlalchemy import event, func, literal, select, union_all
+
+from app import db
+from models import GRNDocument, InventoryCount, InventoryTransfer, PickList
+from sap_cache import get_cache
+
+# Stat name -> document model, in dashboard order
+DOCUMENT_STATS = {
+    'grn_count': GRNDocument,
+    'transfer_count': InventoryTransfer,
+    'pick_list_count': PickList,
+    'count_tasks': InventoryCount
+}
+
+
+def _stats_statement(user_id):
+    return union_all(*[
+        select(literal(name).label('stat'), model.status, func.count().label('total'))
+        .where(model.user_id == user_id)
+        .group_by(model.status)
+        for name, model in DOCUMENT_STATS.items()
+    ])
+
+
+def get_dashboard_stats(user_id, breakdown=False):
+    """Document totals for a user; with breakdown, also counts per status"""
+    cache = get_cache('dashboard_stats')
+    stats = cache.get(user_id)
+    if stats is None:
+        stats = {name: 0 for name in DOCUMENT_STATS}
+        stats['by_status'] = {name: {} for name in DOCUMENT_STATS}
+        for stat, status, total in db.session.execute(_stats_statement(user_id)):
+            stats[stat] += total
+            stats['by_status'][stat][status or 'unknown'] = total
+        cache.set(user_id, stats)
+
+    if breakdown:
+        return stats
+    return {name: stats[name] for name in DOCUMENT_STATS}
+
+
+def invalidate_dashboard_stats(user_id=None):
+    """Drop one user's cached stats, or everyone's"""
+    get_cache('dashboard_stats').invalidate(user_id)
+
+
+_DOCUMENT_MODELS = tuple(DOCUMENT_STATS.values())
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_changed_owners(session, flush_context):
+    owners = session.info.setdefault('dashboard_stats_owners', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, _DOCUMENT_MODELS) and obj.user_id is not None:
+            owners.add(obj.user_id)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_changed_owners(session):
+    for user_id in session.info.pop('dashboard_stats_owners', ()):
+        invalidate_dashboard_stats(user_id)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_changed_owners(session):
+    session.info.pop('dashboard_stats_owners', None)
@@ -0,0 +1,152 @@
+"""
+Local Item Directory
+====================
+
+In-memory index over the items mirror table that SAPIntegration.sync_items
+maintains: exact ItemCode lookups for validation and item details, a sorted
+code list for prefix search and a trigram index over item names, so scanner
+lookups never wait on an Items('...') call to SAP.
+"""
+
+import bisect
+import itertools
+import logging
+import threading
+import time
+
+from app import app
+from models import ItemMaster
+
+
+def _trigrams(text, pad=True):
+    # Names are padded so short words still index; search terms are not,
+    # since they may start mid-word
+    text = f"  {text.lower()} " if pad else text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class ItemDirectory:
+    """Item code / name index loaded from items and refreshed incrementally"""
+
+    def __init__(self, refresh_interval=60):
+        self.refresh_interval = refresh_interval
+        self._items = {}
+        self._codes = []
+        self._name_index = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._high_water = None
+        self._checked_at = 0.0
+
+    def _query(self, changed_since=None):
+        query = ItemMaster.query
+        if changed_since is not None:
+            # >= so rows sharing the high-water timestamp are never missed
+            query = query.filter(ItemMaster.updated_at >= changed_since)
+        return query.all()
+
+    def _index_name(self, item_code, name, add=True):
+        for gram in _trigrams(name or ''):
+            codes = self._name_index.setdefault(gram, set())
+            if add:
+                codes.add(item_code)
+            else:
+                codes.discard(item_code)
+
+    def _apply(self, rows, replace=False):
+        with self._lock:
+            if replace:
+                self._items, self._name_index = {}, {}
+            for row in rows:
+                previous = self._items.get(row.item_code)
+                if previous:
+                    self._index_name(row.item_code, previous['ItemName'], add=False)
+                self._items[row.item_code] = {
+                    'ItemCode': row.item_code,
+                    'ItemName': row.item_name,
+                    'InventoryUOM': row.inventory_uom,
+                    # Rows synced before sales_unit was mirrored have none yet
+                    'SalesUnit': row.sales_unit or row.inventory_uom,
+                    'UoMGroupEntry': row.uom_group_entry,
+                    'ItemType': row.item_type,
+                    'DefaultWarehouse': row.default_warehouse,
+                    'ManageBatchNumbers': row.manage_batch_numbers,
+                    'ManageSerialNumbers': row.manage_serial_numbers,
+                    'BarCode': row.barcode,
+                    'Active': row.is_active is not False
+                }
+                self._index_name(row.item_code, row.item_name)
+                if row.updated_at and (self._high_water is None
+                                       or row.updated_at > self._high_water):
+                    self._high_water = row.updated_at
+            self._codes = sorted(self._items)
+            self._loaded = True
+            self._checked_at = time.monotonic()
+
+    def load(self):
+        """Load the whole directory from the items mirror"""
+        self._high_water = None
+        rows = self._query()
+        self._apply(rows, replace=True)
+        logging.info(f"📦 Loaded {len(rows)} items into the local item directory")
+
+    def refresh(self):
+        """Pick up items rows changed since the last load or refresh"""
+        if not self._loaded:
+            return self.load()
+        rows = self._query(self._high_water)
+        self._apply(rows)
+        if rows:
+            logging.info(f"📦 Refreshed {len(rows)} items in the local item directory")
+
+    def _ensure_fresh(self):
+        if not self._loaded or time.monotonic() - self._checked_at >= self.refresh_interval:
+            try:
+                self.refresh()
+            except Exception as e:
+                # Don't retry on every lookup while the table is unreachable
+                self._checked_at = time.monotonic()
+                logging.warning(f"Local item directory unavailable: {str(e)}")
+
+    def lookup(self, item_code):
+        """Item by exact code; None if not mirrored (yet)"""
+        self._ensure_fresh()
+        return self._items.get(item_code)
+
+    def search(self, query, limit=20):
+        """Active items whose code starts with query, then items whose name contains it"""
+        self._ensure_fresh()
+        query = (query or '').strip()
+        if not query:
+            return []
+
+        with self._lock:
+            codes, items = self._codes, self._items
+            matches = []
+            # Codes are matched case-sensitively, as SAP stores them
+            start = bisect.bisect_left(codes, query)
+            for code in itertools.islice(codes, start, None):
+                if not code.startswith(query) or len(matches) >= limit:
+                    break
+                if items[code]['Active']:
+                    matches.append(items[code])
+
+            if len(matches) < limit and len(query) >= 3:
+                grams = [self._name_index.get(gram, set()) for gram in _trigrams(query, pad=False)]
+                candidates = set.intersection(*grams) if grams else set()
+                needle = query.lower()
+                found = {item['ItemCode'] for item in matches}
+                for code in sorted(candidates - found):
+                    item = items[code]
+                    if item['Active'] and needle in (item['ItemName'] or '').lower():
+                        matches.append(item)
+                        if len(matches) >= limit:
+                            break
+        return matches
+
+    def __len__(self):
+        return len(self._items)
+
+
+item_directory = ItemDirectory(
+    refresh_interval=app.config.get('ITEM_DIRECTORY_REFRESH_SECONDS', 60))
@@ -0,0 +1,93 @@
+"""
+Keyset Pagination
+=================
+
+Newest-first pages over (created_at, id) for the document list views and
+their JSON APIs. A page is fetched with
+
+    WHERE (created_at, id) < (:cursor_created_at, :cursor_id)
+    ORDER BY created_at DESC, id DESC LIMIT :page_size + 1
+
+so every page costs the same index range scan on the (filter, created_at)
+indexes, however far back the user pages - unlike OFFSET, which reads and
+discards every earlier row. The cursor is opaque to clients: pass
+next_cursor back as ?cursor= to get the following page.
+"""
+
+import base64
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+from app import app
+
+
+class KeysetPage:
+    """One page of rows plus the cursor of the page after it"""
+
+    def __init__(self, items, next_cursor=None, cursor=None, page_size=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.cursor = cursor
+        self.page_size = page_size
+
+    @property
+    def has_more(self):
+        return self.next_cursor is not None
+
+    @property
+    def is_first(self):
+        return self.cursor is None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+
+def encode_cursor(created_at, row_id):
+    raw = f"{created_at.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(created_at, id) from a cursor; ValueError if it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, row_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+def page_size_arg(value):
+    """Requested page size clamped to 1..LIST_PAGE_SIZE_MAX, default LIST_PAGE_SIZE"""
+    default = app.config.get('LIST_PAGE_SIZE', 50)
+    try:
+        size = int(value) if value not in (None, '') else default
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, app.config.get('LIST_PAGE_SIZE_MAX', 200)))
+
+
+def keyset_page(query, model, cursor=None, page_size=None):
+    """Newest-first page of query (a model query) after cursor
+
+    Raises ValueError for a malformed cursor.
+    """
+    page_size = page_size or page_size_arg(None)
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.filter(tuple_(model.created_at, model.id) < tuple_(created_at, row_id))
+
+    rows = query.order_by(model.created_at.desc(), model.id.desc()).limit(page_size + 1).all()
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+    return KeysetPage(rows, next_cursor=next_cursor, cursor=cursor or None, page_size=page_size)
@@ -11,5 +11,41 @@ try:
 except ImportError:
     print("⚠️ Enhanced bin scanning fix not found, using default implementation")
 
+# Warm the local bin and item directories so the first scans don't have to ask SAP
+try:
+    from bin_directory import bin_directory
+    from item_directory import item_directory
+    with app.app_context():
+        bin_directory.load()
+        item_directory.load()
+except Exception as e:
+    print(f"⚠️ Could not load local bin/item directories: {e}")
+
+# Build the barcode index from existing GRN lines, labels and items on first start
+try:
+    from barcode_resolver import rebuild_index
+    from models import BarcodeIndex
+    with app.app_context():
+        if BarcodeIndex.query.first() is None:
+            rebuild_index()
+except Exception as e:
+    print(f"⚠️ Could not build barcode index: {e}")
+
+# Run queued and periodic SAP master data syncs in the background
+if app.config.get('SAP_SYNC_SCHEDULER') == 'thread':
+    try:
+        from sync_scheduler import sync_scheduler
+        sync_scheduler.start()
+    except Exception as e:
+        print(f"⚠️ Could not start SAP sync scheduler: {e}")
+
+# Post QC-approved documents queued in the SAP outbox in the background
+if app.config.get('SAP_OUTBOX_DISPATCHER') == 'thread':
+    try:
+        from sap_outbox import sap_outbox
+        sap_outbox.start()
+    except Exception as e:
+        print(f"⚠️ Could not start SAP outbox dispatcher: {e}")
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
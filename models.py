@@ -114,6 +114,10 @@ class User(UserMixin, db.Model):
 
 class GRNDocument(db.Model):
     __tablename__ = 'grn_documents'
+    __table_args__ = (
+        db.Index('ix_grn_documents_user_created', 'user_id', 'created_at'),  # "my documents" lists
+        db.Index('ix_grn_documents_status_created', 'status', 'created_at'),  # QC / pending queues
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     po_number = db.Column(db.String(20), nullable=False)
@@ -146,6 +150,7 @@ class GRNDocument(db.Model):
 
 class GRNItem(db.Model):
     __tablename__ = 'grn_items'
+    __table_args__ = (db.Index('ix_grn_items_document_item', 'grn_document_id', 'item_code'),)
 
     id = db.Column(db.Integer, primary_key=True)
     grn_document_id = db.Column(db.Integer,
@@ -180,6 +185,10 @@ class GRNItem(db.Model):
 
 class InventoryTransfer(db.Model):
     __tablename__ = 'inventory_transfers'
+    __table_args__ = (
+        db.Index('ix_inventory_transfers_user_created', 'user_id', 'created_at'),
+        db.Index('ix_inventory_transfers_status_created', 'status', 'created_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     transfer_request_number = db.Column(db.String(20), nullable=False)
@@ -206,6 +215,7 @@ class InventoryTransfer(db.Model):
 
 class InventoryTransferItem(db.Model):
     __tablename__ = 'inventory_transfer_items'
+    __table_args__ = (db.Index('ix_inventory_transfer_items_transfer', 'inventory_transfer_id'),)
 
     id = db.Column(db.Integer, primary_key=True)
     inventory_transfer_id = db.Column(db.Integer,
@@ -233,6 +243,10 @@ class InventoryTransferItem(db.Model):
 
 class PickList(db.Model):
     __tablename__ = 'pick_lists'
+    __table_args__ = (
+        db.Index('ix_pick_lists_user_created', 'user_id', 'created_at'),
+        db.Index('ix_pick_lists_status_created', 'status', 'created_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     sales_order_number = db.Column(db.String(20), nullable=False)
@@ -257,6 +271,7 @@ class PickList(db.Model):
 
 class PickListItem(db.Model):
     __tablename__ = 'pick_list_items'
+    __table_args__ = (db.Index('ix_pick_list_items_pick_list', 'pick_list_id'),)
 
     id = db.Column(db.Integer, primary_key=True)
     pick_list_id = db.Column(db.Integer, db.ForeignKey('pick_lists.id'), nullable=False)
@@ -275,6 +290,10 @@ class PickListItem(db.Model):
 
 class InventoryCount(db.Model):
     __tablename__ = 'inventory_counts'
+    __table_args__ = (
+        db.Index('ix_inventory_counts_user_created', 'user_id', 'created_at'),
+        db.Index('ix_inventory_counts_status_created', 'status', 'created_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     count_number = db.Column(db.String(20), nullable=False)
@@ -296,6 +315,7 @@ class InventoryCount(db.Model):
 
 class InventoryCountItem(db.Model):
     __tablename__ = 'inventory_count_items'
+    __table_args__ = (db.Index('ix_inventory_count_items_count', 'inventory_count_id'),)
 
     id = db.Column(db.Integer, primary_key=True)
     inventory_count_id = db.Column(db.Integer,
@@ -316,6 +336,10 @@ class InventoryCountItem(db.Model):
 
 class BarcodeLabel(db.Model):
     __tablename__ = 'barcode_labels'
+    __table_args__ = (
+        db.Index('ix_barcode_labels_barcode', 'barcode'),
+        db.Index('ix_barcode_labels_created', 'created_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     item_code = db.Column(db.String(50), nullable=False)
@@ -329,6 +353,29 @@ class BarcodeLabel(db.Model):
         return f'<BarcodeLabel {self.id}>'
 
 
+class BarcodeIndex(db.Model):
+    """Every known barcode mapped to its item, batch and origin document,
+    so a scan resolves with one indexed query (see barcode_resolver.py)"""
+    __tablename__ = 'barcode_index'
+    __table_args__ = (db.UniqueConstraint('source', 'source_id', name='uq_barcode_index_source'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    barcode = db.Column(db.String(200), nullable=False, index=True)
+    item_code = db.Column(db.String(50), nullable=False)
+    batch_number = db.Column(db.String(50), nullable=True)
+    serial_number = db.Column(db.String(50), nullable=True)
+    source = db.Column(db.String(20), nullable=False)  # grn_supplier, grn_generated, wms_label, sap_item
+    source_id = db.Column(db.String(50), nullable=False)  # Id of the source row (ItemCode for sap_item)
+    document_type = db.Column(db.String(20), nullable=True)  # GRN
+    document_id = db.Column(db.Integer, nullable=True)
+    document_number = db.Column(db.String(50), nullable=True)  # PO number
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<BarcodeIndex {self.barcode} -> {self.item_code}>'
+
+
 class BinLocation(db.Model):
     __tablename__ = 'bin_locations'
     
@@ -400,6 +447,121 @@ class BinScanningLog(db.Model):
         return f'<BinScanningLog {self.bin_code} by {self.user_id}>'
 
 
+class ItemMaster(db.Model):
+    """Local mirror of the SAP B1 item master, kept current by sync_items"""
+    __tablename__ = 'items'
+
+    id = db.Column(db.Integer, primary_key=True)
+    item_code = db.Column(db.String(50), unique=True, nullable=False)
+    item_name = db.Column(db.String(200), nullable=True)
+    inventory_uom = db.Column(db.String(20), nullable=True)
+    sales_unit = db.Column(db.String(20), nullable=True)
+    uom_group_entry = db.Column(db.Integer, nullable=True)
+    item_type = db.Column(db.String(20), nullable=True)
+    default_warehouse = db.Column(db.String(50), nullable=True)
+    manage_batch_numbers = db.Column(db.String(10), nullable=True)  # tYES / tNO as SAP returns them
+    manage_serial_numbers = db.Column(db.String(10), nullable=True)
+    barcode = db.Column(db.String(100), nullable=True)  # Primary BarCode
+    is_active = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ItemMaster {self.item_code}>'
+
+
+class SAPSyncState(db.Model):
+    __tablename__ = 'sap_sync_state'
+
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(50), nullable=False, unique=True)  # BinLocations, BusinessPartners
+    last_update_date = db.Column(db.String(10), nullable=True)  # High-water mark: SAP UpdateDate (YYYY-MM-DD)
+    last_update_time = db.Column(db.String(8), nullable=True)  # High-water mark: SAP UpdateTime (HH:MM:SS)
+    last_full_sync_at = db.Column(db.DateTime, nullable=True)
+    last_sync_at = db.Column(db.DateTime, nullable=True)
+    last_sync_count = db.Column(db.Integer, default=0)
+    checkpoint = db.Column(db.Text, nullable=True)  # JSON progress of an unfinished pass, for resuming
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<SAPSyncState {self.entity} {self.last_update_date} {self.last_update_time}>'
+
+
+class SAPSyncRun(db.Model):
+    __tablename__ = 'sap_sync_runs'
+    __table_args__ = (
+        # At most one queued/running run across all workers (NULLs don't collide)
+        db.Index('ux_sap_sync_runs_active_slot', 'active_slot', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    trigger = db.Column(db.String(20), nullable=False, default='manual')  # manual, schedule
+    full = db.Column(db.Boolean, nullable=True)  # None = incremental unless a full pass is due
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, success, partial, failed
+    active_slot = db.Column(db.Integer, nullable=True)  # 1 while queued/running, NULL once finished
+    requested_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    worker = db.Column(db.String(100), nullable=True)  # host:pid that executed the run
+    results = db.Column(db.Text, nullable=True)  # JSON: entity -> synced
+    error = db.Column(db.Text, nullable=True)
+    queued_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f'<SAPSyncRun {self.id} {self.status}>'
+
+
+class SAPOutbox(db.Model):
+    """A WMS document waiting to be posted to SAP B1, written in the same
+    transaction as the approval that queues it (see sap_outbox.py)"""
+    __tablename__ = 'sap_outbox'
+    __table_args__ = (
+        db.Index('ix_sap_outbox_document', 'document_type', 'document_id'),
+        db.Index('ix_sap_outbox_status_next', 'status', 'next_attempt_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    document_type = db.Column(db.String(30), nullable=False)  # grn, inventory_transfer
+    document_id = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, processing, posted, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    requested_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    worker = db.Column(db.String(100), nullable=True)  # host:pid of the last attempt
+    sap_doc_entry = db.Column(db.Integer, nullable=True)
+    sap_doc_num = db.Column(db.String(20), nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f'<SAPOutbox {self.id} {self.document_type}:{self.document_id} {self.status}>'
+
+
+class SAPPostingKey(db.Model):
+    """Ledger of SAP postings by idempotency key, so a retry never creates a
+    second SAP document for the same WMS document (see sap_posting_ledger.py)"""
+    __tablename__ = 'sap_posting_keys'
+
+    id = db.Column(db.Integer, primary_key=True)
+    idempotency_key = db.Column(db.String(50), nullable=False, unique=True)  # WMS-GRN-12, WMS-TR-7
+    document_type = db.Column(db.String(30), nullable=False)
+    document_id = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, in_flight, posted, failed, unknown
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_attempt_at = db.Column(db.DateTime, nullable=True)  # when the last POST was sent
+    sap_doc_entry = db.Column(db.Integer, nullable=True)
+    sap_doc_num = db.Column(db.String(20), nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<SAPPostingKey {self.idempotency_key} {self.status}>'
+
+
 class DocumentNumberSeries(db.Model):
     __tablename__ = 'document_number_series'
 
@@ -414,29 +576,19 @@ class DocumentNumberSeries(db.Model):
     @classmethod
     def get_next_number(cls, document_type):
         """Generate next document number for given document type"""
-        series = cls.query.filter_by(document_type=document_type).first()
-        
-        if not series:
-            # Create default series if not exists
-            prefixes = {
-                'GRPO': 'GRPO-',
-                'TRANSFER': 'TR-',
-                'PICKLIST': 'PL-'
-            }
-            series = cls(
-                document_type=document_type,
-                prefix=prefixes.get(document_type, 'DOC-'),
-                current_number=1
-            )
-            db.session.add(series)
-        
+        from number_allocator import DOCUMENT_SERIES, number_allocator
+
+        # Prefixes for series created on first use
+        prefixes = {
+            'GRPO': 'GRPO-',
+            'TRANSFER': 'TR-',
+            'PICKLIST': 'PL-'
+        }
+        number, series = number_allocator.next_value(DOCUMENT_SERIES, document_type, defaults={
+            'prefix': prefixes.get(document_type, 'DOC-'),
+            'year_suffix': True
+        })
+
         # Generate document number
-        year_suffix = datetime.now().strftime('%Y') if series.year_suffix else ''
-        doc_number = f"{series.prefix}{series.current_number:04d}{'-' + year_suffix if year_suffix else ''}"
-        
-        # Increment counter
-        series.current_number += 1
-        series.updated_at = datetime.utcnow()
-        db.session.commit()
-        
-        return doc_number
+        year_suffix = datetime.now().strftime('%Y') if series['year_suffix'] else ''
+        return f"{series['prefix']}{number:04d}{'-' + year_suffix if year_suffix else ''}"
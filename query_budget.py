@@ -0,0 +1,92 @@
+"""
+Query Budget
+============
+
+Counts the SQL statements a block of code or a request issues on the
+current thread, to catch N+1 relationship loading:
+
+    with assert_max_queries(5):
+        client.get('/qc_dashboard')
+
+Views declare their budget with @query_budget(n). A request that goes over
+it is logged as a warning, or fails with QueryBudgetExceeded when
+QUERY_BUDGET_STRICT is on (development and test runs).
+"""
+
+import functools
+import logging
+import threading
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import app
+
+_local = threading.local()
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A block or view issued more SQL statements than its budget"""
+
+
+class QueryCounter:
+    """Statements executed on this thread while the counter is active"""
+
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def report(self):
+        return '\n'.join(f"  {i + 1}. {sql}" for i, sql in enumerate(self.statements))
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    for counter in getattr(_local, 'counters', ()):
+        counter.statements.append(' '.join(statement.split()))
+
+
+@contextmanager
+def count_queries():
+    """Count the SQL statements executed on this thread inside the block"""
+    counter = QueryCounter()
+    counters = getattr(_local, 'counters', None)
+    if counters is None:
+        counters = _local.counters = []
+    counters.append(counter)
+    try:
+        yield counter
+    finally:
+        counters.remove(counter)
+
+
+@contextmanager
+def assert_max_queries(limit):
+    """Fail with QueryBudgetExceeded if the block executes more than limit statements"""
+    with count_queries() as counter:
+        yield counter
+    if counter.count > limit:
+        raise QueryBudgetExceeded(
+            f"{counter.count} queries executed, budget is {limit}:\n{counter.report()}")
+
+
+def query_budget(limit):
+    """Warn (or fail in QUERY_BUDGET_STRICT mode) when a view exceeds limit queries"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            with count_queries() as counter:
+                response = view(*args, **kwargs)
+            if counter.count > limit:
+                message = f"{view.__name__} executed {counter.count} queries, budget is {limit}"
+                if app.config.get('QUERY_BUDGET_STRICT'):
+                    raise QueryBudgetExceeded(f"{message}:\n{counter.report()}")
+                logging.warning(f"⚠️ {message}")
+            return response
+        wrapper.query_budget = limit
+        return wrapper
+    return decorator
@@ -8,12 +8,18 @@ import json
 from app import app, db, login_manager
 from models import User, GRNDocument, GRNItem, InventoryTransfer, InventoryTransferItem, PickList, PickListItem, InventoryCount, InventoryCountItem, BarcodeLabel, BinScanningLog, DocumentNumberSeries
 from sap_integration import SAPIntegration
-from sap_extensions import get_bin_locations, get_batch_details, post_grn_to_sap
+from sap_extensions import get_bin_locations, get_batch_details
+from sap_fields import select_fields
+from keyset_pagination import keyset_page, page_size_arg
+from query_budget import query_budget
+from dashboard_stats import get_dashboard_stats
+from sap_outbox import entry_status, sap_outbox
+from sap_posting_ledger import posting_key
+from sqlalchemy.orm import joinedload, selectinload
 
 # Monkey patch the missing methods to SAPIntegration class
 SAPIntegration.get_bin_locations = lambda self, warehouse_code: get_bin_locations(self, warehouse_code)
 SAPIntegration.get_batch_details = lambda self, item_code: get_batch_details(self, item_code)  
-SAPIntegration.post_grn_to_sap = lambda self, grn_doc: post_grn_to_sap(self, grn_doc)
 
 # BinScanningLog is now imported above
 
@@ -21,6 +27,14 @@ SAPIntegration.post_grn_to_sap = lambda self, grn_doc: post_grn_to_sap(self, grn
 def load_user(user_id):
     return User.query.get(int(user_id))
 
+def _list_page(query, model, cursor_arg='cursor'):
+    """Keyset page of a list view from ?cursor= / ?page_size=; a bad cursor restarts at the newest"""
+    page_size = page_size_arg(request.args.get('page_size'))
+    try:
+        return keyset_page(query, model, request.args.get(cursor_arg), page_size)
+    except ValueError:
+        return keyset_page(query, model, None, page_size)
+
 @app.route('/')
 def index():
     if current_user.is_authenticated:
@@ -77,20 +91,11 @@ def logout():
 
 @app.route('/dashboard')
 @login_required
+@query_budget(1)
 def dashboard():
     try:
-        # Get dashboard statistics
-        grn_count = GRNDocument.query.filter_by(user_id=current_user.id).count()
-        transfer_count = InventoryTransfer.query.filter_by(user_id=current_user.id).count()
-        pick_list_count = PickList.query.filter_by(user_id=current_user.id).count()
-        count_tasks = InventoryCount.query.filter_by(user_id=current_user.id).count()
-        
-        stats = {
-            'grn_count': grn_count,
-            'transfer_count': transfer_count,
-            'pick_list_count': pick_list_count,
-            'count_tasks': count_tasks
-        }
+        # Get dashboard statistics (one query, cached per user)
+        stats = get_dashboard_stats(current_user.id)
     except Exception as e:
         logging.error(f"Database error in dashboard: {e}")
         # Handle database schema mismatch gracefully
@@ -113,7 +118,7 @@ def grn():
         return redirect(url_for('dashboard'))
     
     try:
-        documents = GRNDocument.query.filter_by(user_id=current_user.id).order_by(GRNDocument.created_at.desc()).all()
+        documents = _list_page(GRNDocument.query.filter_by(user_id=current_user.id), GRNDocument)
     except Exception as e:
         logging.error(f"Database error in grn: {e}")
         documents = []
@@ -208,9 +213,12 @@ def create_grn():
 
 @app.route('/grn/<int:grn_id>')
 @login_required
+@query_budget(2)
 def grn_detail(grn_id):
     try:
-        grn_doc = GRNDocument.query.get_or_404(grn_id)
+        grn_doc = GRNDocument.query.options(
+            joinedload(GRNDocument.user), joinedload(GRNDocument.qc_user),
+            selectinload(GRNDocument.items)).get_or_404(grn_id)
         
         # Get PO items from SAP
         sap = SAPIntegration()
@@ -381,9 +389,10 @@ def add_grn_item(grn_id):
     batch_number = request.form.get('batch_number')
     serial_number = request.form.get('serial_number')
     
-    # Get PO line item details if available
+    # Get PO line item details if available - fresh from SAP, since the
+    # quantities below are validated against the open quantity
     sap = SAPIntegration()
-    po_items = sap.get_purchase_order_items(grn_doc.po_number)
+    po_items = sap.get_purchase_order_items(grn_doc.po_number, fresh=True)
     
     # Find matching PO line item
     po_line_item = None
@@ -507,55 +516,24 @@ def approve_grn(grn_id):
         for item in grn_doc.items:
             item.qc_status = 'approved'
         
-        # Always post to SAP B1 when using approve button
-        logging.info("=" * 100)
-        logging.info("🚀 POSTING GRN TO SAP B1 - PURCHASE DELIVERY NOTE CREATION")
-        logging.info("=" * 100)
-        logging.info(f"📋 GRN ID: {grn_doc.id}")
-        logging.info(f"📄 PO Number: {grn_doc.po_number}")
-        logging.info(f"👤 User: {current_user.username}")
-        logging.info(f"🏢 Branch: {current_user.branch_id}")
+        # Approval and the SAP posting request commit together; the outbox
+        # dispatcher posts to SAP B1 and moves the GRN to 'posted'
+        grn_doc.status = 'approved'
+        entry, _ = sap_outbox.enqueue('grn', grn_doc.id, user_id=current_user.id)
+        db.session.commit()
         
-        sap = SAPIntegration()
-        result = sap.post_grn_to_sap(grn_doc)
+        logging.info(f"📮 GRN {grn_doc.id} (PO {grn_doc.po_number}) approved by {current_user.username}, "
+                     f"queued for SAP B1 posting (outbox {entry.id})")
+        success_message = 'GRN approved. Posting to SAP B1 in the background.'
         
-        if result.get('success'):
-            grn_doc.status = 'posted'
-            grn_doc.sap_document_number = result.get('sap_document_number')
-            db.session.commit()
-            
-            logging.info("=" * 100)
-            logging.info("✅ SUCCESS: GRN POSTED TO SAP B1")
-            logging.info(f"📄 SAP Document Number: {result.get('sap_document_number')}")
-            logging.info("=" * 100)
-            
-            success_message = f'GRN approved and posted to SAP B1 successfully! SAP Document Number: {result.get("sap_document_number")}'
-            
-            if request.headers.get('Content-Type') == 'application/json' or request.is_json:
-                return jsonify({
-                    'success': True, 
-                    'message': success_message,
-                    'sap_document_number': result.get('sap_document_number')
-                })
-            flash(success_message, 'success')
-        else:
-            grn_doc.status = 'approved'  # Keep as approved even if SAP posting fails
-            db.session.commit()
-            
-            logging.error("=" * 100)
-            logging.error("❌ FAILED: GRN POSTING TO SAP B1 FAILED")
-            logging.error(f"🚫 Error: {result.get('error')}")
-            logging.error("=" * 100)
-            
-            error_message = f'GRN approved but failed to post to SAP B1: {result.get("error")}'
-            
-            if request.headers.get('Content-Type') == 'application/json' or request.is_json:
-                return jsonify({
-                    'success': False,
-                    'error': error_message,
-                    'grn_approved': True
-                })
-            flash(error_message, 'warning')
+        if request.headers.get('Content-Type') == 'application/json' or request.is_json:
+            return jsonify({
+                'success': True,
+                'message': success_message,
+                'outbox': entry_status(entry),
+                'status_url': url_for('sap_outbox_status', entry_id=entry.id)
+            })
+        flash(success_message, 'success')
     
     except Exception as e:
         logging.error(f"Error approving GRN: {str(e)}")
@@ -687,7 +665,7 @@ def inventory_transfer():
         flash('Access denied. You do not have permission to access Inventory Transfer screen.', 'error')
         return redirect(url_for('dashboard'))
     
-    transfers = InventoryTransfer.query.filter_by(user_id=current_user.id).order_by(InventoryTransfer.created_at.desc()).all()
+    transfers = _list_page(InventoryTransfer.query.filter_by(user_id=current_user.id), InventoryTransfer)
     return render_template('inventory_transfer.html', transfers=transfers)
 
 @app.route('/inventory_transfer/create', methods=['POST'])
@@ -755,8 +733,10 @@ def create_inventory_transfer():
 
 @app.route('/inventory_transfer/<int:transfer_id>', methods=['GET', 'POST'])
 @login_required
+@query_budget(2)
 def inventory_transfer_detail(transfer_id):
-    transfer = InventoryTransfer.query.get_or_404(transfer_id)
+    transfer = InventoryTransfer.query.options(
+        joinedload(InventoryTransfer.user), selectinload(InventoryTransfer.items)).get_or_404(transfer_id)
     
     # Get available items from SAP transfer request (only open lines)
     available_items = []
@@ -791,7 +771,6 @@ def inventory_transfer_detail(transfer_id):
             batch_number = request.form.get('batch_number', '')
             
             # Get item details from SAP B1 to ensure correct UOM
-            sap = SAPIntegration()
             item_details = sap.get_item_details(item_code)
             if item_details:
                 actual_uom = item_details.get('InventoryUoM', unit_of_measure)
@@ -920,29 +899,24 @@ def qc_approve_transfer(transfer_id):
         # Mark individual items as approved
         for item in transfer.items:
             item.qc_status = 'approved'
-            
-        # Submit to SAP B1
-        sap = SAPIntegration()
-        result = sap.create_inventory_transfer(transfer)
-        
-        if result.get('success'):
-            # Update transfer status and SAP document number
-            transfer.status = 'qc_approved'
-            transfer.qc_approver_id = current_user.id
-            transfer.qc_approved_at = datetime.utcnow()
-            transfer.qc_notes = qc_notes
-            transfer.sap_document_number = result.get('document_number')
-            db.session.commit()
-            
-            logging.info(f"✅ Inventory Transfer {transfer_id} QC approved and posted to SAP B1 as document {result.get('document_number')}")
-            return jsonify({
-                'success': True, 
-                'message': f'Transfer QC approved and posted to SAP B1 as document {result.get("document_number")}',
-                'sap_document_number': result.get('document_number')
-            })
-        else:
-            logging.error(f"❌ Failed to post transfer {transfer_id} to SAP B1: {result.get('error')}")
-            return jsonify({'success': False, 'error': result.get('error')}), 500
+        
+        transfer.status = 'qc_approved'
+        transfer.qc_approver_id = current_user.id
+        transfer.qc_approved_at = datetime.utcnow()
+        transfer.qc_notes = qc_notes
+        
+        # Approval and the SAP posting request commit together; the outbox
+        # dispatcher posts the stock transfer and records its SAP number
+        entry, _ = sap_outbox.enqueue('inventory_transfer', transfer.id, user_id=current_user.id)
+        db.session.commit()
+        
+        logging.info(f"📮 Inventory Transfer {transfer_id} QC approved, queued for SAP B1 posting (outbox {entry.id})")
+        return jsonify({
+            'success': True,
+            'message': 'Transfer QC approved. Posting to SAP B1 in the background.',
+            'outbox': entry_status(entry),
+            'status_url': url_for('sap_outbox_status', entry_id=entry.id)
+        })
         
     except Exception as e:
         logging.error(f"Error QC approving transfer: {str(e)}")
@@ -1071,6 +1045,7 @@ def reopen_transfer_additional(transfer_id):
 
 @app.route('/qc_dashboard')
 @login_required
+@query_budget(6)
 def qc_dashboard():
     """QC Dashboard for approving transfers and GRNs"""
     # Check QC permissions
@@ -1079,14 +1054,22 @@ def qc_dashboard():
         return redirect(url_for('dashboard'))
     
     # Get pending transfers for QC approval
-    pending_transfers = InventoryTransfer.query.filter_by(status='submitted').order_by(InventoryTransfer.created_at.desc()).all()
+    # The template shows each document's creator and line count
+    transfers_query = InventoryTransfer.query.filter_by(status='submitted')
+    pending_transfers = _list_page(transfers_query.options(
+        joinedload(InventoryTransfer.user), selectinload(InventoryTransfer.items)),
+        InventoryTransfer, cursor_arg='transfers_cursor')
     
     # Get pending GRNs for QC approval
-    pending_grns = GRNDocument.query.filter_by(status='submitted').order_by(GRNDocument.created_at.desc()).all()
+    grns_query = GRNDocument.query.filter_by(status='submitted')
+    pending_grns = _list_page(grns_query.options(
+        joinedload(GRNDocument.user), selectinload(GRNDocument.items)),
+        GRNDocument, cursor_arg='grns_cursor')
     
     return render_template('qc_dashboard.html', 
                          pending_transfers=pending_transfers,
-                         pending_grns=pending_grns)
+                         pending_grns=pending_grns,
+                         pending_count=transfers_query.count() + grns_query.count())
 
 @app.route('/pick_list')
 @login_required
@@ -1096,13 +1079,16 @@ def pick_list():
         flash('Access denied. You do not have permission to access Pick List screen.', 'error')
         return redirect(url_for('dashboard'))
     
-    pick_lists = PickList.query.filter_by(user_id=current_user.id).order_by(PickList.created_at.desc()).all()
+    pick_lists = _list_page(PickList.query.filter_by(user_id=current_user.id), PickList)
     return render_template('pick_list.html', pick_lists=pick_lists)
 
 @app.route('/pick_list/<int:pick_list_id>')
 @login_required
+@query_budget(2)
 def pick_list_detail(pick_list_id):
-    pick_list = PickList.query.get_or_404(pick_list_id)
+    pick_list = PickList.query.options(
+        joinedload(PickList.user), joinedload(PickList.approver),
+        selectinload(PickList.items)).get_or_404(pick_list_id)
     return render_template('pick_list_detail.html', pick_list=pick_list)
 
 @app.route('/create_pick_list', methods=['POST'])
@@ -1165,13 +1151,15 @@ def inventory_counting():
         flash('Access denied. You do not have permission to access Inventory Counting screen.', 'error')
         return redirect(url_for('dashboard'))
     
-    counts = InventoryCount.query.filter_by(user_id=current_user.id).order_by(InventoryCount.created_at.desc()).all()
+    counts = _list_page(InventoryCount.query.filter_by(user_id=current_user.id), InventoryCount)
     return render_template('inventory_counting.html', counts=counts)
 
 @app.route('/inventory_counting/<int:count_id>')
 @login_required
+@query_budget(2)
 def inventory_counting_detail(count_id):
-    count = InventoryCount.query.get_or_404(count_id)
+    count = InventoryCount.query.options(
+        joinedload(InventoryCount.user), selectinload(InventoryCount.items)).get_or_404(count_id)
     return render_template('inventory_counting_detail.html', count=count)
 
 @app.route('/create_count_task', methods=['POST'])
@@ -1359,7 +1347,7 @@ def print_label():
 @app.route('/barcode_reprint')
 @login_required
 def barcode_reprint():
-    labels = BarcodeLabel.query.order_by(BarcodeLabel.last_printed.desc()).all()
+    labels = _list_page(BarcodeLabel.query, BarcodeLabel)
     return render_template('barcode_reprint.html', labels=labels)
 
 @app.route('/api/reprint_label', methods=['POST'])
@@ -1613,6 +1601,14 @@ def validate_po():
 def validate_item():
     item_code = request.json['item_code']
     
+    # Answer from the local items mirror; only unsynced items go to SAP
+    from item_directory import item_directory
+    local_item = item_directory.lookup(item_code)
+    if local_item:
+        if not local_item['Active']:
+            return jsonify({'valid': False, 'error': 'Item is inactive'})
+        return jsonify({'valid': True, 'item_data': local_item})
+    
     sap = SAPIntegration()
     item_data = sap.get_item_master(item_code)
     
@@ -1621,6 +1617,15 @@ def validate_item():
     else:
         return jsonify({'valid': False, 'error': 'Item not found'})
 
+@app.route('/api/items/search', methods=['GET'])
+@login_required
+def search_items():
+    """Item code prefix / name search over the local items mirror"""
+    from item_directory import item_directory
+    query = request.args.get('q', '')
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    return jsonify({'items': item_directory.search(query, limit=limit)})
+
 @app.route('/api/get_bins', methods=['GET'])
 @login_required
 def get_bins():
@@ -1660,20 +1665,15 @@ def scan_po():
 @app.route('/api/scan_barcode', methods=['POST'])
 @login_required  
 def scan_barcode():
-    """API endpoint for supplier barcode scanning"""
+    """API endpoint for barcode scanning - resolves any known barcode to item, batch and origin document"""
+    from barcode_resolver import resolve
     barcode = request.json.get('barcode')
     
-    # This would integrate with a barcode lookup service or database
-    # For now, return mock data
-    return jsonify({
-        'success': True,
-        'item_data': {
-            'item_code': 'ITM001',
-            'batch_number': 'BTH2025001',
-            'expiration_date': '2025-12-31',
-            'serial_number': barcode
-        }
-    })
+    resolved = resolve(barcode)
+    if not resolved:
+        return jsonify({'success': False, 'error': f'Unknown barcode {barcode}'})
+    
+    return jsonify({'success': True, 'item_data': resolved})
 
 # Duplicate generate_barcode_api route removed to prevent conflicts
 
@@ -1741,30 +1741,20 @@ def post_grn_to_sap_manual(grn_id):
             flash(f'GRN already posted to SAP B1 as document {grn_doc.sap_document_number}.', 'warning')
             return redirect(url_for('grn_detail', grn_id=grn_id))
         
-        # Post to SAP B1
-        logging.info("=" * 100)
-        logging.info("🔄 MANUAL POSTING GRN TO SAP B1")
-        logging.info("=" * 100)
-        logging.info(f"📋 GRN ID: {grn_doc.id}")
-        logging.info(f"📄 PO Number: {grn_doc.po_number}")
-        logging.info(f"👤 Manual Post User: {current_user.username}")
-        
-        sap = SAPIntegration()
-        result = sap.post_grn_to_sap(grn_doc)
-        
-        if result.get('success'):
-            logging.info("=" * 100)
-            logging.info("✅ SUCCESS: MANUAL GRN POSTED TO SAP B1")
-            logging.info(f"📄 SAP Document Number: {result.get('sap_document_number')}")
-            logging.info("=" * 100)
-            flash(f'GRN successfully posted to SAP B1 as Goods Received Note {result.get("sap_document_number")}.', 'success')
-        else:
-            logging.error("=" * 100)
-            logging.error("❌ FAILED: MANUAL GRN POSTING TO SAP B1 FAILED")
-            logging.error(f"🚫 Error: {result.get('error')}")
-            logging.error("=" * 100)
-            flash(f'Error posting GRN to SAP B1: {result.get("error")}', 'error')
+        # Post through the outbox like QC approval, so the PDN carries the
+        # GRN's idempotency key and is never sent alongside a queued posting
+        entry, queued = sap_outbox.enqueue('grn', grn_doc.id, user_id=current_user.id)
+        if not queued:
+            if entry.status == 'posted':
+                flash(f'GRN already posted to SAP B1 as document {entry.sap_doc_num}.', 'warning')
+            else:
+                flash(f'GRN is already {entry.status} for SAP B1 posting (outbox {entry.id}).', 'info')
+            return redirect(url_for('grn_detail', grn_id=grn_id))
+        db.session.commit()
         
+        logging.info(f"📮 GRN {grn_doc.id} manually queued for SAP B1 posting by {current_user.username} "
+                     f"(outbox {entry.id})")
+        flash('GRN queued for posting to SAP B1. The posting status updates on this page.', 'success')
         return redirect(url_for('grn_detail', grn_id=grn_id))
         
     except Exception as e:
@@ -1917,27 +1907,184 @@ def get_bins_api():
 @app.route('/sync-sap-data', methods=['POST'])
 @login_required
 def sync_sap_data():
-    """Sync master data from SAP B1"""
+    """Queue a master data sync from SAP B1 for the background scheduler"""
     if current_user.role not in ['admin', 'manager']:
         flash('You do not have permission to sync SAP data', 'error')
         return redirect(url_for('dashboard'))
     
-    from sap_integration import SAPIntegration
-    sap_integration = SAPIntegration()
-    results = sap_integration.sync_all_master_data()
-    
-    success_count = sum(1 for result in results.values() if result)
-    total_count = len(results)
+    from sync_scheduler import sync_scheduler
+    # mode=full forces a full reconciliation instead of an incremental sync
+    full = True if request.values.get('mode') == 'full' else None
+    run, queued = sync_scheduler.enqueue(trigger='manual', full=full, user_id=current_user.id)
     
-    if success_count == total_count:
-        flash(f'SAP master data synchronized successfully! ({success_count}/{total_count} completed)', 'success')
-    elif success_count > 0:
-        flash(f'SAP master data partially synchronized ({success_count}/{total_count} completed)', 'warning')
+    if queued:
+        flash(f'SAP master data sync queued (run #{run.id}). It runs in the background.', 'success')
     else:
-        flash('Failed to synchronize SAP master data. Check SAP connection.', 'error')
+        flash(f'An SAP master data sync is already {run.status} (run #{run.id}).', 'info')
     
     return redirect(url_for('dashboard'))
 
+@app.route('/api/dashboard/stats')
+@login_required
+def api_dashboard_stats():
+    """Current user's document counts; ?breakdown=1 adds counts per status"""
+    breakdown = request.args.get('breakdown', '').lower() in ('1', 'true', 'yes')
+    return jsonify({'success': True, **get_dashboard_stats(current_user.id, breakdown=breakdown)})
+
+# Outbox document_type -> WMS document model, for the status permission check
+OUTBOX_DOCUMENTS = {
+    'grn': GRNDocument,
+    'inventory_transfer': InventoryTransfer
+}
+
+def _can_view_sap_posting(document_type, document_id):
+    """QC users, admins and managers see every posting; other users only their own documents'"""
+    if current_user.role in ['admin', 'manager'] or current_user.has_permission('qc_dashboard'):
+        return True
+    document = db.session.get(OUTBOX_DOCUMENTS[document_type], document_id)
+    return document is not None and document.user_id == current_user.id
+
+@app.route('/api/sap/outbox/<int:entry_id>')
+@login_required
+def sap_outbox_status(entry_id):
+    """Status of one SAP posting request, for the UI to poll"""
+    from models import SAPOutbox
+    entry = SAPOutbox.query.get_or_404(entry_id)
+    if not _can_view_sap_posting(entry.document_type, entry.document_id):
+        return jsonify({'success': False, 'error': 'Access denied'}), 403
+    return jsonify({'success': True, 'outbox': entry_status(entry)})
+
+@app.route('/api/sap/outbox/<document_type>/<int:document_id>')
+@login_required
+def sap_outbox_document_status(document_type, document_id):
+    """Latest SAP posting request for a WMS document; outbox is null if it was never queued"""
+    from models import SAPOutbox
+    if document_type not in OUTBOX_DOCUMENTS:
+        return jsonify({'success': False, 'error': f'Unknown document type: {document_type}'}), 404
+    if not _can_view_sap_posting(document_type, document_id):
+        return jsonify({'success': False, 'error': 'Access denied'}), 403
+    entry = SAPOutbox.query.filter_by(document_type=document_type, document_id=document_id).order_by(
+        SAPOutbox.id.desc()).first()
+    return jsonify({'success': True, 'outbox': entry_status(entry) if entry else None})
+
+@app.route('/api/sap/outbox/<int:entry_id>/retry', methods=['POST'])
+@login_required
+def sap_outbox_retry(entry_id):
+    """Re-queue a failed SAP posting"""
+    if current_user.role not in ['admin', 'manager']:
+        return jsonify({'success': False, 'error': 'Access denied'}), 403
+    if not sap_outbox.retry(entry_id):
+        return jsonify({'success': False, 'error': 'Only failed postings can be retried'}), 400
+    return jsonify({'success': True, 'message': 'Posting re-queued'})
+
+@app.route('/api/sap/sync_status')
+@login_required
+def sap_sync_status():
+    """Scheduler status, recent sync runs and per-entity sync metrics"""
+    if current_user.role not in ['admin', 'manager']:
+        return jsonify({'success': False, 'error': 'Access denied'}), 403
+
+    from sync_scheduler import sync_scheduler
+    return jsonify({'success': True, **sync_scheduler.status()})
+
+@app.route('/api/sap/cache_stats')
+@login_required
+def sap_cache_stats():
+    """Hit/miss counters for the SAP caches and coalesced reads in this worker"""
+    if current_user.role not in ['admin', 'manager']:
+        return jsonify({'success': False, 'error': 'Access denied'}), 403
+    
+    from sap_cache import cache_stats
+    from sap_integration import in_flight_reads
+    return jsonify({'success': True, 'caches': cache_stats(),
+                    'coalesced_reads': in_flight_reads.stats()})
+
+# Keyset-paginated list APIs: ?cursor=<next_cursor>&page_size=<n>
+
+LIST_FIELDS = {
+    GRNDocument: ['id', 'po_number', 'sap_document_number', 'supplier_code', 'supplier_name',
+                  'status', 'user_id', 'created_at'],
+    InventoryTransfer: ['id', 'transfer_request_number', 'sap_document_number', 'status',
+                        'from_warehouse', 'to_warehouse', 'user_id', 'created_at'],
+    PickList: ['id', 'pick_list_number', 'sales_order_number', 'status', 'user_id', 'created_at'],
+    InventoryCount: ['id', 'count_number', 'warehouse_code', 'bin_location', 'status',
+                     'user_id', 'created_at'],
+    BarcodeLabel: ['id', 'item_code', 'barcode', 'label_format', 'print_count', 'last_printed',
+                   'created_at']
+}
+
+def _page_json(query, model):
+    """JSON page of query rows with the cursor for the next page"""
+    try:
+        page = keyset_page(query, model, request.args.get('cursor'),
+                           page_size_arg(request.args.get('page_size')))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    items = []
+    for row in page:
+        item = {}
+        for field in LIST_FIELDS[model]:
+            value = getattr(row, field)
+            item[field] = value.isoformat() if isinstance(value, datetime) else value
+        items.append(item)
+    return jsonify({'success': True, 'items': items, 'page_size': page.page_size,
+                    'next_cursor': page.next_cursor, 'has_more': page.has_more})
+
+@app.route('/api/grn_documents')
+@login_required
+def api_grn_documents():
+    """Current user's GRN documents, newest first"""
+    if not current_user.has_permission('grn'):
+        return jsonify({'success': False, 'error': 'Access denied'}), 403
+    return _page_json(GRNDocument.query.filter_by(user_id=current_user.id), GRNDocument)
+
+@app.route('/api/inventory_transfers')
+@login_required
+def api_inventory_transfers():
+    """Current user's inventory transfers, newest first"""
+    if not current_user.has_permission('inventory_transfer'):
+        return jsonify({'success': False, 'error': 'Access denied'}), 403
+    return _page_json(InventoryTransfer.query.filter_by(user_id=current_user.id), InventoryTransfer)
+
+@app.route('/api/pick_lists')
+@login_required
+def api_pick_lists():
+    """Current user's pick lists, newest first"""
+    if not current_user.has_permission('pick_list'):
+        return jsonify({'success': False, 'error': 'Access denied'}), 403
+    return _page_json(PickList.query.filter_by(user_id=current_user.id), PickList)
+
+@app.route('/api/inventory_counts')
+@login_required
+def api_inventory_counts():
+    """Current user's inventory counts, newest first"""
+    if not current_user.has_permission('inventory_counting'):
+        return jsonify({'success': False, 'error': 'Access denied'}), 403
+    return _page_json(InventoryCount.query.filter_by(user_id=current_user.id), InventoryCount)
+
+@app.route('/api/qc/pending_grns')
+@login_required
+def api_qc_pending_grns():
+    """Submitted GRNs awaiting QC, newest first"""
+    if not current_user.has_permission('qc_dashboard') and current_user.role not in ['admin', 'manager']:
+        return jsonify({'success': False, 'error': 'Access denied'}), 403
+    return _page_json(GRNDocument.query.filter_by(status='submitted'), GRNDocument)
+
+@app.route('/api/qc/pending_transfers')
+@login_required
+def api_qc_pending_transfers():
+    """Submitted inventory transfers awaiting QC, newest first"""
+    if not current_user.has_permission('qc_dashboard') and current_user.role not in ['admin', 'manager']:
+        return jsonify({'success': False, 'error': 'Access denied'}), 403
+    return _page_json(InventoryTransfer.query.filter_by(status='submitted'), InventoryTransfer)
+
+@app.route('/api/barcode_labels')
+@login_required
+def api_barcode_labels():
+    """Printed barcode labels, newest first"""
+    return _page_json(BarcodeLabel.query, BarcodeLabel)
+
 # Duplicate route removed - using the one defined earlier
 
 # Default admin user is created in app.py during initialization
@@ -1971,8 +2118,8 @@ def preview_grn_json(grn_id):
         if 'T' in doc_due_date:
             doc_due_date = doc_due_date.split('T')[0]
         
-        # Generate external reference
-        external_ref = sap.generate_external_reference_number(grn_doc)
+        # External reference is the GRN's idempotency key, as posted
+        external_ref = posting_key('grn', grn_doc.id)
         
         # Get BusinessPlaceID from PO DocumentLines instead of bin location
         first_warehouse_code = None
@@ -2133,25 +2280,17 @@ def api_get_warehouse_bins(warehouse_code):
             # Use real SAP B1 API
             url = f"{sap.base_url}/b1s/v1/BinLocations"
             params = {
-                "$filter": f"Warehouse eq '{warehouse_code}'"
+                "$filter": f"Warehouse eq '{warehouse_code}'",
+                "$select": select_fields('BinLocations')
             }
             
-            response = sap.session.get(url, params=params)
-            
-            if response.status_code == 200:
-                data = response.json()
-                bin_locations = data.get("value", [])
-                
-                bins = []
-                for bin_loc in bin_locations:
-                    bins.append({
-                        "BinCode": bin_loc.get("BinCode"),
-                        "Description": bin_loc.get("Description") or "",
-                        "AbsEntry": bin_loc.get("AbsEntry")
-                    })
-            else:
-                logging.error(f"Failed to get bins for warehouse {warehouse_code}: {response.status_code}")
-                bins = []
+            bins = []
+            for bin_loc in sap.iter_collection(url, params=params):
+                bins.append({
+                    "BinCode": bin_loc.get("BinCode"),
+                    "Description": bin_loc.get("Description") or "",
+                    "AbsEntry": bin_loc.get("AbsEntry")
+                })
         
         return jsonify({
             "success": True,
@@ -2198,7 +2337,7 @@ def api_get_warehouse_batches(warehouse_code):
                     "$top": 50  # Limit results for performance
                 }
             
-            response = sap.session.get(url, params=params)
+            response = sap.get(url, params=params)
             
             if response.status_code == 200:
                 data = response.json()
@@ -2258,30 +2397,21 @@ def get_item_batches(item_code):
                 "$filter": f"ItemCode eq '{item_code}'"
             }
             
-            response = sap.session.get(url, params=params)
-            
-            if response.status_code == 200:
-                data = response.json()
-                batch_details = data.get("value", [])
+            batches = []
+            for batch in sap.iter_collection(url, params=params):
+                expiration_date = batch.get("ExpirationDate", "")
+                if expiration_date and "T" in expiration_date:
+                    # Convert SAP date format to simple date
+                    expiration_date = expiration_date.split("T")[0]
                 
-                batches = []
-                for batch in batch_details:
-                    expiration_date = batch.get("ExpirationDate", "")
-                    if expiration_date and "T" in expiration_date:
-                        # Convert SAP date format to simple date
-                        expiration_date = expiration_date.split("T")[0]
-                    
-                    batches.append({
-                        "Batch": batch.get("Batch"),
-                        "ItemCode": batch.get("ItemCode"),
-                        "ItemDescription": batch.get("ItemDescription", ""),
-                        "ExpirationDate": expiration_date,
-                        "Status": batch.get("Status", ""),
-                        "SystemNumber": batch.get("SystemNumber")
-                    })
-            else:
-                logging.error(f"Failed to get batches for item {item_code}: {response.status_code}")
-                batches = []
+                batches.append({
+                    "Batch": batch.get("Batch"),
+                    "ItemCode": batch.get("ItemCode"),
+                    "ItemDescription": batch.get("ItemDescription", ""),
+                    "ExpirationDate": expiration_date,
+                    "Status": batch.get("Status", ""),
+                    "SystemNumber": batch.get("SystemNumber")
+                })
         
         return jsonify({
             "success": True,
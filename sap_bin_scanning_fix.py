@@ -2,15 +2,22 @@
 Enhanced SAP B1 Bin Scanning Integration
 Fix for get_bin_items function with proper OnStock/OnHand API calls
 """
+import logging
+
+from bin_directory import bin_directory
+from sap_fields import select_fields
+
 
 def get_bin_items_enhanced(self, bin_code):
     """Get items in a specific bin location with OnStock/OnHand details
     
     Uses the exact API pattern provided by user:
-    1. BinLocations API to get bin info
+    1. BinLocations API to get bin info (skipped for bins in the local directory)
     2. Warehouses API to get warehouse details
     3. BatchNumberDetails API to get batch items
     4. ItemWhsStock API to get OnHand/OnStock quantities
+
+    Steps 2+3 and all step-4 lookups each go out as one $batch call.
     """
     if not self.ensure_logged_in():
         # Return mock data for offline mode
@@ -46,31 +53,41 @@ def get_bin_items_enhanced(self, bin_code):
         }]
 
     try:
-        # Step 1: Get bin information using provided API pattern
-        bin_info_url = f"{self.base_url}/b1s/v1/BinLocations?$filter=BinCode eq '{bin_code}'"
-        logging.info(f"🔍 Getting bin info: {bin_info_url}")
-        
-        bin_response = self.session.get(bin_info_url)
-        if bin_response.status_code != 200:
-            logging.warning(f"Bin {bin_code} not found in SAP B1")
-            return []
+        # Step 1: Get bin information - local bin directory first, then the
+        # BinLocations API pattern provided for bins not synced yet
+        local_bin = bin_directory.lookup(bin_code)
+        if local_bin:
+            warehouse_code = local_bin['Warehouse']
+            abs_entry = local_bin['AbsEntry']
+        else:
+            bin_info_url = f"{self.base_url}/b1s/v1/BinLocations?$filter=BinCode eq '{bin_code}'&$select={select_fields('BinLocations')}"
+            logging.info(f"🔍 Getting bin info: {bin_info_url}")
 
-        bin_data = bin_response.json().get('value', [])
-        if not bin_data:
-            logging.warning(f"Bin {bin_code} does not exist")
-            return []
+            bin_response = self.get(bin_info_url)
+            if bin_response.status_code != 200:
+                logging.warning(f"Bin {bin_code} not found in SAP B1")
+                return []
 
-        bin_info = bin_data[0]
-        warehouse_code = bin_info.get('Warehouse', '')
-        abs_entry = bin_info.get('AbsEntry', 0)
+            bin_data = bin_response.json().get('value', [])
+            if not bin_data:
+                logging.warning(f"Bin {bin_code} does not exist")
+                return []
+
+            bin_info = bin_data[0]
+            warehouse_code = bin_info.get('Warehouse', '')
+            abs_entry = bin_info.get('AbsEntry', 0)
+            bin_directory.remember(bin_code, abs_entry, warehouse_code,
+                                   bin_info.get('Inactive') != 'Y')
         
         logging.info(f"✅ Found bin {bin_code} in warehouse {warehouse_code} (AbsEntry: {abs_entry})")
 
-        # Step 2: Get warehouse details using provided API pattern
+        # Steps 2 + 3: warehouse details and batch details in one $batch round trip
+        # Use the AbsEntry from bin info as SystemNumber for the batch lookup
         warehouse_url = f"{self.base_url}/b1s/v1/Warehouses?$select=BusinessPlaceID,WarehouseCode,DefaultBin&$filter=WarehouseCode eq '{warehouse_code}'"
-        logging.info(f"🔍 Getting warehouse info: {warehouse_url}")
-        
-        warehouse_response = self.session.get(warehouse_url)
+        batch_url = f"{self.base_url}/b1s/v1/BatchNumberDetails?$filter=SystemNumber eq {abs_entry}"
+        logging.info(f"🔍 Getting warehouse info and batch details: {warehouse_url} | {batch_url}")
+
+        warehouse_response, batch_response = self.batch_get([warehouse_url, batch_url])
         if warehouse_response.status_code != 200:
             logging.error(f"Failed to get warehouse info: {warehouse_response.status_code}")
             return []
@@ -86,76 +103,79 @@ def get_bin_items_enhanced(self, bin_code):
         
         logging.info(f"✅ Warehouse {warehouse_code} - BusinessPlaceID: {business_place_id}, DefaultBin: {default_bin}")
 
-        # Step 3: Get batch details using provided API pattern
-        # Use the AbsEntry from bin info as SystemNumber
-        batch_url = f"{self.base_url}/b1s/v1/BatchNumberDetails?$filter=SystemNumber eq {abs_entry}"
-        logging.info(f"🔍 Getting batch details: {batch_url}")
-        
-        batch_response = self.session.get(batch_url)
         if batch_response.status_code != 200:
             logging.warning(f"No batch data found for SystemNumber {abs_entry}")
             # Try alternative approach with DefaultBin
             batch_url = f"{self.base_url}/b1s/v1/BatchNumberDetails?$filter=SystemNumber eq {default_bin}"
             logging.info(f"🔍 Trying alternative batch lookup: {batch_url}")
-            batch_response = self.session.get(batch_url)
+            batch_response = self.get(batch_url)
 
         formatted_items = []
         
         if batch_response.status_code == 200:
-            batch_data = batch_response.json().get('value', [])
+            batch_data = [batch_item for batch_item in batch_response.json().get('value', [])
+                          if batch_item.get('ItemCode')]
             logging.info(f"📦 Found {len(batch_data)} batch items")
-            
-            for batch_item in batch_data:
-                item_code = batch_item.get('ItemCode', '')
-                if not item_code:
-                    continue
-                    
-                # Step 4: Get OnHand/OnStock quantities for each item
-                # Using ItemWhsStock API to get warehouse-specific stock levels
-                stock_url = f"{self.base_url}/b1s/v1/ItemWhsStock?$filter=ItemCode eq '{item_code}' and WarehouseCode eq '{warehouse_code}'"
+
+            # Step 4: OnHand/OnStock (ItemWhsStock) and item master data (UoM, name)
+            # for every distinct item, all packed into a single $batch call
+            item_codes = list(dict.fromkeys(batch_item['ItemCode'] for batch_item in batch_data))
+            lookups = []
+            for item_code in item_codes:
+                lookups.append(f"{self.base_url}/b1s/v1/ItemWhsStock?$filter=ItemCode eq '{item_code}' and WarehouseCode eq '{warehouse_code}'")
+                lookups.append(f"{self.base_url}/b1s/v1/Items('{item_code}')?$select=ItemCode,ItemName,InventoryUOM")
+
+            try:
+                responses = self.batch_get(lookups)
+            except Exception as e:
+                logging.error(f"Error getting stock data for bin {bin_code}: {e}")
+                responses = []
+
+            item_details = {}
+            for index, item_code in enumerate(item_codes[:len(responses) // 2]):
+                stock_response = responses[2 * index]
+                item_response = responses[2 * index + 1]
                 try:
-                    stock_response = self.session.get(stock_url)
-                    on_hand = 0.0
-                    on_stock = 0.0
-                    uom = 'EA'
-                    
+                    details = {'OnHand': 0.0, 'OnStock': 0.0, 'UoM': 'EA', 'ItemName': None}
+
                     if stock_response.status_code == 200:
                         stock_data = stock_response.json().get('value', [])
                         if stock_data:
                             stock_info = stock_data[0]
-                            on_hand = float(stock_info.get('OnHand', 0.0))
-                            on_stock = float(stock_info.get('OnStock', 0.0))
-                            
-                    # Get item master data for UoM and updated name
-                    item_url = f"{self.base_url}/b1s/v1/Items('{item_code}')?$select=ItemCode,ItemName,InventoryUOM"
-                    item_response = self.session.get(item_url)
-                    item_name = batch_item.get('ItemDescription', '')
-                    
+                            details['OnHand'] = float(stock_info.get('OnHand', 0.0))
+                            details['OnStock'] = float(stock_info.get('OnStock', 0.0))
+
                     if item_response.status_code == 200:
                         item_data = item_response.json()
-                        item_name = item_data.get('ItemName', item_name)
-                        uom = item_data.get('InventoryUOM', 'EA')
-                    
-                    formatted_items.append({
-                        'ItemCode': item_code,
-                        'ItemName': item_name,
-                        'OnHand': on_hand,
-                        'OnStock': on_stock,
-                        'UoM': uom,
-                        'BatchNumber': batch_item.get('Batch', ''),
-                        'ExpiryDate': batch_item.get('ExpirationDate', ''),
-                        'AdmissionDate': batch_item.get('AdmissionDate', ''),
-                        'ManufacturingDate': batch_item.get('ManufacturingDate', ''),
-                        'Status': batch_item.get('Status', ''),
-                        'Warehouse': warehouse_code,
-                        'BinCode': bin_code,
-                        'BinAbsEntry': abs_entry,
-                        'BusinessPlaceID': business_place_id
-                    })
-                    
+                        details['ItemName'] = item_data.get('ItemName')
+                        details['UoM'] = item_data.get('InventoryUOM', 'EA')
+
+                    item_details[item_code] = details
                 except Exception as e:
                     logging.error(f"Error getting stock data for item {item_code}: {e}")
+
+            for batch_item in batch_data:
+                item_code = batch_item['ItemCode']
+                details = item_details.get(item_code)
+                if details is None:
                     continue
+
+                formatted_items.append({
+                    'ItemCode': item_code,
+                    'ItemName': details['ItemName'] or batch_item.get('ItemDescription', ''),
+                    'OnHand': details['OnHand'],
+                    'OnStock': details['OnStock'],
+                    'UoM': details['UoM'],
+                    'BatchNumber': batch_item.get('Batch', ''),
+                    'ExpiryDate': batch_item.get('ExpirationDate', ''),
+                    'AdmissionDate': batch_item.get('AdmissionDate', ''),
+                    'ManufacturingDate': batch_item.get('ManufacturingDate', ''),
+                    'Status': batch_item.get('Status', ''),
+                    'Warehouse': warehouse_code,
+                    'BinCode': bin_code,
+                    'BinAbsEntry': abs_entry,
+                    'BusinessPlaceID': business_place_id
+                })
         else:
             logging.warning(f"No batch data found for bin {bin_code}")
 
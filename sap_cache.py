@@ -0,0 +1,257 @@
+"""
+SAP B1 Master Data Cache
+========================
+
+Process-level TTL + LRU caches for SAP master data lookups. SAPIntegration
+is instantiated per request, so anything cached on the instance is lost at
+the end of the request; these caches live for the lifetime of the worker.
+
+Optionally a shared backend (a SQLite file or a Redis server) sits behind
+the in-memory caches, so every gunicorn worker reuses one SAP fetch per key
+and freshly started workers begin warm.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Per-entity settings: (time-to-live in seconds, maximum number of keys)
+CACHE_SETTINGS = {
+    'warehouses': (3600, 16),
+    'business_place_ids': (3600, 256),
+    'bins': (900, 512),
+    'items': (900, 5000),
+    'purchase_orders': (120, 500),
+    'batches': (60, 1000),
+    'dashboard_stats': (60, 2000)  # per-user document counts, see dashboard_stats.py
+}
+
+
+class SQLiteCacheBackend:
+    """Shared cache in a local SQLite file, for workers on the same host"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        # One connection per thread and process - sqlite3 connections must
+        # not cross threads or survive a fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sap_cache (
+                    namespace TEXT NOT NULL,
+                    cache_key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, cache_key)
+                )
+            """)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, namespace, key):
+        row = self._connection().execute(
+            "SELECT value, expires_at FROM sap_cache WHERE namespace = ? AND cache_key = ?",
+            (namespace, key)).fetchone()
+        if row is None or row[1] <= time.time():
+            return None, None
+        return row[0], row[1]
+
+    def set(self, namespace, key, value, ttl):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO sap_cache (namespace, cache_key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (namespace, key, value, time.time() + ttl))
+
+    def delete(self, namespace, key=None):
+        if key is None:
+            self._connection().execute(
+                "DELETE FROM sap_cache WHERE namespace = ? OR expires_at <= ?",
+                (namespace, time.time()))
+        else:
+            self._connection().execute(
+                "DELETE FROM sap_cache WHERE namespace = ? AND cache_key = ?",
+                (namespace, key))
+
+
+class RedisCacheBackend:
+    """Shared cache on a Redis-compatible server, for workers on any host"""
+
+    PREFIX = 'wms:sap_cache:'
+
+    def __init__(self, url):
+        import redis  # Optional dependency, only needed for this backend
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, namespace, key):
+        name = f"{self.PREFIX}{namespace}:{key}"
+        with self.client.pipeline() as pipe:
+            value, ttl_ms = pipe.get(name).pttl(name).execute()
+        if value is None:
+            return None, None
+        return value.decode('utf-8'), time.time() + max(ttl_ms, 0) / 1000
+
+    def set(self, namespace, key, value, ttl):
+        self.client.set(f"{self.PREFIX}{namespace}:{key}", value, px=int(ttl * 1000))
+
+    def delete(self, namespace, key=None):
+        if key is not None:
+            self.client.delete(f"{self.PREFIX}{namespace}:{key}")
+            return
+        names = list(self.client.scan_iter(match=f"{self.PREFIX}{namespace}:*"))
+        if names:
+            self.client.delete(*names)
+
+
+# Shared backend behind the in-memory caches (None = memory only)
+_backend = None
+
+# With a shared backend, how long a worker may keep serving its in-memory
+# copy before re-reading the backend (bounds staleness after invalidation)
+_l1_ttl = None
+
+
+def configure_backend(kind='memory', url=None, l1_ttl=30):
+    """Select the shared cache backend: 'memory', 'sqlite' (url = file path) or 'redis'"""
+    global _backend, _l1_ttl
+    try:
+        if kind == 'sqlite':
+            _backend = SQLiteCacheBackend(url or 'sap_cache.db')
+        elif kind == 'redis':
+            _backend = RedisCacheBackend(url or 'redis://localhost:6379/0')
+        else:
+            _backend = None
+    except Exception as e:
+        logging.warning(
+            f"SAP cache backend '{kind}' unavailable ({e}), using in-memory cache only")
+        _backend = None
+    _l1_ttl = l1_ttl if _backend is not None else None
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after a fixed TTL"""
+
+    def __init__(self, name, ttl, max_size):
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the cached value for key, or None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+
+        value = self._backend_get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.shared_hits += 1
+        return value
+
+    def set(self, key, value):
+        """Store a value, evicting the least recently used keys when full"""
+        self._store(key, value, self.ttl)
+        if _backend is not None:
+            try:
+                _backend.set(self.name, json.dumps(key), json.dumps(value), self.ttl)
+            except Exception as e:
+                logging.warning(f"SAP cache backend write failed: {e}")
+
+    def invalidate(self, key=None):
+        """Drop one key, or every key when none is given"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+        if _backend is not None:
+            try:
+                _backend.delete(self.name, None if key is None else json.dumps(key))
+            except Exception as e:
+                logging.warning(f"SAP cache backend invalidation failed: {e}")
+
+    def _store(self, key, value, ttl):
+        if _l1_ttl is not None:
+            ttl = min(ttl, _l1_ttl)
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _backend_get(self, key):
+        """Read a key another worker may have fetched, copying it into memory"""
+        if _backend is None:
+            return None
+        try:
+            raw, expires_at = _backend.get(self.name, json.dumps(key))
+        except Exception as e:
+            logging.warning(f"SAP cache backend read failed: {e}")
+            return None
+        if raw is None:
+            return None
+        value = json.loads(raw)
+        self._store(key, value, max(expires_at - time.time(), 0))
+        return value
+
+    def stats(self):
+        """Cache counters for diagnostics"""
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(name):
+    """Get the process-wide cache for one kind of SAP master data"""
+    with _caches_lock:
+        cache = _caches.get(name)
+        if cache is None:
+            ttl, max_size = CACHE_SETTINGS[name]
+            cache = TTLCache(name, ttl, max_size)
+            _caches[name] = cache
+        return cache
+
+
+def invalidate(name, key=None):
+    """Invalidation hook - call after SAP data of this kind changes or is re-synced"""
+    get_cache(name).invalidate(key)
+
+
+def cache_stats():
+    """Counters for every cache created in this worker"""
+    with _caches_lock:
+        caches = list(_caches.values())
+    return {cache.name: cache.stats() for cache in caches}
@@ -0,0 +1,56 @@
+"""
+SAP B1 Service Layer Field Registry
+===================================
+
+The entity properties each SAPIntegration read actually consumes, so GETs
+can send $select instead of pulling whole entities (Items alone carries
+hundreds of properties plus price list and warehouse info arrays).
+
+Add a property here before reading it from a response - anything not
+listed is not returned by SAP.
+"""
+
+SELECT_FIELDS = {
+    # get_purchase_order - GRN creation, validation and GRPO posting
+    'PurchaseOrders': [
+        'DocEntry', 'DocNum', 'CardCode', 'CardName', 'DocDate',
+        'DocDueDate', 'DocTotal', 'DocumentStatus', 'DocumentLines'
+    ],
+    # get_item_details / get_item_master, sync_items
+    'Items': [
+        'ItemCode', 'ItemName', 'ItemsGroupCode', 'ItemType', 'SalesUnit',
+        'InventoryUOM', 'UoMGroupEntry', 'DefaultWarehouse',
+        'ManageBatchNumbers', 'ManageSerialNumbers', 'QuantityOnStock',
+        'MinInventory', 'BarCode', 'Valid'
+    ],
+    # get_bins, get_available_bins, get_warehouse_bins, sync_bins, bin lookups
+    'BinLocations': [
+        'AbsEntry', 'BinCode', 'Warehouse', 'Description', 'Inactive'
+    ],
+    # get_warehouses, sync_warehouses
+    'Warehouses': [
+        'WarehouseCode', 'WarehouseName', 'Street', 'Inactive', 'DefaultBin',
+        'BusinessPlaceID'
+    ],
+    # sync_business_partners
+    'BusinessPartners': [
+        'CardCode', 'CardName', 'CardType', 'Phone1', 'EmailAddress',
+        'Address', 'Valid'
+    ]
+}
+
+# Change-tracking properties used by incremental syncs: (date, time or None).
+# Only selected by the sync reads, which need them to advance the high-water mark
+DELTA_FIELDS = {
+    'BinLocations': ('UpdateDate', None),
+    'Items': ('UpdateDate', 'UpdateTime'),
+    'BusinessPartners': ('UpdateDate', 'UpdateTime')
+}
+
+
+def select_fields(entity, with_delta=False):
+    """Comma-separated $select value for reading the given entity"""
+    fields = list(SELECT_FIELDS[entity])
+    if with_delta:
+        fields.extend(f for f in DELTA_FIELDS.get(entity, ()) if f)
+    return ','.join(fields)
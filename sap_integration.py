@@ -1,1735 +1,120 @@
+import copy
 import requests
 import json
 import logging
-from datetime import datetime
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urljoin, urlsplit
+from flask import g, has_app_context, has_request_context
 from app import app
+from barcode_resolver import index_item_barcodes
+from bin_directory import bin_directory
+from bulk_upsert import bulk_upsert
+from item_directory import item_directory
+from sap_cache import configure_backend, get_cache, invalidate
+from sap_fields import DELTA_FIELDS, select_fields
+from sap_posting_ledger import posting_key, posting_ledger
+from sap_session_pool import get_concurrency_limiter, get_session_pool
+from sap_single_flight import SingleFlight
 
 import urllib3
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+# Service Layer responses worth retrying for idempotent reads
+RETRYABLE_STATUS_CODES = {500, 502, 503, 504}
 
-class SAPIntegration:
-
-    def __init__(self):
-        self.base_url = app.config['SAP_B1_SERVER']
-        self.username = app.config['SAP_B1_USERNAME']
-        self.password = app.config['SAP_B1_PASSWORD']
-        self.company_db = app.config['SAP_B1_COMPANY_DB']
-        self.session_id = None
-        self.session = requests.Session()
-        self.session.verify = False  # For development, in production use proper SSL
-        self.is_offline = False
-
-        # Cache for frequently accessed data
-        self._warehouse_cache = {}
-        self._bin_cache = {}
-        self._branch_cache = {}
-        self._item_cache = {}
-        self._batch_cache = {}
-
-    def login(self):
-        """Login to SAP B1 Service Layer"""
-        # Check if SAP configuration exists
-        if not self.base_url or not self.username or not self.password or not self.company_db:
-            logging.warning(
-                "SAP B1 configuration not complete. Running in offline mode.")
-            return False
-
-        login_url = f"{self.base_url}/b1s/v1/Login"
-        login_data = {
-            "UserName": self.username,
-            "Password": self.password,
-            "CompanyDB": self.company_db
-        }
-
-        try:
-            response = self.session.post(login_url,
-                                         json=login_data,
-                                         timeout=10)
-            if response.status_code == 200:
-                self.session_id = response.json().get('SessionId')
-                logging.info("Successfully logged in to SAP B1")
-                return True
-            else:
-                logging.warning(
-                    f"SAP B1 login failed: {response.text}. Running in offline mode."
-                )
-                return False
-        except Exception as e:
-            logging.warning(
-                f"SAP B1 login error: {str(e)}. Running in offline mode.")
-            return False
-
-    def ensure_logged_in(self):
-        """Ensure we have a valid session"""
-        if not self.session_id:
-            return self.login()
-        return True
-
-    def get_inventory_transfer_request(self, doc_num):
-        """Get specific inventory transfer request from SAP B1"""
-        if not self.ensure_logged_in():
-            logging.warning(
-                "SAP B1 not available, returning mock transfer request for validation"
-            )
-            # Return mock data for offline mode to allow testing
-            return {
-                'DocNum':
-                int(doc_num) if doc_num.isdigit() else doc_num,
-                'DocEntry':
-                123,
-                'DocStatus':
-                'bost_Open',
-                'DocumentStatus':
-                'bost_Open',
-                'FromWarehouse':
-                'WH001',
-                'ToWarehouse':
-                'WH002',
-                'StockTransferLines': [{
-                    'LineNum': 0,
-                    'ItemCode': 'ITM001',
-                    'ItemDescription': 'Sample Item',
-                    'Quantity': 10,
-                    'FromWarehouseCode': 'WH001',
-                    'WarehouseCode': 'WH002'
-                }]
-            }
-
-        try:
-            # Try multiple endpoints to find the transfer request
-            endpoints_to_try = [
-                f"InventoryTransferRequests?$filter=DocNum eq {doc_num}",
-                f"InventoryTransferRequests?$filter=DocNum eq '{doc_num}'",
-                f"StockTransfers?$filter=DocNum eq {doc_num}",
-                f"StockTransfers?$filter=DocNum eq '{doc_num}'"
-            ]
-
-            for endpoint in endpoints_to_try:
-                url = f"{self.base_url}/b1s/v1/{endpoint}"
-                logging.info(f"🔍 Trying SAP B1 API: {url}")
-
-                response = self.session.get(url)
-                logging.info(f"📡 Response status: {response.status_code}")
-
-                if response.status_code == 200:
-                    data = response.json()
-                    transfers = data.get('value', [])
-                    logging.info(
-                        f"📦 Found {len(transfers)} transfer requests for DocNum {doc_num}"
-                    )
-
-                    if transfers:
-                        transfer_data = transfers[0]
-                        doc_status = transfer_data.get(
-                            'DocumentStatus',
-                            transfer_data.get('DocStatus', ''))
-                        logging.info(
-                            f"✅ Transfer request found: {transfer_data.get('DocNum')} - Status: {doc_status}"
-                        )
-
-                        # Normalize the response structure for consistent access
-                        if 'StockTransferLines' not in transfer_data and 'DocumentLines' in transfer_data:
-                            transfer_data[
-                                'StockTransferLines'] = transfer_data[
-                                    'DocumentLines']
-
-                        # Ensure consistent status field
-                        if 'DocumentStatus' in transfer_data and 'DocStatus' not in transfer_data:
-                            transfer_data['DocStatus'] = transfer_data[
-                                'DocumentStatus']
-
-                        # Log the full structure for debugging
-                        logging.info(
-                            f"📋 Transfer Data: DocNum={transfer_data.get('DocNum')}, FromWarehouse={transfer_data.get('FromWarehouse')}, ToWarehouse={transfer_data.get('ToWarehouse')}"
-                        )
-
-                        return transfer_data
-                    else:
-                        logging.info(f"No results from endpoint: {endpoint}")
-                        continue
-                else:
-                    logging.warning(
-                        f"API call failed for {endpoint}: {response.status_code}"
-                    )
-                    continue
-
-            # If no endpoint worked, return None
-            logging.warning(
-                f"❌ No transfer request found for DocNum {doc_num} in any endpoint"
-            )
-            return None
-
-        except Exception as e:
-            logging.error(
-                f"❌ Error getting inventory transfer request: {str(e)}")
-            return None
+# Upper bound for a single backoff sleep between retries (seconds)
+MAX_RETRY_BACKOFF = 8
 
-    def get_bins(self, warehouse_code):
-        """Get bins for a specific warehouse"""
-        if not self.ensure_logged_in():
-            return []
+# Identical GETs issued concurrently in this worker share one HTTP call
+in_flight_reads = SingleFlight()
 
-        try:
-            url = f"{self.base_url}/b1s/v1/BinLocations?$filter=Warehouse eq '{warehouse_code}'"
-            response = self.session.get(url)
+# business_partners has no ORM model; its CREATE TABLE runs once per process
+_business_partners_table_ready = False
 
-            if response.status_code == 200:
-                data = response.json()
-                bins = data.get('value', [])
+configure_backend(app.config.get('SAP_CACHE_BACKEND', 'memory'),
+                  app.config.get('SAP_CACHE_URL'),
+                  l1_ttl=app.config.get('SAP_CACHE_L1_TTL', 30))
 
-                # Transform the data to match our expected format
-                formatted_bins = []
-                for bin_data in bins:
-                    formatted_bins.append({
-                        'BinCode':
-                        bin_data.get('BinCode'),
-                        'Description':
-                        bin_data.get('Description', ''),
-                        'Warehouse':
-                        bin_data.get('Warehouse'),
-                        'Active':
-                        bin_data.get('Active', 'Y')
-                    })
 
-                return formatted_bins
-            else:
-                logging.error(f"Failed to get bins: {response.status_code}")
-                return []
-        except Exception as e:
-            logging.error(f"Error getting bins: {str(e)}")
-            return []
+class BatchPartResponse:
+    """One demultiplexed response from a Service Layer $batch call"""
 
-    def get_purchase_order(self, po_number):
-        """Get purchase order details from SAP B1"""
-        if not self.ensure_logged_in():
-            # Return mock data for offline mode
-            return {
-                'DocNum':
-                po_number,
-                'CardCode':
-                'V001',  # Sample vendor code
-                'CardName':
-                'Sample Vendor Ltd',
-                'DocDate':
-                '2025-01-08',
-                'DocTotal':
-                15000.00,
-                'DocumentLines': [{
-                    'LineNum': 0,
-                    'ItemCode': 'ITM001',
-                    'ItemDescription': 'Sample Item 1',
-                    'Quantity': 100,
-                    'OpenQuantity': 100,
-                    'RemainingOpenQuantity': 100,
-                    'Price': 50.00,
-                    'UoMCode': 'EA',
-                    'WarehouseCode': 'WH01',
-                    'LineStatus': 'bost_Open'
-                }, {
-                    'LineNum': 1,
-                    'ItemCode': 'ITM002',
-                    'ItemDescription': 'Sample Item 2',
-                    'Quantity': 50,
-                    'OpenQuantity': 30,
-                    'RemainingOpenQuantity': 30,
-                    'Price': 200.00,
-                    'UoMCode': 'KGS',
-                    'WarehouseCode': 'WH01',
-                    'LineStatus': 'bost_Open'
-                }]
-            }
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
 
-        url = f"{self.base_url}/b1s/v1/PurchaseOrders?$filter=DocNum eq {po_number}"
+    def json(self):
+        return json.loads(self.text) if self.text else {}
 
-        try:
-            response = self.session.get(url, timeout=10)
-            if response.status_code == 200:
-                data = response.json()
-                if data['value']:
-                    return data['value'][0]
-            return None
-        except Exception as e:
-            logging.warning(
-                f"Error fetching PO {po_number}: {str(e)}. Using offline mode."
-            )
-            # Return mock data on error
-            return {
-                'DocNum':
-                po_number,
-                'CardCode':
-                'V001',
-                'CardName':
-                'Sample Vendor Ltd',
-                'DocDate':
-                '2025-01-08',
-                'DocTotal':
-                15000.00,
-                'DocumentLines': [{
-                    'LineNum': 0,
-                    'ItemCode': 'ITM001',
-                    'ItemDescription': 'Sample Item 1',
-                    'Quantity': 100,
-                    'OpenQuantity': 100,
-                    'RemainingOpenQuantity': 100,
-                    'Price': 50.00,
-                    'UoMCode': 'EA',
-                    'WarehouseCode': 'WH01',
-                    'LineStatus': 'bost_Open'
-                }]
-            }
 
-    def get_purchase_order_items(self, po_number):
-        """Get purchase order line items"""
-        try:
-            po_data = self.get_purchase_order(po_number)
-            if po_data:
-                return po_data.get('DocumentLines', [])
-        except Exception as e:
-            logging.warning(
-                f"Unable to fetch PO items for {po_number}: {str(e)}. Running in offline mode."
-            )
+def _parse_batch_response(response):
+    """Split a multipart/mixed $batch response into BatchPartResponse objects"""
+    match = re.search(r'boundary="?([^";]+)"?',
+                      response.headers.get('Content-Type', ''))
+    if not match:
         return []
 
-    def get_item_master(self, item_code):
-        """Get item master data from SAP B1"""
-        if not self.ensure_logged_in():
-            return None
+    body = response.content.decode('utf-8').replace('\r\n', '\n')
+    parts = []
+    for chunk in body.split(f"--{match.group(1)}")[1:]:
+        if chunk.startswith('--'):
+            break
+        # MIME part headers, blank line, then the embedded HTTP response
+        _, _, http_message = chunk.lstrip('\n').partition('\n\n')
+        status_line, _, rest = http_message.partition('\n')
+        _, _, payload = rest.partition('\n\n')
+        status_code = int(status_line.split()[1])
+        parts.append(BatchPartResponse(status_code, payload.strip()))
+    return parts
 
-        url = f"{self.base_url}/b1s/v1/Items('{item_code}')"
 
-        try:
-            response = self.session.get(url)
-            if response.status_code == 200:
-                return response.json()
-            return None
-        except Exception as e:
-            logging.error(f"Error fetching item {item_code}: {str(e)}")
-            return None
+def _delta_filter(entity, update_date, update_time=None):
+    """$filter for rows changed at or after a high-water mark - inclusive, so rows
+    sharing the mark are read again rather than missed"""
+    date_field, time_field = DELTA_FIELDS[entity]
+    if time_field and update_time:
+        return (f"({date_field} gt '{update_date}' or ({date_field} eq '{update_date}'"
+                f" and {time_field} ge '{update_time}'))")
+    return f"{date_field} ge '{update_date}'"
 
-    def get_warehouse_bins(self, warehouse_code):
-        """Get bins for a warehouse"""
-        if not self.ensure_logged_in():
-            return []
 
-        url = f"{self.base_url}/b1s/v1/BinLocations?$filter=WhsCode eq '{warehouse_code}'"
+def _change_mark(entity, row):
+    """(UpdateDate, UpdateTime) of a synced row, comparable as a tuple"""
+    date_field, time_field = DELTA_FIELDS[entity]
+    update_date = (row.get(date_field) or '')[:10]
+    if not update_date:
+        return None
+    update_time = (row.get(time_field) or '')[:8] if time_field else ''
+    return update_date, update_time
 
-        try:
-            response = self.session.get(url)
-            if response.status_code == 200:
-                data = response.json()
-                return data.get('value', [])
-            return []
-        except Exception as e:
-            logging.error(
-                f"Error fetching bins for warehouse {warehouse_code}: {str(e)}"
-            )
-            return []
 
-    def get_bin_items(self, bin_code):
-        """Get items in a specific bin location"""
-        if not self.ensure_logged_in():
-            # Return mock data for offline mode
-            logging.warning(
-                f"SAP B1 not available, returning mock bin data for {bin_code}"
-            )
-            return [{
-                'ItemCode': 'ITEM-001',
-                'ItemName': 'Sample Item 1',
-                'Quantity': 50,
-                'UoM': 'EA',
-                'BatchNumber': 'BATCH-001',
-                'ExpiryDate': '2025-12-31'
-            }, {
-                'ItemCode': 'ITEM-002',
-                'ItemName': 'Sample Item 2',
-                'Quantity': 25,
-                'UoM': 'PCS',
-                'BatchNumber': 'BATCH-002',
-                'ExpiryDate': '2025-10-15'
-            }]
-
-        try:
-            # Step 1: Get bin information and validate bin code exists
-            bin_info_url = f"{self.base_url}/b1s/v1/BinLocations?$filter=BinCode eq '{bin_code}'"
-            bin_response = self.session.get(bin_info_url)
-
-            if bin_response.status_code != 200:
-                logging.warning(f"Bin {bin_code} not found in SAP B1")
-                return []
-
-            bin_data = bin_response.json().get('value', [])
-            if not bin_data:
-                logging.warning(f"Bin {bin_code} does not exist")
-                return []
-
-            bin_info = bin_data[0]
-            warehouse_code = bin_info.get('Warehouse', '')
-            abs_entry = bin_info.get('AbsEntry', 0)
-
-            logging.info(
-                f"Found bin {bin_code} in warehouse {warehouse_code} (AbsEntry: {abs_entry})"
-            )
-            print(
-                f"Found bin {bin_code} in warehouse {warehouse_code} (AbsEntry: {abs_entry})"
-            )
-            # Step 2: Get items in this bin using ItemWhsStock for warehouse inventory
-            # SAP B1 API to get items with stock in specific bin location
-            stock_url = f"{self.base_url}/b1s/v1/Warehouses"
-            params = {
-                '$filter': f"WarehouseCode eq '{warehouse_code}'",
-                '$select': 'BusinessPlaceID,WarehouseCode,DefaultBin'
-            }
-
-            stock_response = self.session.get(stock_url, params=params)
-            print(stock_url)
-            print(params)
-            if stock_response.status_code != 200:
-                logging.error(
-                    f"Failed to get warehouse stock: {stock_response.status_code}"
-                )
-                return []
-
-            stock_data = stock_response.json().get('value', [])
-            logging.info(
-                f"Found {len(stock_data)} items with stock in warehouse {warehouse_code}"
-            )
-            print(
-                f"Found {len(stock_data)} items with stock in warehouse {warehouse_code}"
-            )
-            # Step 3: Get batch details for items (using your API example)
-            formatted_items = []
-            for stock_item in stock_data[:
-                                         10]:  # Limit to first 10 items for performance
-                default_Bin = stock_item.get('DefaultBin', '')
-                if not default_Bin:
-                    continue
-
-                # Get batch information for this item
-                batch_url = f"{self.base_url}/b1s/v1/BatchNumberDetails?$filter=SystemNumber eq {default_Bin} and Status eq 'bdsStatus_Released'"
-                print(batch_url)
-                try:
-                    batch_response = self.session.get(batch_url)
-                    if batch_response.status_code == 200:
-                        batch_data = batch_response.json().get('value', [])
-                        print(batch_data)
-                        if batch_data:
-                            # Use first available batch
-                            batch_info = batch_data[0]
-                            formatted_items.append({
-                                'ItemCode':
-                                batch_info.get('ItemCode'),
-                                'ItemName':
-                                batch_info.get('ItemDescription'),
-                                'Batch':
-                                batch_info.get('Batch'),
-                                'ExpirationDate':
-                                batch_info.get('ExpirationDate', 0),
-                                'UoM':
-                                'EA',  # Default UoM, could be enhanced with item master data
-                                'BatchNumber':
-                                batch_info.get('Batch', ''),
-                                'ExpiryDate':
-                                batch_info.get('ExpirationDate', ''),
-                                'BinCode':
-                                bin_code,
-                                'WarehouseCode':
-                                warehouse_code
-                            })
-                        else:
-                            # No batch info, add item without batch
-                            formatted_items.append({
-                                'ItemCode':
-                                batch_info.get('ItemCode'),
-                                'ItemName':
-                                batch_info.get('ItemDescription'),
-                                'Batch':
-                                batch_info.get('Batch'),
-                                'ExpirationDate':
-                                batch_info.get('ExpirationDate', 0),
-                                'BatchNumber':
-                                batch_info.get('Batch', ''),
-                                'ExpiryDate':
-                                batch_info.get('ExpirationDate', ''),
-                                'BinCode':
-                                bin_code,
-                                'WarehouseCode':
-                                warehouse_code
-                            })
-
-                except Exception as batch_error:
-                    logging.warning(
-                        f"Could not get batch info for {default_Bin}: {batch_error}"
-                    )
-                    # Add item without batch info
-                    formatted_items.append({
-                        'ItemCode':
-                        batch_info.get('ItemCode'),
-                        'ItemName':
-                        batch_info.get('ItemDescription'),
-                        'Quantity':
-                        stock_item.get('OnHand', 0),
-                        'BatchNumber':
-                        '',
-                        'ExpiryDate':
-                        '',
-                        'BinCode':
-                        bin_code,
-                        'WarehouseCode':
-                        warehouse_code
-                    })
-
-            logging.info(
-                f"Formatted {len(formatted_items)} items for bin {bin_code}")
-            return formatted_items
-
-        except Exception as e:
-            logging.error(f"Error fetching items for bin {bin_code}: {str(e)}")
-            return []
-
-    def get_available_bins(self, warehouse_code):
-        """Get available bins for a warehouse"""
-        if not self.ensure_logged_in():
-            # Return fallback bins if SAP is not available
-            return []
-
-        try:
-            # Get bins from SAP B1
-            url = f"{self.base_url}/b1s/v1/BinLocations"
-            params = {
-                '$filter': f"Warehouse eq '{warehouse_code}' and Active eq 'Y'"
-            }
-
-            response = self.session.get(url, params=params)
-            if response.status_code == 200:
-                data = response.json()
-                bins = []
-                for bin_data in data.get('value', []):
-                    bins.append({
-                        'BinCode': bin_data.get('BinCode'),
-                        'Description': bin_data.get('Description', '')
-                    })
-                return bins
-            else:
-                logging.error(f"Failed to get bins from SAP: {response.text}")
-                return []
-
-        except Exception as e:
-            logging.error(f"Error getting bins from SAP: {str(e)}")
-            return []
-
-    def create_goods_receipt_po(self, grpo_document):
-        """Create Goods Receipt PO in SAP B1"""
-        if not self.ensure_logged_in():
-            # Return success for offline mode
-            import random
-            return {
-                'success': True,
-                'error': None,
-                'document_number': f'GRPO-{random.randint(100000, 999999)}'
-            }
-
-        url = f"{self.base_url}/b1s/v1/PurchaseDeliveryNotes"
-
-        # Get PO data to ensure we have correct supplier code
-        po_data = self.get_purchase_order(grpo_document.po_number)
-        if not po_data:
-            return {
-                'success': False,
-                'error': f'Purchase Order {grpo_document.po_number} not found'
-            }
-
-        supplier_code = po_data.get('CardCode')
-        if not supplier_code:
-            return {'success': False, 'error': 'Supplier code not found in PO'}
-
-        # Build document lines
-        document_lines = []
-        for item in grpo_document.items:
-            line = {
-                "ItemCode": item.item_code,
-                "Quantity": item.received_quantity,
-                "UnitOfMeasure": item.unit_of_measure,
-                "WarehouseCode": "WH01",  # Default warehouse
-                "BinCode": item.bin_location
-            }
-
-            # Add batch information if available
-            if item.batch_number:
-                line["BatchNumbers"] = [{
-                    "BatchNumber":
-                    item.batch_number,
-                    "Quantity":
-                    item.received_quantity,
-                    "ExpiryDate":
-                    item.expiration_date.strftime('%Y-%m-%d')
-                    if item.expiration_date else None
-                }]
-
-            # Add serial numbers if needed
-            if item.generated_barcode:
-                line["SerialNumbers"] = [{
-                    "SerialNumber": item.generated_barcode,
-                    "Quantity": 1
-                }]
-
-            document_lines.append(line)
-
-        grpo_data = {
-            "CardCode": supplier_code,
-            "DocDate": grpo_document.created_at.strftime('%Y-%m-%d'),
-            "DocumentLines": document_lines,
-            "Comments":
-            f"Created from WMS GRPO {grpo_document.id} by {grpo_document.user.username}",
-            "U_WMS_GRPO_ID":
-            str(grpo_document.id)  # Custom field to track WMS document
-        }
-
-        try:
-            response = self.session.post(url, json=grpo_data)
-            if response.status_code == 201:
-                result = response.json()
-                return {
-                    'success': True,
-                    'document_number': result.get('DocNum')
-                }
-            else:
-                return {
-                    'success': False,
-                    'error': f"SAP B1 error: {response.text}"
-                }
-        except Exception as e:
-            logging.error(f"Error creating GRPO in SAP B1: {str(e)}")
-            return {'success': False, 'error': str(e)}
-
-    def get_bin_abs_entry(self, bin_code, warehouse_code):
-        """Get bin AbsEntry from SAP B1 for bin allocation"""
-        if not self.ensure_logged_in():
-            return None
-
-        try:
-            url = f"{self.base_url}/b1s/v1/BinLocations?$filter=BinCode eq '{bin_code}' and Warehouse eq '{warehouse_code}'"
-            response = self.session.get(url)
-
-            if response.status_code == 200:
-                bins = response.json().get('value', [])
-                if bins:
-                    return bins[0].get('AbsEntry')
-            return None
-        except Exception as e:
-            logging.error(
-                f"Error getting bin AbsEntry for {bin_code}: {str(e)}")
-            return None
-
-    def get_batch_numbers(self, item_code):
-        """Get batch numbers for specific item from SAP B1 BatchNumberDetails"""
-        # Check cache first
-        if item_code in self._batch_cache:
-            return self._batch_cache[item_code]
-
-        if not self.ensure_logged_in():
-            logging.warning(
-                f"SAP B1 not available, returning mock batch data for {item_code}"
-            )
-            # Return mock batch data for offline mode
-            mock_batches = [{
-                "Batch": f"BATCH-{item_code}-001",
-                "ItemCode": item_code,
-                "Status": "bdsStatus_Released",
-                "ExpirationDate": None,
-                "ManufacturingDate": None,
-                "AdmissionDate": "2025-01-01T00:00:00Z"
-            }, {
-                "Batch": f"BATCH-{item_code}-002",
-                "ItemCode": item_code,
-                "Status": "bdsStatus_Released",
-                "ExpirationDate": None,
-                "ManufacturingDate": None,
-                "AdmissionDate": "2025-01-01T00:00:00Z"
-            }]
-            self._batch_cache[item_code] = mock_batches
-            return mock_batches
-
-        try:
-            url = f"{self.base_url}/b1s/v1/BatchNumberDetails?$filter=ItemCode eq '{item_code}' and Status eq 'bdsStatus_Released'"
-            logging.info(f"🔍 Fetching batch numbers from SAP B1: {url}")
-
-            response = self.session.get(url)
-            if response.status_code == 200:
-                data = response.json()
-                batches = data.get('value', [])
-                logging.info(
-                    f"📦 Found {len(batches)} batch numbers for item {item_code}"
-                )
-
-                # Cache the results
-                self._batch_cache[item_code] = batches
-                return batches
-            else:
-                logging.warning(
-                    f"Failed to fetch batch numbers: {response.status_code} - {response.text}"
-                )
-                return []
-        except Exception as e:
-            logging.error(
-                f"Error fetching batch numbers for {item_code}: {str(e)}")
-            return []
-
-    def get_item_batches(self, item_code, warehouse_code=''):
-        """Get available batches for an item with stock information"""
-        logging.info(
-            f"🔍 Getting batches for item {item_code} in warehouse {warehouse_code}"
-        )
-
-        if not self.ensure_logged_in():
-            logging.warning("⚠️ No SAP B1 session - returning mock batch data")
-            return self._get_mock_batch_data(item_code)
-
-        try:
-            # SAP B1 API to get batch details
-            filter_clause = f"ItemCode eq '{item_code}'"
-            if warehouse_code:
-                filter_clause += f" and Warehouse eq '{warehouse_code}'"
-
-            url = f"{self.base_url}/b1s/v1/BatchNumberDetails?$filter={filter_clause}&$select=BatchNumber,OnHandQuantity,ExpiryDate,ManufacturingDate,Warehouse"
-
-            response = self.session.get(url)
-
-            if response.status_code == 200:
-                data = response.json()
-                batches = data.get('value', [])
-                logging.info(
-                    f"✅ Found {len(batches)} batches for item {item_code}")
-                return batches
-            else:
-                logging.error(
-                    f"❌ SAP B1 API error getting batches: {response.status_code}"
-                )
-                return self._get_mock_batch_data(item_code)
-
-        except Exception as e:
-            logging.error(f"❌ Error getting batches from SAP B1: {str(e)}")
-            return self._get_mock_batch_data(item_code)
-
-    def get_batch_stock(self, item_code, batch_number, warehouse_code=''):
-        """Get stock level for a specific batch"""
-        logging.info(
-            f"📊 Getting stock for batch {batch_number} of item {item_code}")
-
-        if not self.ensure_logged_in():
-            logging.warning("⚠️ No SAP B1 session - returning mock stock data")
-            return {
-                'OnHandQuantity': 100,
-                'Warehouse': warehouse_code,
-                'ExpiryDate': '2025-12-31',
-                'ManufacturingDate': '2025-01-01'
-            }
-
-        try:
-            filter_clause = f"ItemCode eq '{item_code}' and BatchNumber eq '{batch_number}'"
-            if warehouse_code:
-                filter_clause += f" and Warehouse eq '{warehouse_code}'"
-
-            url = f"{self.base_url}/b1s/v1/BatchNumberDetails?$filter={filter_clause}"
-
-            response = self.session.get(url)
-
-            if response.status_code == 200:
-                data = response.json()
-                batches = data.get('value', [])
-                if batches:
-                    logging.info(
-                        f"✅ Found stock for batch {batch_number}: {batches[0].get('OnHandQuantity', 0)}"
-                    )
-                    return batches[0]
-                else:
-                    logging.warning(
-                        f"⚠️ Batch {batch_number} not found for item {item_code}"
-                    )
-                    return None
-            else:
-                logging.error(
-                    f"❌ SAP B1 API error getting batch stock: {response.status_code}"
-                )
-                return {
-                    'OnHandQuantity': 100,
-                    'Warehouse': warehouse_code,
-                    'ExpiryDate': '2025-12-31',
-                    'ManufacturingDate': '2025-01-01'
-                }
-
-        except Exception as e:
-            logging.error(f"❌ Error getting batch stock from SAP B1: {str(e)}")
-            return {
-                'OnHandQuantity': 100,
-                'Warehouse': warehouse_code,
-                'ExpiryDate': '2025-12-31',
-                'ManufacturingDate': '2025-01-01'
-            }
-
-    def _get_mock_batch_data(self, item_code):
-        """Return mock batch data for offline testing"""
-        return [{
-            'BatchNumber': 'A22',
-            'OnHandQuantity': 66.0,
-            'ExpiryDate': '2025-12-31T00:00:00Z',
-            'ManufacturingDate': '2025-01-01T00:00:00Z',
-            'Warehouse': 'ORD-CHN'
-        }, {
-            'BatchNumber': 'B23',
-            'OnHandQuantity': 45.0,
-            'ExpiryDate': '2026-06-30T00:00:00Z',
-            'ManufacturingDate': '2025-06-01T00:00:00Z',
-            'Warehouse': 'ORD-CHN'
-        }, {
-            'BatchNumber': 'C24',
-            'OnHandQuantity': 32.0,
-            'ExpiryDate': '2026-12-31T00:00:00Z',
-            'ManufacturingDate': '2025-12-01T00:00:00Z',
-            'Warehouse': 'ORD-CHN'
-        }]
-
-    def create_inventory_transfer(self, transfer_document):
-        """Create Stock Transfer in SAP B1 with correct JSON structure"""
-        if not self.ensure_logged_in():
-            logging.warning(
-                "SAP B1 not available, simulating transfer creation for testing"
-            )
-            return {
-                'success': True,
-                'document_number': f'ST-{transfer_document.id}'
-            }
-
-        url = f"{self.base_url}/b1s/v1/StockTransfers"
-
-        # Get transfer request data for BaseEntry reference
-        transfer_request_data = self.get_inventory_transfer_request(
-            transfer_document.transfer_request_number)
-        base_entry = transfer_request_data.get(
-            'DocEntry') if transfer_request_data else None
-
-        # Build stock transfer lines with enhanced structure
-        stock_transfer_lines = []
-        for index, item in enumerate(transfer_document.items):
-            # Get item details for accurate UoM and pricing
-            item_details = self.get_item_details(item.item_code)
-
-            # Use actual item UoM if available
-            actual_uom = item_details.get(
-                'InventoryUoM',
-                item.unit_of_measure) if item_details else item.unit_of_measure
-
-            # Find corresponding line in transfer request for price info
-            price = 0
-            unit_price = 0
-            uom_entry = None
-            base_line = index
-
-            if transfer_request_data and 'StockTransferLines' in transfer_request_data:
-                for req_line in transfer_request_data['StockTransferLines']:
-                    if req_line.get('ItemCode') == item.item_code:
-                        price = req_line.get('Price', 0)
-                        unit_price = req_line.get('UnitPrice', price)
-                        uom_entry = req_line.get('UoMEntry')
-                        base_line = req_line.get('LineNum', index)
-                        break
-
-            line = {
-                "LineNum": index,
-                "ItemCode": item.item_code,
-                "Quantity": float(item.quantity),
-                "WarehouseCode": transfer_document.to_warehouse,
-                "FromWarehouseCode": transfer_document.from_warehouse,
-                "UoMCode": actual_uom
-            }
-
-            # Add BaseEntry and BaseLine if available (reference to transfer request)
-            if base_entry:
-                line["BaseEntry"] = base_entry
-                line["BaseLine"] = base_line
-                line["BaseType"] = "1250000001"  # oInventoryTransferRequest
-
-            # Add pricing if available
-            if price > 0:
-                line["Price"] = price
-                line["UnitPrice"] = unit_price
-
-            # Add UoMEntry if available
-            if uom_entry:
-                line["UoMEntry"] = uom_entry
-
-            # Add batch numbers if present
-            if item.batch_number:
-                line["BatchNumbers"] = [{
-                    "BaseLineNumber": index,
-                    "BatchNumberProperty": item.batch_number,
-                    "Quantity": float(item.quantity)
-                }]
-
-            # Add bin allocation if bins are specified
-            # if item.from_bin or item.to_bin:
-            #     line["BinAllocation"] = []
-            #
-            #     if item.from_bin:
-            #         line["BinAllocation"].append({
-            #             "BinActionType": "batFromWarehouse",
-            #             "BinAbsEntry": self.get_bin_abs_entry(item.from_bin, transfer_document.from_warehouse),
-            #             "Quantity": float(item.quantity)
-            #         })
-            #
-            #     if item.to_bin:
-            #         line["BinAllocation"].append({
-            #             "BinActionType": "batToWarehouse",
-            #             "BinAbsEntry": self.get_bin_abs_entry(item.to_bin, transfer_document.to_warehouse),
-            #             "Quantity": float(item.quantity)
-            #         })
-
-            stock_transfer_lines.append(line)
-
-        transfer_data = {
-            "DocDate": datetime.now().strftime('%Y-%m-%d'),
-            "Comments":
-            f"QC Approved WMS Transfer {transfer_document.id} by {transfer_document.qc_approver.username if transfer_document.qc_approver else 'System'}",
-            "FromWarehouse": transfer_document.from_warehouse,
-            "ToWarehouse": transfer_document.to_warehouse,
-            "StockTransferLines": stock_transfer_lines
-        }
-        print(transfer_data)
-        # Log the JSON payload for debugging
-        logging.info(f"📤 Sending stock transfer to SAP B1:")
-        logging.info(f"JSON payload: {json.dumps(transfer_data, indent=2)}")
-
-        try:
-            response = self.session.post(url, json=transfer_data)
-            logging.info(f"📡 SAP B1 response status: {response.status_code}")
-
-            if response.status_code == 201:
-                result = response.json()
-                logging.info(
-                    f"✅ Stock transfer created successfully: {result.get('DocNum')}"
-                )
-                return {
-                    'success': True,
-                    'document_number': result.get('DocNum')
-                }
-            else:
-                error_msg = f"SAP B1 error: {response.text}"
-                logging.error(
-                    f"❌ Failed to create stock transfer: {error_msg}")
-                return {'success': False, 'error': error_msg}
-        except Exception as e:
-            logging.error(
-                f"❌ Error creating stock transfer in SAP B1: {str(e)}")
-            return {'success': False, 'error': str(e)}
-
-    def get_item_details(self, item_code):
-        """Get detailed item information from SAP B1"""
-        if not self.ensure_logged_in():
-            return {
-                'ItemCode': item_code,
-                'ItemName': f'Mock Item {item_code}',
-                'UoMGroupEntry': 1,
-                'UoMCode': 'EA',
-                'UoMName': 'Each',
-                'InventoryUoM': 'EA',
-                'DefaultWarehouse': 'WH001',
-                'ItemType': 'itItems',
-                'ManageSerialNumbers': 'N',
-                'ManageBatchNumbers': 'N'
-            }
-
-        try:
-            url = f"{self.base_url}/b1s/v1/Items('{item_code}')"
-            response = self.session.get(url)
-
-            if response.status_code == 200:
-                item_data = response.json()
-
-                # Get UoM details
-                uom_group_entry = item_data.get('UoMGroupEntry')
-                inventory_uom = item_data.get('InventoryUoM', 'EA')
-
-                return {
-                    'ItemCode': item_data.get('ItemCode'),
-                    'ItemName': item_data.get('ItemName'),
-                    'UoMGroupEntry': uom_group_entry,
-                    'UoMCode': inventory_uom,
-                    'InventoryUoM': inventory_uom,
-                    'DefaultWarehouse': item_data.get('DefaultWarehouse'),
-                    'ItemType': item_data.get('ItemType'),
-                    'ManageSerialNumbers':
-                    item_data.get('ManageSerialNumbers'),
-                    'ManageBatchNumbers': item_data.get('ManageBatchNumbers')
-                }
-            else:
-                logging.error(
-                    f"Failed to get item details for {item_code}: {response.text}"
-                )
-                return None
-        except Exception as e:
-            logging.error(
-                f"Error getting item details for {item_code}: {str(e)}")
-            return None
-
-    def create_inventory_counting(self, count_document):
-        """Create Inventory Counting Document in SAP B1"""
-        if not self.ensure_logged_in():
-            return {'success': False, 'error': 'Not logged in to SAP B1'}
-
-        url = f"{self.base_url}/b1s/v1/InventoryCountings"
-
-        # Build document lines
-        document_lines = []
-        for item in count_document.items:
-            line = {
-                "ItemCode": item.item_code,
-                "CountedQuantity": item.counted_quantity,
-                "BinCode": count_document.bin_location
-            }
-            if item.batch_number:
-                line["BatchNumber"] = item.batch_number
-            document_lines.append(line)
-
-        count_data = {
-            "CountDate": datetime.now().strftime('%Y-%m-%d'),
-            "CountTime": datetime.now().strftime('%H:%M:%S'),
-            "Remarks": f"Created from WMS Count {count_document.id}",
-            "InventoryCountingLines": document_lines
-        }
-
-        try:
-            response = self.session.post(url, json=count_data)
-            if response.status_code == 201:
-                result = response.json()
-                return {
-                    'success': True,
-                    'document_number': result.get('DocNum')
-                }
-            else:
-                return {
-                    'success': False,
-                    'error': f"SAP B1 error: {response.text}"
-                }
-        except Exception as e:
-            logging.error(
-                f"Error creating inventory counting in SAP B1: {str(e)}")
-            return {'success': False, 'error': str(e)}
-
-    def sync_warehouses(self):
-        """Sync warehouses from SAP B1 to local database"""
-        if not self.ensure_logged_in():
-            logging.warning("Cannot sync warehouses - SAP B1 not available")
-            return False
-
-        try:
-            url = f"{self.base_url}/b1s/v1/Warehouses"
-            response = self.session.get(url)
-
-            if response.status_code == 200:
-                warehouses = response.json().get('value', [])
-
-                from app import db
-
-                # Clear cache and update database
-                self._warehouse_cache = {}
-
-                for wh in warehouses:
-                    # Check if warehouse exists in branches table
-                    existing = db.session.execute(
-                        db.text("SELECT id FROM branches WHERE id = :id"), {
-                            "id": wh.get('WarehouseCode')
-                        }).fetchone()
-
-                    if not existing:
-                        # Insert new warehouse as branch - use compatible SQL
-                        import os
-                        from app import app
-                        db_uri = app.config.get('SQLALCHEMY_DATABASE_URI', '')
-
-                        if 'postgresql' in db_uri.lower(
-                        ) or 'mysql' in db_uri.lower():
-                            insert_sql = """
-                                INSERT INTO branches (id, name, address, is_active, created_at, updated_at)
-                                VALUES (:id, :name, :address, :is_active, NOW(), NOW())
-                            """
-                        else:
-                            insert_sql = """
-                                INSERT INTO branches (id, name, address, is_active, created_at, updated_at)
-                                VALUES (:id, :name, :address, :is_active, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                            """
-
-                        db.session.execute(
-                            db.text(insert_sql), {
-                                "id": wh.get('WarehouseCode'),
-                                "name": wh.get('WarehouseName', ''),
-                                "address": wh.get('Street', ''),
-                                "is_active": wh.get('Inactive') != 'Y'
-                            })
-                    else:
-                        # Update existing warehouse - use compatible SQL
-                        import os
-                        from app import app
-                        db_uri = app.config.get('SQLALCHEMY_DATABASE_URI', '')
-
-                        if 'postgresql' in db_uri.lower(
-                        ) or 'mysql' in db_uri.lower():
-                            update_sql = """
-                                UPDATE branches SET 
-                                    name = :name, 
-                                    address = :address, 
-                                    is_active = :is_active,
-                                    updated_at = NOW()
-                                WHERE id = :id
-                            """
-                        else:
-                            update_sql = """
-                                UPDATE branches SET 
-                                    name = :name, 
-                                    address = :address, 
-                                    is_active = :is_active,
-                                    updated_at = CURRENT_TIMESTAMP
-                                WHERE id = :id
-                            """
-
-                        db.session.execute(
-                            db.text(update_sql), {
-                                "id": wh.get('WarehouseCode'),
-                                "name": wh.get('WarehouseName', ''),
-                                "address": wh.get('Street', ''),
-                                "is_active": wh.get('Inactive') != 'Y'
-                            })
-
-                    # Cache warehouse data
-                    self._warehouse_cache[wh.get('WarehouseCode')] = {
-                        'WarehouseCode': wh.get('WarehouseCode'),
-                        'WarehouseName': wh.get('WarehouseName'),
-                        'Address': wh.get('Street'),
-                        'Active': wh.get('Inactive') != 'Y'
-                    }
-
-                db.session.commit()
-                logging.info(
-                    f"Synced {len(warehouses)} warehouses from SAP B1")
-                return True
-
-        except Exception as e:
-            logging.error(f"Error syncing warehouses: {str(e)}")
-            return False
-
-    def sync_bins(self, warehouse_code=None):
-        """Sync bin locations from SAP B1"""
-        if not self.ensure_logged_in():
-            logging.warning("Cannot sync bins - SAP B1 not available")
-            return False
-
-        try:
-            # Get bins for specific warehouse or all warehouses
-            if warehouse_code:
-                url = f"{self.base_url}/b1s/v1/BinLocations?$filter=Warehouse eq '{warehouse_code}'"
-            else:
-                url = f"{self.base_url}/b1s/v1/BinLocations"
-
-            response = self.session.get(url)
-
-            if response.status_code == 200:
-                bins = response.json().get('value', [])
-
-                # Create bins table if not exists - use compatible SQL
-                from app import db, app
-                import os
-
-                db_uri = app.config.get('SQLALCHEMY_DATABASE_URI', '')
-
-                if 'postgresql' in db_uri.lower():
-                    create_table_sql = """
-                        CREATE TABLE IF NOT EXISTS bin_locations (
-                            id SERIAL PRIMARY KEY,
-                            bin_code VARCHAR(50) NOT NULL,
-                            warehouse_code VARCHAR(10) NOT NULL,
-                            bin_name VARCHAR(100),
-                            is_active BOOLEAN DEFAULT TRUE,
-                            created_at TIMESTAMP DEFAULT NOW(),
-                            updated_at TIMESTAMP DEFAULT NOW(),
-                            UNIQUE(bin_code, warehouse_code)
-                        )
-                    """
-                elif 'mysql' in db_uri.lower():
-                    create_table_sql = """
-                        CREATE TABLE IF NOT EXISTS bin_locations (
-                            id INT AUTO_INCREMENT PRIMARY KEY,
-                            bin_code VARCHAR(50) NOT NULL,
-                            warehouse_code VARCHAR(10) NOT NULL,
-                            bin_name VARCHAR(100),
-                            is_active BOOLEAN DEFAULT TRUE,
-                            created_at TIMESTAMP DEFAULT NOW(),
-                            updated_at TIMESTAMP DEFAULT NOW() ON UPDATE NOW(),
-                            UNIQUE KEY unique_bin_warehouse (bin_code, warehouse_code)
-                        )
-                    """
-                else:
-                    create_table_sql = """
-                        CREATE TABLE IF NOT EXISTS bin_locations (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            bin_code VARCHAR(50) NOT NULL,
-                            warehouse_code VARCHAR(10) NOT NULL,
-                            bin_name VARCHAR(100),
-                            is_active BOOLEAN DEFAULT 1,
-                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            UNIQUE(bin_code, warehouse_code)
-                        )
-                    """
-
-                db.session.execute(db.text(create_table_sql))
-
-                # Clear cache
-                self._bin_cache = {}
-
-                for bin_data in bins:
-                    bin_code = bin_data.get('BinCode')
-                    wh_code = bin_data.get(
-                        'Warehouse')  # Use 'Warehouse' not 'WarehouseCode'
-
-                    if bin_code and wh_code:
-                        # Upsert bin location - use database-specific syntax
-                        if 'postgresql' in db_uri.lower():
-                            upsert_sql = """
-                                INSERT INTO bin_locations (bin_code, warehouse_code, bin_name, is_active, created_at, updated_at)
-                                VALUES (:bin_code, :warehouse_code, :bin_name, :is_active, NOW(), NOW())
-                                ON CONFLICT (bin_code, warehouse_code) 
-                                DO UPDATE SET 
-                                    bin_name = EXCLUDED.bin_name,
-                                    is_active = EXCLUDED.is_active,
-                                    updated_at = NOW()
-                            """
-                        elif 'mysql' in db_uri.lower():
-                            upsert_sql = """
-                                INSERT INTO bin_locations (bin_code, warehouse_code, bin_name, is_active, created_at, updated_at)
-                                VALUES (:bin_code, :warehouse_code, :bin_name, :is_active, NOW(), NOW())
-                                ON DUPLICATE KEY UPDATE 
-                                    bin_name = VALUES(bin_name),
-                                    is_active = VALUES(is_active),
-                                    updated_at = NOW()
-                            """
-                        else:
-                            # SQLite - use INSERT OR REPLACE
-                            upsert_sql = """
-                                INSERT OR REPLACE INTO bin_locations (bin_code, warehouse_code, bin_name, is_active, created_at, updated_at)
-                                VALUES (:bin_code, :warehouse_code, :bin_name, :is_active, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                            """
-
-                        db.session.execute(
-                            db.text(upsert_sql), {
-                                "bin_code": bin_code,
-                                "warehouse_code": wh_code,
-                                "bin_name": bin_data.get('Description', ''),
-                                "is_active": bin_data.get('Inactive') != 'Y'
-                            })
-
-                        # Cache bin data
-                        cache_key = f"{wh_code}:{bin_code}"
-                        self._bin_cache[cache_key] = {
-                            'BinCode': bin_code,
-                            'WarehouseCode': wh_code,
-                            'Description': bin_data.get('Description', ''),
-                            'Active': bin_data.get('Inactive') != 'Y'
-                        }
-
-                db.session.commit()
-                logging.info(f"Synced {len(bins)} bin locations from SAP B1")
-                return True
-
-        except Exception as e:
-            logging.error(f"Error syncing bins: {str(e)}")
-            return False
-
-    def sync_business_partners(self):
-        """Sync business partners (suppliers/customers) from SAP B1"""
-        if not self.ensure_logged_in():
-            logging.warning(
-                "Cannot sync business partners - SAP B1 not available")
-            return False
-
-        try:
-            # Get suppliers and customers
-            url = f"{self.base_url}/b1s/v1/BusinessPartners?$filter=CardType eq 'cSupplier' or CardType eq 'cCustomer'"
-            response = self.session.get(url)
-
-            if response.status_code == 200:
-                partners = response.json().get('value', [])
-
-                from app import db, app
-
-                # Create business_partners table if not exists - use database-specific syntax
-                db_uri = app.config.get('SQLALCHEMY_DATABASE_URI', '')
-
-                if 'postgresql' in db_uri.lower():
-                    create_table_sql = """
-                        CREATE TABLE IF NOT EXISTS business_partners (
-                            id SERIAL PRIMARY KEY,
-                            card_code VARCHAR(50) UNIQUE NOT NULL,
-                            card_name VARCHAR(200) NOT NULL,
-                            card_type VARCHAR(20) NOT NULL,
-                            phone VARCHAR(50),
-                            email VARCHAR(100),
-                            address TEXT,
-                            is_active BOOLEAN DEFAULT TRUE,
-                            created_at TIMESTAMP DEFAULT NOW(),
-                            updated_at TIMESTAMP DEFAULT NOW()
-                        )
-                    """
-                elif 'mysql' in db_uri.lower():
-                    create_table_sql = """
-                        CREATE TABLE IF NOT EXISTS business_partners (
-                            id INT AUTO_INCREMENT PRIMARY KEY,
-                            card_code VARCHAR(50) UNIQUE NOT NULL,
-                            card_name VARCHAR(200) NOT NULL,
-                            card_type VARCHAR(20) NOT NULL,
-                            phone VARCHAR(50),
-                            email VARCHAR(100),
-                            address TEXT,
-                            is_active BOOLEAN DEFAULT TRUE,
-                            created_at TIMESTAMP DEFAULT NOW(),
-                            updated_at TIMESTAMP DEFAULT NOW() ON UPDATE NOW()
-                        )
-                    """
-                else:
-                    create_table_sql = """
-                        CREATE TABLE IF NOT EXISTS business_partners (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            card_code VARCHAR(50) UNIQUE NOT NULL,
-                            card_name VARCHAR(200) NOT NULL,
-                            card_type VARCHAR(20) NOT NULL,
-                            phone VARCHAR(50),
-                            email VARCHAR(100),
-                            address TEXT,
-                            is_active BOOLEAN DEFAULT 1,
-                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                        )
-                    """
-
-                db.session.execute(db.text(create_table_sql))
-
-                for partner in partners:
-                    card_code = partner.get('CardCode')
-                    if card_code:
-                        # Use database-specific upsert syntax
-                        if 'postgresql' in db_uri.lower():
-                            upsert_sql = """
-                                INSERT INTO business_partners (card_code, card_name, card_type, phone, email, address, is_active, created_at, updated_at)
-                                VALUES (:card_code, :card_name, :card_type, :phone, :email, :address, :is_active, NOW(), NOW())
-                                ON CONFLICT (card_code) 
-                                DO UPDATE SET 
-                                    card_name = EXCLUDED.card_name,
-                                    card_type = EXCLUDED.card_type,
-                                    phone = EXCLUDED.phone,
-                                    email = EXCLUDED.email,
-                                    address = EXCLUDED.address,
-                                    is_active = EXCLUDED.is_active,
-                                    updated_at = NOW()
-                            """
-                        elif 'mysql' in db_uri.lower():
-                            upsert_sql = """
-                                INSERT INTO business_partners (card_code, card_name, card_type, phone, email, address, is_active, created_at, updated_at)
-                                VALUES (:card_code, :card_name, :card_type, :phone, :email, :address, :is_active, NOW(), NOW())
-                                ON DUPLICATE KEY UPDATE 
-                                    card_name = VALUES(card_name),
-                                    card_type = VALUES(card_type),
-                                    phone = VALUES(phone),
-                                    email = VALUES(email),
-                                    address = VALUES(address),
-                                    is_active = VALUES(is_active),
-                                    updated_at = NOW()
-                            """
-                        else:
-                            # SQLite - use INSERT OR REPLACE
-                            upsert_sql = """
-                                INSERT OR REPLACE INTO business_partners (card_code, card_name, card_type, phone, email, address, is_active, created_at, updated_at)
-                                VALUES (:card_code, :card_name, :card_type, :phone, :email, :address, :is_active, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                            """
-
-                        db.session.execute(
-                            db.text(upsert_sql), {
-                                "card_code": card_code,
-                                "card_name": partner.get('CardName', ''),
-                                "card_type": partner.get('CardType', ''),
-                                "phone": partner.get('Phone1', ''),
-                                "email": partner.get('EmailAddress', ''),
-                                "address": partner.get('Address', ''),
-                                "is_active": partner.get('Valid') == 'Y'
-                            })
-
-                db.session.commit()
-                logging.info(
-                    f"Synced {len(partners)} business partners from SAP B1")
-                return True
-
-        except Exception as e:
-            logging.error(f"Error syncing business partners: {str(e)}")
-            return False
-
-    def get_warehouse_business_place_id(self, warehouse_code):
-        """Get BusinessPlaceID for a warehouse from SAP B1"""
-        if not self.ensure_logged_in():
-            return 5  # Default fallback
-
-        try:
-            url = f"{self.base_url}/b1s/v1/Warehouses"
-            params = {
-                '$select': 'BusinessPlaceID',
-                '$filter': f"WarehouseCode eq '{warehouse_code}'"
-            }
-
-            response = self.session.get(url, params=params)
-            if response.status_code == 200:
-                data = response.json()
-                if data.get('value') and len(data['value']) > 0:
-                    return data['value'][0].get('BusinessPlaceID', 5)
-            return 5  # Default fallback
-
-        except Exception as e:
-            logging.error(
-                f"Error getting BusinessPlaceID for warehouse {warehouse_code}: {str(e)}"
-            )
-            return 5  # Default fallback
-
-    def generate_external_reference_number(self, grpo_document):
-        """Generate unique external reference number for Purchase Delivery Note"""
-        from datetime import datetime
-
-        # Get current date in YYYYMMDD format
-        date_str = datetime.now().strftime('%Y%m%d')
-
-        # Get sequence number for today
-        try:
-            from app import db
-
-            # Create sequence table if not exists
-            create_sequence_table = """
-                CREATE TABLE IF NOT EXISTS pdn_sequence (
-                    date_key VARCHAR(8) PRIMARY KEY,
-                    sequence_number INTEGER DEFAULT 0
-                )
-            """
-            db.session.execute(db.text(create_sequence_table))
-
-            # Get or create sequence for today
-            result = db.session.execute(
-                db.text(
-                    "SELECT sequence_number FROM pdn_sequence WHERE date_key = :date_key"
-                ), {
-                    "date_key": date_str
-                }).fetchone()
-
-            if result:
-                sequence_num = result[0] + 1
-                db.session.execute(
-                    db.text(
-                        "UPDATE pdn_sequence SET sequence_number = :seq WHERE date_key = :date_key"
-                    ), {
-                        "seq": sequence_num,
-                        "date_key": date_str
-                    })
-            else:
-                sequence_num = 1
-                db.session.execute(
-                    db.text(
-                        "INSERT INTO pdn_sequence (date_key, sequence_number) VALUES (:date_key, :seq)"
-                    ), {
-                        "date_key": date_str,
-                        "seq": sequence_num
-                    })
-
-            db.session.commit()
-
-            # Format: EXT-REF-YYYYMMDD-XXX
-            return f"EXT-REF-{date_str}-{sequence_num:03d}"
-
-        except Exception as e:
-            logging.error(
-                f"Error generating external reference number: {str(e)}")
-            # Fallback to timestamp-based reference
-            timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-            return f"EXT-REF-{timestamp}"
-
-    def create_purchase_delivery_note(self, grpo_document):
-        """Create Purchase Delivery Note in SAP B1 with exact JSON structure specified"""
-        if not self.ensure_logged_in():
-            # Return success for offline mode
-            import random
-            return {
-                'success': True,
-                'error': None,
-                'document_number': f'PDN-{random.randint(100000, 999999)}'
-            }
-
-        # Get PO data first to ensure proper field mapping
-        po_data = self.get_purchase_order(grpo_document.po_number)
-        if not po_data:
-            return {
-                'success':
-                False,
-                'error':
-                f'Purchase Order {grpo_document.po_number} not found in SAP B1'
-            }
-
-        # Extract required fields from PO with correct date formatting
-        card_code = po_data.get('CardCode')
-        po_doc_entry = po_data.get('DocEntry')
-
-        # Use PO dates in correct format (YYYY-MM-DD, not with time)
-        doc_date = po_data.get('DocDate', '2024-02-24')
-        doc_due_date = po_data.get('DocDueDate', '2024-03-05')
-
-        # Ensure dates are in YYYY-MM-DD format (remove time if present)
-        if 'T' in doc_date:
-            doc_date = doc_date.split('T')[0]
-        if 'T' in doc_due_date:
-            doc_due_date = doc_due_date.split('T')[0]
-
-        if not card_code or not po_doc_entry:
-            return {
-                'success': False,
-                'error': 'Missing CardCode or PO DocEntry from SAP B1'
-            }
-
-        # Generate unique external reference number
-        external_ref = self.generate_external_reference_number(grpo_document)
-
-        # Get first warehouse code from PO DocumentLines to determine BusinessPlaceID
-        first_warehouse_code = None
-        if grpo_document.items:
-            for item in grpo_document.items:
-                if item.qc_status == 'approved':
-                    # Find matching PO line to get proper warehouse code
-                    for po_line in po_data.get('DocumentLines', []):
-                        if po_line.get('ItemCode') == item.item_code:
-                            first_warehouse_code = po_line.get(
-                                'WarehouseCode') or po_line.get('WhsCode')
-                            if first_warehouse_code:
-                                break
-                    if first_warehouse_code:
-                        break
-
-        # Get BusinessPlaceID for the warehouse
-        business_place_id = self.get_warehouse_business_place_id(
-            first_warehouse_code) if first_warehouse_code else 5
-
-        # Build document lines with exact structure
-        document_lines = []
-        line_number = 0
-
-        for item in grpo_document.items:
-            # Only include QC approved items
-            if item.qc_status != 'approved':
-                continue
-
-            # Find matching PO line for proper mapping
-            po_line_num = None
-            po_line_data = None
-            for po_line in po_data.get('DocumentLines', []):
-                if po_line.get('ItemCode') == item.item_code:
-                    po_line_num = po_line.get('LineNum')
-                    po_line_data = po_line
-                    break
-
-            if po_line_num is None:
-                logging.warning(
-                    f"PO line not found for item {item.item_code} in PO {grpo_document.po_number}"
-                )
-                continue  # Skip items not found in PO
-
-            # Get exact warehouse code from PO line instead of bin location
-            po_warehouse_code = None
-            if po_line_data:
-                po_warehouse_code = po_line_data.get(
-                    'WarehouseCode') or po_line_data.get('WhsCode')
-
-            # Use PO warehouse code, or fallback to extracted from bin location
-            warehouse_code = po_warehouse_code or (item.bin_location.split(
-                '-')[0] if '-' in item.bin_location else item.bin_location[:4])
-
-            # Build line with exact SAP B1 structure
-            line = {
-                "BaseType": 22,  # Constant value for Purchase Order
-                "BaseEntry": po_doc_entry,
-                "BaseLine": po_line_num,
-                "ItemCode": item.item_code,
-                "Quantity": item.received_quantity,
-                "WarehouseCode": warehouse_code
-            }
-
-            # Add batch information in EXACT format as user specified
-            if item.batch_number:
-                # Format expiry date properly
-                expiry_date = doc_date + "T00:00:00Z"  # Default to PO date
-                if item.expiration_date:
-                    if hasattr(item.expiration_date, 'strftime'):
-                        expiry_date = item.expiration_date.strftime(
-                            '%Y-%m-%dT%H:%M:%SZ')
-                    else:
-                        # If it's a string, ensure proper format
-                        expiry_date = str(item.expiration_date)
-                        if 'T' not in expiry_date:
-                            expiry_date += "T00:00:00Z"
-
-                batch_info = {
-                    "BatchNumber":
-                    item.batch_number,
-                    "Quantity":
-                    item.received_quantity,
-                    "BaseLineNumber":
-                    line_number,
-                    "ManufacturerSerialNumber":
-                    getattr(item, 'manufacturer_serial', None) or "MFG-SN-001",
-                    "InternalSerialNumber":
-                    getattr(item, 'internal_serial', None) or "INT-SN-001",
-                    "ExpiryDate":
-                    expiry_date
-                }
-
-                line["BatchNumbers"] = [batch_info]
-
-            document_lines.append(line)
-            line_number += 1
-
-        if not document_lines:
-            return {
-                'success':
-                False,
-                'error':
-                'No approved items found for Purchase Delivery Note creation'
-            }
-
-        # Build Purchase Delivery Note with EXACT user-specified structure
-        pdn_data = {
-            "CardCode": card_code,
-            "DocDate": doc_date,
-            "DocDueDate": doc_due_date,
-            "Comments": grpo_document.notes or "Auto-created from PO after QC",
-            "NumAtCard": external_ref,
-            "BPL_IDAssignedToInvoice": business_place_id,
-            "DocumentLines": document_lines
-        }
-
-        # Submit to SAP B1
-        url = f"{self.base_url}/b1s/v1/PurchaseDeliveryNotes"
-
-        # Log the payload for debugging - Enhanced JSON logging
-        import json
-        logging.info("=" * 80)
-        logging.info("PURCHASE DELIVERY NOTE - JSON PAYLOAD")
-        logging.info("=" * 80)
-        logging.info(json.dumps(pdn_data, indent=2, default=str))
-        logging.info("=" * 80)
-        print(pdn_data)
-        try:
-            response = self.session.post(url, json=pdn_data)
-            if response.status_code == 201:
-                result = response.json()
-                logging.info(
-                    f"Successfully created Purchase Delivery Note {result.get('DocNum')} for GRPO {grpo_document.id}"
-                )
-                return {
-                    'success':
-                    True,
-                    'document_number':
-                    result.get('DocNum'),
-                    'doc_entry':
-                    result.get('DocEntry'),
-                    'external_reference':
-                    external_ref,
-                    'message':
-                    f'Purchase Delivery Note {result.get("DocNum")} created successfully with reference {external_ref}'
-                }
-            else:
-                error_msg = f"SAP B1 error creating Purchase Delivery Note: {response.text}"
-                logging.error(error_msg)
-                return {'success': False, 'error': error_msg}
-        except Exception as e:
-            error_msg = f"Error creating Purchase Delivery Note in SAP B1: {str(e)}"
-            logging.error(error_msg)
-            return {'success': False, 'error': error_msg}
-
-    def post_grpo_to_sap(self, grpo_document):
-        """Post approved GRPO to SAP B1 as Purchase Delivery Note"""
-        if not self.ensure_logged_in():
-            logging.warning("Cannot post GRPO - SAP B1 not available")
-            return {'success': False, 'error': 'SAP B1 not available'}
-
-        try:
-            # Create Purchase Delivery Note to close PO
-            result = self.create_purchase_delivery_note(grpo_document)
-
-            if result.get('success'):
-                # Update WMS record with SAP document number
-                grpo_document.sap_document_number = str(
-                    result.get('document_number'))
-                grpo_document.status = 'posted'
-
-                from app import db
-                db.session.commit()
-
-                logging.info(
-                    f"GRPO posted to SAP B1 with Purchase Delivery Note: {result.get('document_number')}"
-                )
-                return {
-                    'success':
-                    True,
-                    'sap_document_number':
-                    result.get('document_number'),
-                    'message':
-                    f'GRPO posted to SAP B1 as Purchase Delivery Note {result.get("document_number")}'
-                }
-            else:
-                return {
-                    'success': False,
-                    'error': result.get('error', 'Unknown error occurred')
-                }
-        except Exception as e:
-            logging.error(f"Error posting GRPO to SAP: {str(e)}")
-            return {'success': False, 'error': str(e)}
-
-    def sync_all_master_data(self):
-        """Sync all master data from SAP B1"""
-        logging.info("Starting full SAP B1 master data synchronization...")
-
-        results = {
-            'warehouses': self.sync_warehouses(),
-            'bins': self.sync_bins(),
-            'business_partners': self.sync_business_partners()
-        }
-
-        success_count = sum(1 for result in results.values() if result)
-        logging.info(
-            f"Master data sync completed: {success_count}/{len(results)} successful"
-        )
-
-        return results
+def _max_mark(mark, other):
+    """Later of two (UpdateDate, UpdateTime) marks; either may be None"""
+    if not other:
+        return tuple(mark) if mark else None
+    if not mark:
+        return tuple(other)
+    return max(tuple(mark), tuple(other))
 
-    def logout(self):
-        """Logout from SAP B1"""
-        if self.session_id:
-            try:
-                logout_url = f"{self.base_url}/b1s/v1/Logout"
-                self.session.post(logout_url)
-                self.session_id = None
-                logging.info("Logged out from SAP B1")
-            except Exception as e:
-                logging.error(f"Error logging out from SAP B1: {str(e)}")
 
+def _odata_quote(value):
+    """Escape a string for use inside an OData '...' literal"""
+    return str(value).replace("'", "''")
 
-import requests
-import json
-import logging
-from datetime import datetime
-from app import app
 
-import urllib3
+def _may_have_reached_sap(error):
+    """Whether SAP may have created the document despite a failed POST
 
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    Only a connect timeout proves the request never arrived; a read timeout,
+    dropped connection or unreadable response may follow a successful post.
+    """
+    return not isinstance(error, requests.exceptions.ConnectTimeout)
 
 
 class SAPIntegration:
@@ -1743,53 +128,253 @@ class SAPIntegration:
         self.session = requests.Session()
         self.session.verify = False  # For development, in production use proper SSL
         self.is_offline = False
-
-        # Cache for frequently accessed data
-        self._warehouse_cache = {}
-        self._bin_cache = {}
-        self._branch_cache = {}
-        self._item_cache = {}
-        self._batch_cache = {}
+        self._pool = None
+        self._pooled = None
+        self._renew_lock = threading.Lock()
 
     def login(self):
-        """Login to SAP B1 Service Layer"""
+        """Check out a logged-in SAP B1 Service Layer session from the shared pool"""
         # Check if SAP configuration exists
         if not self.base_url or not self.username or not self.password or not self.company_db:
             logging.warning(
                 "SAP B1 configuration not complete. Running in offline mode.")
             return False
 
-        login_url = f"{self.base_url}/b1s/v1/Login"
-        login_data = {
-            "UserName": self.username,
-            "Password": self.password,
-            "CompanyDB": self.company_db
-        }
-
-        try:
-            response = self.session.post(login_url,
-                                         json=login_data,
-                                         timeout=10)
-            if response.status_code == 200:
-                self.session_id = response.json().get('SessionId')
-                logging.info("Successfully logged in to SAP B1")
-                return True
-            else:
-                logging.warning(
-                    f"SAP B1 login failed: {response.text}. Running in offline mode."
-                )
-                return False
-        except Exception as e:
-            logging.warning(
-                f"SAP B1 login error: {str(e)}. Running in offline mode.")
+        pool = get_session_pool(self.base_url, self.username, self.password,
+                                self.company_db,
+                                max_size=app.config.get('SAP_SESSION_POOL_SIZE', 4))
+        pooled = pool.acquire()
+        if not pooled:
             return False
 
+        self._pool = pool
+        self._pooled = pooled
+        self.session = pooled.session
+        self.session_id = pooled.session_id
+
+        # Hand the session back to the pool when the Flask request ends
+        if has_app_context():
+            g.setdefault('sap_integrations', []).append(self)
+        return True
+
     def ensure_logged_in(self):
         """Ensure we have a valid session"""
         if not self.session_id:
             return self.login()
         return True
 
+    def release(self):
+        """Return the borrowed SAP B1 session to the shared pool"""
+        if not self._pooled:
+            return
+        self._pool.release(self._pooled)
+        self._pooled = None
+        self.session_id = None
+        self.session = requests.Session()
+        self.session.verify = False
+
+    def _renew_session(self, stale_session_id=None):
+        """Log in again after SAP rejected the current session (401)"""
+        with self._renew_lock:
+            # Another fan_out() worker may already have logged in again
+            if stale_session_id and self.session_id != stale_session_id:
+                return True
+            if not self._pooled or not self._pool.renew(self._pooled):
+                return False
+            self.session_id = self._pooled.session_id
+            return True
+
+    def request(self, method, url, idempotent=None, memoize=True, **kwargs):
+        """Send a Service Layer request, sharing identical reads where possible
+
+        Within an HTTP request, successful GETs are memoized on flask.g, so
+        each distinct resource is fetched at most once per request, across
+        every SAPIntegration instance the request creates. Background runs
+        (scheduler, outbox) and collection pages (memoize=False) are not
+        memoized, since they would hold whole result sets in memory. GETs
+        for the same URL, query parameters and headers that are already in
+        flight in this worker wait for and share that call's response.
+        """
+        memo = g.setdefault('sap_read_memo', {}) if has_request_context() else None
+        if method.upper() != 'GET':
+            # A write may change what later reads in this request return
+            if memo:
+                memo.clear()
+            return self._send(method, url, idempotent, **kwargs)
+
+        target = requests.Request('GET', url, params=kwargs.get('params')).prepare().url
+        key = (self.base_url, self.company_db, self.username, target,
+               tuple(sorted((kwargs.get('headers') or {}).items())))
+        if memo is not None and key in memo:
+            return memo[key]
+
+        if app.config.get('SAP_COALESCE_READS', True):
+            response = in_flight_reads.do(
+                key, lambda: self._send(method, url, idempotent, **kwargs))
+        else:
+            response = self._send(method, url, idempotent, **kwargs)
+
+        if memo is not None and memoize and response.status_code == 200:
+            memo[key] = response
+        return response
+
+    def _send(self, method, url, idempotent=None, **kwargs):
+        """Send a Service Layer request, re-authenticating and retrying as needed
+
+        A 401 (expired/invalid session) triggers one re-login and replay for
+        any method, since SAP rejected the call before doing any work. Reads
+        are also retried on 5xx responses and dropped connections with
+        bounded exponential backoff; writes are only retried if the
+        connection could not be established at all.
+        """
+        if idempotent is None:
+            idempotent = method.upper() == 'GET'
+        max_retries = app.config.get('SAP_REQUEST_RETRIES', 3)
+        backoff = app.config.get('SAP_RETRY_BACKOFF', 0.5)
+        kwargs.setdefault('timeout', app.config.get('SAP_REQUEST_TIMEOUT', 60))
+
+        attempt = 0
+        reauthenticated = False
+        while True:
+            session_id = self.session_id
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                retryable = isinstance(e, requests.exceptions.ConnectTimeout) or (
+                    idempotent and isinstance(e, (requests.exceptions.ConnectionError,
+                                                  requests.exceptions.Timeout)))
+                if not retryable or attempt >= max_retries:
+                    raise
+                delay = min(backoff * (2 ** attempt), MAX_RETRY_BACKOFF)
+                logging.warning(
+                    f"SAP B1 {method} {url} failed ({e}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            if self._pooled:
+                self._pooled.touch()
+
+            if response.status_code == 401 and not reauthenticated:
+                logging.info("SAP B1 session expired (401) - logging in again")
+                reauthenticated = True
+                if self._renew_session(session_id):
+                    continue
+                return response
+
+            if (response.status_code in RETRYABLE_STATUS_CODES and idempotent
+                    and attempt < max_retries):
+                delay = min(backoff * (2 ** attempt), MAX_RETRY_BACKOFF)
+                logging.warning(
+                    f"SAP B1 {method} {url} returned {response.status_code}; retrying in {delay:.1f}s")
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            return response
+
+    def get(self, url, **kwargs):
+        """GET from the Service Layer via request()"""
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        """POST to the Service Layer via request()"""
+        return self.request('POST', url, **kwargs)
+
+    def iter_collection(self, url, params=None):
+        """Yield every record of a Service Layer collection, page by page
+
+        Follows odata.nextLink so results are not cut off at SAP's default
+        page size of 20, and asks for SAP_PAGE_SIZE records per page via
+        Prefer: odata.maxpagesize. Raises requests.HTTPError if a page fails.
+        """
+        headers = {
+            'Prefer': f"odata.maxpagesize={app.config.get('SAP_PAGE_SIZE', 500)}"
+        }
+        while url:
+            response = self.get(url, params=params, headers=headers, memoize=False)
+            response.raise_for_status()
+            data = response.json()
+            yield from data.get('value', [])
+
+            next_link = data.get('odata.nextLink') or data.get('@odata.nextLink')
+            url = urljoin(f"{self.base_url}/b1s/v1/", next_link) if next_link else None
+            params = None  # nextLink already carries the query options
+
+    def fan_out(self, func, items):
+        """Run func(item) for independent lookups concurrently, keeping order
+
+        Worker threads share this instance's logged-in session, so call
+        ensure_logged_in() first. Parallelism is capped per SAP server by
+        SAP_MAX_CONCURRENCY across all requests in this worker process.
+        """
+        items = list(items)
+        max_concurrent = app.config.get('SAP_MAX_CONCURRENCY', 4)
+        if len(items) <= 1 or max_concurrent <= 1:
+            return [func(item) for item in items]
+
+        limiter = get_concurrency_limiter(self.base_url, max_concurrent)
+
+        def run(item):
+            with limiter:
+                return func(item)
+
+        with ThreadPoolExecutor(max_workers=min(max_concurrent, len(items))) as executor:
+            return list(executor.map(run, items))
+
+    def batch_get(self, requests_to_send):
+        """Fetch several Service Layer GETs in a single $batch round trip
+
+        Takes URLs or (url, params) tuples and returns response-like objects
+        (status_code, text, json()) in the same order. Falls back to
+        individual GETs if the $batch call itself is rejected.
+        """
+        entries = [entry if isinstance(entry, tuple) else (entry, None)
+                   for entry in requests_to_send]
+        chunk_size = app.config.get('SAP_BATCH_MAX_REQUESTS', 50)
+
+        results = []
+        for start in range(0, len(entries), chunk_size):
+            results.extend(self._send_batch(entries[start:start + chunk_size]))
+        return results
+
+    def _send_batch(self, entries):
+        """Send one multipart $batch request and demultiplex its responses"""
+        boundary = f"batch_{uuid.uuid4()}"
+        body = []
+        for url, params in entries:
+            prepared = requests.Request('GET', url, params=params).prepare()
+            target = urlsplit(prepared.url)
+            path = f"{target.path}?{target.query}" if target.query else target.path
+            body.append(f"--{boundary}\r\n"
+                        "Content-Type: application/http\r\n"
+                        "Content-Transfer-Encoding: binary\r\n\r\n"
+                        f"GET {path}\r\n\r\n")
+        body.append(f"--{boundary}--\r\n")
+
+        try:
+            # Straight to _send: the batch only reads, so it must not clear
+            # the per-request read memo the way request() does for writes
+            response = self._send(
+                'POST', f"{self.base_url}/b1s/v1/$batch",
+                data=''.join(body).encode('utf-8'),
+                headers={'Content-Type': f'multipart/mixed;boundary={boundary}'},
+                idempotent=True)
+            if response.status_code in (200, 202):
+                parts = _parse_batch_response(response)
+                if len(parts) == len(entries):
+                    return parts
+                logging.warning(
+                    f"SAP B1 $batch returned {len(parts)} parts for {len(entries)} requests")
+            else:
+                logging.warning(
+                    f"SAP B1 $batch failed: {response.status_code} - {response.text}")
+        except Exception as e:
+            logging.warning(f"SAP B1 $batch error: {str(e)}")
+
+        logging.info(f"Falling back to {len(entries)} individual SAP B1 requests")
+        return self.fan_out(lambda entry: self.get(entry[0], params=entry[1]), entries)
+
     def get_inventory_transfer_request(self, doc_num):
         """Get specific inventory transfer request from SAP B1"""
         if not self.ensure_logged_in():
@@ -1833,7 +418,7 @@ class SAPIntegration:
                 url = f"{self.base_url}/b1s/v1/{endpoint}"
                 logging.info(f"🔍 Trying SAP B1 API: {url}")
 
-                response = self.session.get(url)
+                response = self.get(url)
                 logging.info(f"📡 Response status: {response.status_code}")
 
                 if response.status_code == 200:
@@ -1891,41 +476,50 @@ class SAPIntegration:
 
     def get_bins(self, warehouse_code):
         """Get bins for a specific warehouse"""
+        cached = get_cache('bins').get(('bins', warehouse_code))
+        if cached is not None:
+            return cached
+
         if not self.ensure_logged_in():
             return []
 
         try:
-            url = f"{self.base_url}/b1s/v1/BinLocations?$filter=Warehouse eq '{warehouse_code}'"
-            response = self.session.get(url)
-
-            if response.status_code == 200:
-                data = response.json()
-                bins = data.get('value', [])
-
-                # Transform the data to match our expected format
-                formatted_bins = []
-                for bin_data in bins:
-                    formatted_bins.append({
-                        'BinCode':
-                        bin_data.get('BinCode'),
-                        'Description':
-                        bin_data.get('Description', ''),
-                        'Warehouse':
-                        bin_data.get('Warehouse'),
-                        'Active':
-                        bin_data.get('Active', 'Y')
-                    })
-
-                return formatted_bins
-            else:
-                logging.error(f"Failed to get bins: {response.status_code}")
-                return []
+            url = f"{self.base_url}/b1s/v1/BinLocations?$filter=Warehouse eq '{warehouse_code}'&$select={select_fields('BinLocations')}"
+
+            # Transform the data to match our expected format
+            formatted_bins = []
+            for bin_data in self.iter_collection(url):
+                formatted_bins.append({
+                    'BinCode':
+                    bin_data.get('BinCode'),
+                    'Description':
+                    bin_data.get('Description', ''),
+                    'Warehouse':
+                    bin_data.get('Warehouse'),
+                    'Active':
+                    bin_data.get('Active', 'Y')
+                })
+
+            get_cache('bins').set(('bins', warehouse_code), formatted_bins)
+            return formatted_bins
         except Exception as e:
             logging.error(f"Error getting bins: {str(e)}")
             return []
 
-    def get_purchase_order(self, po_number):
-        """Get purchase order details from SAP B1"""
+    def get_purchase_order(self, po_number, fresh=False):
+        """Get purchase order details from SAP B1
+
+        Returns a copy the caller may modify. A cached PO can be up to the
+        purchase_orders TTL old, open quantities included, and other users
+        may have received against it since; pass fresh=True where open
+        quantities must be current (receipt validation, posting). A fresh
+        read also refreshes the cache.
+        """
+        if not fresh:
+            cached = get_cache('purchase_orders').get(str(po_number))
+            if cached is not None:
+                return copy.deepcopy(cached)
+
         if not self.ensure_logged_in():
             # Return mock data for offline mode
             return {
@@ -1964,13 +558,14 @@ class SAPIntegration:
                 }]
             }
 
-        url = f"{self.base_url}/b1s/v1/PurchaseOrders?$filter=DocNum eq {po_number}"
+        url = f"{self.base_url}/b1s/v1/PurchaseOrders?$filter=DocNum eq {po_number}&$select={select_fields('PurchaseOrders')}"
 
         try:
-            response = self.session.get(url, timeout=10)
+            response = self.get(url, timeout=10)
             if response.status_code == 200:
                 data = response.json()
                 if data['value']:
+                    get_cache('purchase_orders').set(str(po_number), copy.deepcopy(data['value'][0]))
                     return data['value'][0]
             return None
         except Exception as e:
@@ -2003,10 +598,10 @@ class SAPIntegration:
                 }]
             }
 
-    def get_purchase_order_items(self, po_number):
-        """Get purchase order line items"""
+    def get_purchase_order_items(self, po_number, fresh=False):
+        """Get purchase order line items (fresh: bypass the PO cache)"""
         try:
-            po_data = self.get_purchase_order(po_number)
+            po_data = self.get_purchase_order(po_number, fresh=fresh)
             if po_data:
                 return po_data.get('DocumentLines', [])
         except Exception as e:
@@ -2017,15 +612,21 @@ class SAPIntegration:
 
     def get_item_master(self, item_code):
         """Get item master data from SAP B1"""
+        cached = get_cache('items').get(('master', item_code))
+        if cached is not None:
+            return cached
+
         if not self.ensure_logged_in():
             return None
 
-        url = f"{self.base_url}/b1s/v1/Items('{item_code}')"
+        url = f"{self.base_url}/b1s/v1/Items('{item_code}')?$select={select_fields('Items')}"
 
         try:
-            response = self.session.get(url)
+            response = self.get(url)
             if response.status_code == 200:
-                return response.json()
+                item_data = response.json()
+                get_cache('items').set(('master', item_code), item_data)
+                return item_data
             return None
         except Exception as e:
             logging.error(f"Error fetching item {item_code}: {str(e)}")
@@ -2033,17 +634,24 @@ class SAPIntegration:
 
     def get_warehouse_bins(self, warehouse_code):
         """Get bins for a warehouse"""
+        cached = get_cache('bins').get(('warehouse_bins', warehouse_code))
+        if cached is not None:
+            return cached
+
         if not self.ensure_logged_in():
             return []
 
-        url = f"{self.base_url}/b1s/v1/BinLocations?$filter=Warehouse eq '{warehouse_code}'"
+        url = f"{self.base_url}/b1s/v1/BinLocations"
+        params = {
+            '$filter': f"Warehouse eq '{_odata_quote(warehouse_code)}'",
+            '$select': select_fields('BinLocations')
+        }
 
         try:
-            response = self.session.get(url)
-            if response.status_code == 200:
-                data = response.json()
-                return data.get('value', [])
-            return []
+            # Every page - large warehouses have more bins than one page holds
+            bins = list(self.iter_collection(url, params=params))
+            get_cache('bins').set(('warehouse_bins', warehouse_code), bins)
+            return bins
         except Exception as e:
             logging.error(
                 f"Error fetching bins for warehouse {warehouse_code}: {str(e)}"
@@ -2074,22 +682,30 @@ class SAPIntegration:
             }]
 
         try:
-            # Step 1: Get bin information and validate bin code exists
-            bin_info_url = f"{self.base_url}/b1s/v1/BinLocations?$filter=BinCode eq '{bin_code}'"
-            bin_response = self.session.get(bin_info_url)
+            # Step 1: Get bin information and validate bin code exists,
+            # from the local bin directory when the bin is known there
+            local_bin = bin_directory.lookup(bin_code)
+            if local_bin:
+                warehouse_code = local_bin['Warehouse']
+                abs_entry = local_bin['AbsEntry']
+            else:
+                bin_info_url = f"{self.base_url}/b1s/v1/BinLocations?$filter=BinCode eq '{bin_code}'&$select={select_fields('BinLocations')}"
+                bin_response = self.get(bin_info_url)
 
-            if bin_response.status_code != 200:
-                logging.warning(f"Bin {bin_code} not found in SAP B1")
-                return []
+                if bin_response.status_code != 200:
+                    logging.warning(f"Bin {bin_code} not found in SAP B1")
+                    return []
 
-            bin_data = bin_response.json().get('value', [])
-            if not bin_data:
-                logging.warning(f"Bin {bin_code} does not exist")
-                return []
+                bin_data = bin_response.json().get('value', [])
+                if not bin_data:
+                    logging.warning(f"Bin {bin_code} does not exist")
+                    return []
 
-            bin_info = bin_data[0]
-            warehouse_code = bin_info.get('Warehouse', '')
-            abs_entry = bin_info.get('AbsEntry', 0)
+                bin_info = bin_data[0]
+                warehouse_code = bin_info.get('Warehouse', '')
+                abs_entry = bin_info.get('AbsEntry', 0)
+                bin_directory.remember(bin_code, abs_entry, warehouse_code,
+                                       bin_info.get('Inactive') != 'Y')
 
             logging.info(
                 f"Found bin {bin_code} in warehouse {warehouse_code} (AbsEntry: {abs_entry})"
@@ -2105,7 +721,7 @@ class SAPIntegration:
                 '$select': 'BusinessPlaceID,WarehouseCode,DefaultBin'
             }
 
-            stock_response = self.session.get(stock_url, params=params)
+            stock_response = self.get(stock_url, params=params)
             print(stock_url)
             print(params)
             if stock_response.status_code != 200:
@@ -2122,18 +738,31 @@ class SAPIntegration:
                 f"Found {len(stock_data)} items with stock in warehouse {warehouse_code}"
             )
             # Step 3: Get batch details for items (using your API example)
-            formatted_items = []
-            for stock_item in stock_data[:
-                                         10]:  # Limit to first 10 items for performance
+            stock_items = stock_data[:10]  # Limit to first 10 items for performance
+
+            def fetch_batches(stock_item):
                 default_Bin = stock_item.get('DefaultBin', '')
                 if not default_Bin:
-                    continue
-
+                    return None, None
                 # Get batch information for this item
                 batch_url = f"{self.base_url}/b1s/v1/BatchNumberDetails?$filter=SystemNumber eq {default_Bin} and Status eq 'bdsStatus_Released'"
                 print(batch_url)
                 try:
-                    batch_response = self.session.get(batch_url)
+                    return self.get(batch_url), None
+                except Exception as batch_error:
+                    return None, batch_error
+
+            formatted_items = []
+            batch_results = self.fan_out(fetch_batches, stock_items)
+            for stock_item, (batch_response, batch_lookup_error) in zip(
+                    stock_items, batch_results):
+                default_Bin = stock_item.get('DefaultBin', '')
+                if not default_Bin:
+                    continue
+
+                try:
+                    if batch_lookup_error:
+                        raise batch_lookup_error
                     if batch_response.status_code == 200:
                         batch_data = batch_response.json().get('value', [])
                         print(batch_data)
@@ -2213,6 +842,10 @@ class SAPIntegration:
 
     def get_available_bins(self, warehouse_code):
         """Get available bins for a warehouse"""
+        cached = get_cache('bins').get(('available_bins', warehouse_code))
+        if cached is not None:
+            return cached
+
         if not self.ensure_logged_in():
             # Return fallback bins if SAP is not available
             return []
@@ -2221,22 +854,18 @@ class SAPIntegration:
             # Get bins from SAP B1
             url = f"{self.base_url}/b1s/v1/BinLocations"
             params = {
-                '$filter': f"Warehouse eq '{warehouse_code}' and Active eq 'Y'"
+                '$filter': f"Warehouse eq '{warehouse_code}' and Active eq 'Y'",
+                '$select': select_fields('BinLocations')
             }
 
-            response = self.session.get(url, params=params)
-            if response.status_code == 200:
-                data = response.json()
-                bins = []
-                for bin_data in data.get('value', []):
-                    bins.append({
-                        'BinCode': bin_data.get('BinCode'),
-                        'Description': bin_data.get('Description', '')
-                    })
-                return bins
-            else:
-                logging.error(f"Failed to get bins from SAP: {response.text}")
-                return []
+            bins = []
+            for bin_data in self.iter_collection(url, params=params):
+                bins.append({
+                    'BinCode': bin_data.get('BinCode'),
+                    'Description': bin_data.get('Description', '')
+                })
+            get_cache('bins').set(('available_bins', warehouse_code), bins)
+            return bins
 
         except Exception as e:
             logging.error(f"Error getting bins from SAP: {str(e)}")
@@ -2256,7 +885,7 @@ class SAPIntegration:
         url = f"{self.base_url}/b1s/v1/PurchaseDeliveryNotes"
 
         # Get PO data to ensure we have correct supplier code
-        po_data = self.get_purchase_order(grpo_document.po_number)
+        po_data = self.get_purchase_order(grpo_document.po_number, fresh=True)
         if not po_data:
             return {
                 'success': False,
@@ -2310,9 +939,11 @@ class SAPIntegration:
         }
 
         try:
-            response = self.session.post(url, json=grpo_data)
+            response = self.post(url, json=grpo_data)
             if response.status_code == 201:
                 result = response.json()
+                # Open quantities on the PO have changed
+                invalidate('purchase_orders', str(grpo_document.po_number))
                 return {
                     'success': True,
                     'document_number': result.get('DocNum')
@@ -2328,16 +959,23 @@ class SAPIntegration:
 
     def get_bin_abs_entry(self, bin_code, warehouse_code):
         """Get bin AbsEntry from SAP B1 for bin allocation"""
+        local_bin = bin_directory.lookup(bin_code)
+        if local_bin and local_bin['Warehouse'] == warehouse_code:
+            return local_bin['AbsEntry']
+
         if not self.ensure_logged_in():
             return None
 
         try:
-            url = f"{self.base_url}/b1s/v1/BinLocations?$filter=BinCode eq '{bin_code}' and Warehouse eq '{warehouse_code}'"
-            response = self.session.get(url)
+            url = f"{self.base_url}/b1s/v1/BinLocations?$filter=BinCode eq '{bin_code}' and Warehouse eq '{warehouse_code}'&$select={select_fields('BinLocations')}"
+            response = self.get(url)
 
             if response.status_code == 200:
                 bins = response.json().get('value', [])
                 if bins:
+                    bin_directory.remember(bin_code, bins[0].get('AbsEntry'),
+                                           warehouse_code,
+                                           bins[0].get('Inactive') != 'Y')
                     return bins[0].get('AbsEntry')
             return None
         except Exception as e:
@@ -2348,8 +986,9 @@ class SAPIntegration:
     def get_batch_numbers(self, item_code):
         """Get batch numbers for specific item from SAP B1 BatchNumberDetails"""
         # Check cache first
-        if item_code in self._batch_cache:
-            return self._batch_cache[item_code]
+        cached = get_cache('batches').get(('batch_numbers', item_code))
+        if cached is not None:
+            return cached
 
         if not self.ensure_logged_in():
             logging.warning(
@@ -2371,14 +1010,13 @@ class SAPIntegration:
                 "ManufacturingDate": None,
                 "AdmissionDate": "2025-01-01T00:00:00Z"
             }]
-            self._batch_cache[item_code] = mock_batches
             return mock_batches
 
         try:
             url = f"{self.base_url}/b1s/v1/BatchNumberDetails?$filter=ItemCode eq '{item_code}'"
             logging.info(f"🔍 Fetching batch numbers from SAP B1: {url}")
             print("inin"+url)
-            response = self.session.get(url)
+            response = self.get(url)
             if response.status_code == 200:
                 data = response.json()
                 batches = data.get('value', [])
@@ -2387,7 +1025,7 @@ class SAPIntegration:
                 )
 
                 # Cache the results
-                self._batch_cache[item_code] = batches
+                get_cache('batches').set(('batch_numbers', item_code), batches)
                 return batches
             else:
                 logging.warning(
@@ -2405,6 +1043,11 @@ class SAPIntegration:
             f"🔍 Getting batches for item {item_code} in warehouse {warehouse_code}"
         )
 
+        cache_key = ('item_batches', item_code, warehouse_code)
+        cached = get_cache('batches').get(cache_key)
+        if cached is not None:
+            return cached
+
         if not self.ensure_logged_in():
             logging.warning("⚠️ No SAP B1 session - returning mock batch data")
             return self._get_mock_batch_data(item_code)
@@ -2417,19 +1060,11 @@ class SAPIntegration:
 
             url = f"{self.base_url}/b1s/v1/BatchNumberDetails?$filter={filter_clause}&$select=BatchNumber,OnHandQuantity,ExpiryDate,ManufacturingDate,Warehouse"
 
-            response = self.session.get(url)
-
-            if response.status_code == 200:
-                data = response.json()
-                batches = data.get('value', [])
-                logging.info(
-                    f"✅ Found {len(batches)} batches for item {item_code}")
-                return batches
-            else:
-                logging.error(
-                    f"❌ SAP B1 API error getting batches: {response.status_code}"
-                )
-                return self._get_mock_batch_data(item_code)
+            batches = list(self.iter_collection(url))
+            logging.info(
+                f"✅ Found {len(batches)} batches for item {item_code}")
+            get_cache('batches').set(cache_key, batches)
+            return batches
 
         except Exception as e:
             logging.error(f"❌ Error getting batches from SAP B1: {str(e)}")
@@ -2456,7 +1091,7 @@ class SAPIntegration:
 
             url = f"{self.base_url}/b1s/v1/BatchNumberDetails?$filter={filter_clause}"
 
-            response = self.session.get(url)
+            response = self.get(url)
 
             if response.status_code == 200:
                 data = response.json()
@@ -2513,17 +1148,48 @@ class SAPIntegration:
             'Warehouse': 'ORD-CHN'
         }]
 
+    def _posting_unavailable(self, document):
+        """Result of a posting that could not log in - never a simulated success,
+        so the outbox retries it instead of recording a document SAP never got"""
+        logging.warning(f"SAP B1 not available - {document} was not posted")
+        return {
+            'success': False,
+            'error': f'SAP B1 is not available - {document} was not posted',
+            'retry_after': app.config.get('SAP_OUTBOX_RETRY_BACKOFF_SECONDS', 30)
+        }
+
+    def find_posted_document(self, entity, key_field, idempotency_key):
+        """The entity document whose key_field holds idempotency_key, or None
+
+        Raises if SAP B1 cannot be searched, so callers never mistake an
+        outage for "not posted yet".
+        """
+        response = self.get(f"{self.base_url}/b1s/v1/{entity}", params={
+            '$filter': f"{key_field} eq '{_odata_quote(idempotency_key)}'",
+            '$select': 'DocEntry,DocNum',
+            '$orderby': 'DocEntry'
+        })
+        response.raise_for_status()
+        matches = response.json().get('value', [])
+        return matches[0] if matches else None
+
     def create_inventory_transfer(self, transfer_document):
-        """Create Stock Transfer in SAP B1 with correct JSON structure"""
+        """Create Stock Transfer in SAP B1 with correct JSON structure
+
+        Safe to retry: the transfer is posted at most once per WMS transfer
+        (see sap_posting_ledger.py).
+        """
         if not self.ensure_logged_in():
-            logging.warning(
-                "SAP B1 not available, simulating transfer creation for testing"
-            )
-            return {
-                'success': True,
-                'document_number': f'ST-{transfer_document.id}'
-            }
+            return self._posting_unavailable(f'Inventory transfer {transfer_document.id}')
 
+        key = posting_key('inventory_transfer', transfer_document.id)
+        return posting_ledger.post_once(
+            key, 'inventory_transfer', transfer_document.id,
+            lookup=lambda: self.find_posted_document('StockTransfers', 'JournalMemo', key),
+            post=lambda: self._post_inventory_transfer(transfer_document, key))
+
+    def _post_inventory_transfer(self, transfer_document, idempotency_key):
+        """POST the Stock Transfer; JournalMemo carries the idempotency key"""
         url = f"{self.base_url}/b1s/v1/StockTransfers"
 
         # Get transfer request data for BaseEntry reference
@@ -2532,11 +1198,16 @@ class SAPIntegration:
         base_entry = transfer_request_data.get(
             'DocEntry') if transfer_request_data else None
 
+        # Get item details for accurate UoM and pricing, one lookup per distinct item
+        transfer_items = list(transfer_document.items)
+        item_codes = list(dict.fromkeys(item.item_code for item in transfer_items))
+        item_details_by_code = dict(
+            zip(item_codes, self.fan_out(self.get_item_details, item_codes)))
+
         # Build stock transfer lines with enhanced structure
         stock_transfer_lines = []
-        for index, item in enumerate(transfer_document.items):
-            # Get item details for accurate UoM and pricing
-            item_details = self.get_item_details(item.item_code)
+        for index, item in enumerate(transfer_items):
+            item_details = item_details_by_code.get(item.item_code)
 
             # Use actual item UoM if available
             actual_uom = item_details.get(
@@ -2614,6 +1285,7 @@ class SAPIntegration:
             "DocDate": datetime.now().strftime('%Y-%m-%d'),
             "Comments":
             f"QC Approved WMS Transfer {transfer_document.id} by {transfer_document.qc_approver.username if transfer_document.qc_approver else 'System'}",
+            "JournalMemo": idempotency_key,
             "FromWarehouse": transfer_document.from_warehouse,
             "ToWarehouse": transfer_document.to_warehouse,
             "StockTransferLines": stock_transfer_lines
@@ -2624,7 +1296,7 @@ class SAPIntegration:
         logging.info(f"JSON payload: {json.dumps(transfer_data, indent=2)}")
 
         try:
-            response = self.session.post(url, json=transfer_data)
+            response = self.post(url, json=transfer_data)
             logging.info(f"📡 SAP B1 response status: {response.status_code}")
 
             if response.status_code == 201:
@@ -2634,20 +1306,42 @@ class SAPIntegration:
                 )
                 return {
                     'success': True,
-                    'document_number': result.get('DocNum')
+                    'document_number': result.get('DocNum'),
+                    'doc_entry': result.get('DocEntry')
                 }
             else:
                 error_msg = f"SAP B1 error: {response.text}"
                 logging.error(
                     f"❌ Failed to create stock transfer: {error_msg}")
-                return {'success': False, 'error': error_msg}
+                return {'success': False, 'error': error_msg,
+                        'outcome_unknown': response.status_code >= 500}
         except Exception as e:
             logging.error(
                 f"❌ Error creating stock transfer in SAP B1: {str(e)}")
-            return {'success': False, 'error': str(e)}
+            return {'success': False, 'error': str(e),
+                    'outcome_unknown': _may_have_reached_sap(e)}
 
     def get_item_details(self, item_code):
-        """Get detailed item information from SAP B1"""
+        """Get detailed item information, from the local items mirror when the
+        item has been synced, otherwise from SAP B1"""
+        local_item = item_directory.lookup(item_code)
+        if local_item:
+            return {
+                'ItemCode': local_item['ItemCode'],
+                'ItemName': local_item['ItemName'],
+                'UoMGroupEntry': local_item['UoMGroupEntry'],
+                'UoMCode': local_item['InventoryUOM'] or 'EA',
+                'InventoryUoM': local_item['InventoryUOM'] or 'EA',
+                'DefaultWarehouse': local_item['DefaultWarehouse'],
+                'ItemType': local_item['ItemType'],
+                'ManageSerialNumbers': local_item['ManageSerialNumbers'],
+                'ManageBatchNumbers': local_item['ManageBatchNumbers']
+            }
+
+        cached = get_cache('items').get(('details', item_code))
+        if cached is not None:
+            return cached
+
         if not self.ensure_logged_in():
             return {
                 'ItemCode': item_code,
@@ -2663,17 +1357,17 @@ class SAPIntegration:
             }
 
         try:
-            url = f"{self.base_url}/b1s/v1/Items('{item_code}')"
-            response = self.session.get(url)
+            url = f"{self.base_url}/b1s/v1/Items('{item_code}')?$select={select_fields('Items')}"
+            response = self.get(url)
 
             if response.status_code == 200:
                 item_data = response.json()
 
                 # Get UoM details
                 uom_group_entry = item_data.get('UoMGroupEntry')
-                inventory_uom = item_data.get('InventoryUoM', 'EA')
+                inventory_uom = item_data.get('InventoryUOM', 'EA')
 
-                return {
+                item_details = {
                     'ItemCode': item_data.get('ItemCode'),
                     'ItemName': item_data.get('ItemName'),
                     'UoMGroupEntry': uom_group_entry,
@@ -2685,6 +1379,8 @@ class SAPIntegration:
                     item_data.get('ManageSerialNumbers'),
                     'ManageBatchNumbers': item_data.get('ManageBatchNumbers')
                 }
+                get_cache('items').set(('details', item_code), item_details)
+                return item_details
             else:
                 logging.error(
                     f"Failed to get item details for {item_code}: {response.text}"
@@ -2722,7 +1418,7 @@ class SAPIntegration:
         }
 
         try:
-            response = self.session.post(url, json=count_data)
+            response = self.post(url, json=count_data)
             if response.status_code == 201:
                 result = response.json()
                 return {
@@ -2739,6 +1435,73 @@ class SAPIntegration:
                 f"Error creating inventory counting in SAP B1: {str(e)}")
             return {'success': False, 'error': str(e)}
 
+    def _sync_plan(self, entity, full=None):
+        """Choose a full or incremental pass: returns (full, sync state, delta $filter, checkpoint).
+
+        A pass that failed part-way left a checkpoint on the sync state and
+        is resumed from it, unless a different kind of pass is forced.
+        """
+        from app import db
+        from models import SAPSyncState
+
+        state = SAPSyncState.query.filter_by(entity=entity).first()
+        if state is None:
+            state = SAPSyncState(entity=entity)
+            db.session.add(state)
+
+        if not app.config.get('SAP_DELTA_SYNC', True):
+            full = True
+
+        checkpoint = json.loads(state.checkpoint) if state.checkpoint else None
+        if checkpoint and full is not None and checkpoint['full'] != full:
+            checkpoint = None
+
+        if checkpoint:
+            full = checkpoint['full']
+            logging.info(
+                f"Resuming {entity} sync from checkpoint ({checkpoint['count']} records already synced)")
+        else:
+            if full is None:
+                # Periodic full reconciliation catches deletions and anything a
+                # delta pass missed
+                full_every = timedelta(hours=app.config.get('SAP_FULL_SYNC_HOURS', 168))
+                full = (state.last_update_date is None
+                        or state.last_full_sync_at is None
+                        or datetime.utcnow() - state.last_full_sync_at >= full_every)
+            checkpoint = {
+                'full': full,
+                # Database time, compared with updated_at when reconciling
+                'started_at': str(db.session.execute(db.text("SELECT CURRENT_TIMESTAMP")).scalar()),
+                'last_key': None,
+                'done': [],
+                'mark': None,
+                'count': 0
+            }
+
+        if full:
+            return True, state, None, checkpoint
+        return False, state, _delta_filter(entity, state.last_update_date,
+                                           state.last_update_time), checkpoint
+
+    def _save_checkpoint(self, state, checkpoint):
+        """Persist pass progress with the chunk it belongs to (caller commits)"""
+        state.checkpoint = json.dumps(checkpoint)
+
+    def _record_sync(self, state, full, mark, count):
+        """Advance the high-water mark after a completed pass (caller commits)"""
+        if state is None:
+            return
+        if mark and (state.last_update_date is None or mark >
+                     (state.last_update_date, state.last_update_time or '')):
+            state.last_update_date = mark[0]
+            state.last_update_time = mark[1] or None
+        now = datetime.utcnow()
+        if full:
+            state.last_full_sync_at = now
+        state.last_sync_at = now
+        state.last_sync_count = count
+        state.checkpoint = None
+
     def sync_warehouses(self):
         """Sync warehouses from SAP B1 to local database"""
         if not self.ensure_logged_in():
@@ -2746,355 +1509,419 @@ class SAPIntegration:
             return False
 
         try:
-            url = f"{self.base_url}/b1s/v1/Warehouses"
-            response = self.session.get(url)
-
-            if response.status_code == 200:
-                warehouses = response.json().get('value', [])
-
-                from app import db
-
-                # Clear cache and update database
-                self._warehouse_cache = {}
+            url = f"{self.base_url}/b1s/v1/Warehouses?$select={select_fields('Warehouses')}"
+            warehouses = self.iter_collection(url)
 
-                for wh in warehouses:
-                    # Check if warehouse exists in branches table
-                    existing = db.session.execute(
-                        db.text("SELECT id FROM branches WHERE id = :id"), {
-                            "id": wh.get('WarehouseCode')
-                        }).fetchone()
-
-                    if not existing:
-                        # Insert new warehouse as branch - use compatible SQL
-                        import os
-                        from app import app
-                        db_uri = app.config.get('SQLALCHEMY_DATABASE_URI', '')
-
-                        if 'postgresql' in db_uri.lower(
-                        ) or 'mysql' in db_uri.lower():
-                            insert_sql = """
-                                INSERT INTO branches (id, name, address, is_active, created_at, updated_at)
-                                VALUES (:id, :name, :address, :is_active, NOW(), NOW())
-                            """
-                        else:
-                            insert_sql = """
-                                INSERT INTO branches (id, name, address, is_active, created_at, updated_at)
-                                VALUES (:id, :name, :address, :is_active, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                            """
-
-                        db.session.execute(
-                            db.text(insert_sql), {
-                                "id": wh.get('WarehouseCode'),
-                                "name": wh.get('WarehouseName', ''),
-                                "address": wh.get('Street', ''),
-                                "is_active": wh.get('Inactive') != 'Y'
-                            })
-                    else:
-                        # Update existing warehouse - use compatible SQL
-                        import os
-                        from app import app
-                        db_uri = app.config.get('SQLALCHEMY_DATABASE_URI', '')
-
-                        if 'postgresql' in db_uri.lower(
-                        ) or 'mysql' in db_uri.lower():
-                            update_sql = """
-                                UPDATE branches SET 
-                                    name = :name, 
-                                    address = :address, 
-                                    is_active = :is_active,
-                                    updated_at = NOW()
-                                WHERE id = :id
-                            """
-                        else:
-                            update_sql = """
-                                UPDATE branches SET 
-                                    name = :name, 
-                                    address = :address, 
-                                    is_active = :is_active,
-                                    updated_at = CURRENT_TIMESTAMP
-                                WHERE id = :id
-                            """
-
-                        db.session.execute(
-                            db.text(update_sql), {
-                                "id": wh.get('WarehouseCode'),
-                                "name": wh.get('WarehouseName', ''),
-                                "address": wh.get('Street', ''),
-                                "is_active": wh.get('Inactive') != 'Y'
-                            })
+            from app import db
 
-                    # Cache warehouse data
-                    self._warehouse_cache[wh.get('WarehouseCode')] = {
-                        'WarehouseCode': wh.get('WarehouseCode'),
-                        'WarehouseName': wh.get('WarehouseName'),
-                        'Address': wh.get('Street'),
-                        'Active': wh.get('Inactive') != 'Y'
-                    }
+            # Upsert warehouses as branches in multi-row chunks
+            warehouse_count = bulk_upsert('branches', (
+                {
+                    "id": wh.get('WarehouseCode'),
+                    "name": wh.get('WarehouseName', ''),
+                    "address": wh.get('Street', ''),
+                    "is_active": wh.get('Inactive') != 'Y'
+                } for wh in warehouses if wh.get('WarehouseCode')), ['id'])
 
-                db.session.commit()
-                logging.info(
-                    f"Synced {len(warehouses)} warehouses from SAP B1")
-                return True
+            db.session.commit()
+            invalidate('warehouses')
+            invalidate('business_place_ids')
+            logging.info(
+                f"Synced {warehouse_count} warehouses from SAP B1")
+            return True
 
         except Exception as e:
             logging.error(f"Error syncing warehouses: {str(e)}")
             return False
 
-    def sync_bins(self, warehouse_code=None):
-        """Sync bin locations from SAP B1"""
+    def _upsert_bins(self, bins, on_chunk=None):
+        """Upsert BinLocations records; returns (records read, high-water mark).
+
+        on_chunk(rows, records read, mark) runs after each chunk is written.
+        """
+        bin_count = 0
+        mark = None
+
+        def bin_rows():
+            nonlocal bin_count, mark
+            for bin_data in bins:
+                bin_count += 1
+                bin_code = bin_data.get('BinCode')
+                wh_code = bin_data.get(
+                    'Warehouse')  # Use 'Warehouse' not 'WarehouseCode'
+                mark = _max_mark(mark, _change_mark('BinLocations', bin_data))
+
+                if bin_code and wh_code:
+                    yield {
+                        "bin_code": bin_code,
+                        "warehouse_code": wh_code,
+                        "description": bin_data.get('Description', ''),
+                        "is_active": bin_data.get('Inactive') != 'Y',
+                        "sap_abs_entry": bin_data.get('AbsEntry')
+                    }
+
+        # bin_locations is the BinLocation model's table (created by db.create_all)
+        bulk_upsert('bin_locations', bin_rows(), ['bin_code'],
+                    on_chunk=(lambda rows: on_chunk(rows, bin_count, mark)) if on_chunk else None)
+        return bin_count, mark
+
+    def _deactivate_missing_bins(self, started_at, warehouse_code=None):
+        """After a full pass, deactivate SAP bins it did not touch (deltas can't see deletions)"""
+        from app import db
+
+        now = 'CURRENT_TIMESTAMP' if db.engine.dialect.name == 'sqlite' else 'NOW()'
+        # Every bin the pass returned was upserted with updated_at >= started_at
+        stale_sql = f"""
+            UPDATE bin_locations SET is_active = :inactive, updated_at = {now}
+            WHERE sap_abs_entry IS NOT NULL AND is_active = :active AND updated_at < :started_at
+        """
+        params = {"inactive": False, "active": True, "started_at": started_at}
+        if warehouse_code:
+            stale_sql += " AND warehouse_code = :warehouse_code"
+            params["warehouse_code"] = warehouse_code
+        stale = db.session.execute(db.text(stale_sql), params).rowcount
+        if stale:
+            logging.info(f"Deactivated {stale} bins no longer in SAP B1")
+
+    def sync_bins(self, warehouse_code=None, full=None):
+        """Sync bin locations from SAP B1.
+
+        Company-wide syncs are incremental (only bins changed since the last
+        sync) unless full=True or a periodic full reconciliation is due; full
+        company-wide passes are split per warehouse when SAP_BIN_SYNC_PARALLEL
+        is on. They commit and checkpoint every chunk, so a failed pass
+        resumes where it stopped. Warehouse-scoped syncs always read the
+        whole warehouse.
+        """
         if not self.ensure_logged_in():
             logging.warning("Cannot sync bins - SAP B1 not available")
             return False
 
+        from app import db
+
         try:
-            # Get bins for specific warehouse or all warehouses
             if warehouse_code:
-                url = f"{self.base_url}/b1s/v1/BinLocations?$filter=Warehouse eq '{warehouse_code}'"
+                full, state, delta, checkpoint = True, None, None, None
+                started_at = str(db.session.execute(db.text("SELECT CURRENT_TIMESTAMP")).scalar())
             else:
-                url = f"{self.base_url}/b1s/v1/BinLocations"
-
-            response = self.session.get(url)
-
-            if response.status_code == 200:
-                bins = response.json().get('value', [])
-
-                # Create bins table if not exists - use compatible SQL
-                from app import db, app
-                import os
-
-                db_uri = app.config.get('SQLALCHEMY_DATABASE_URI', '')
-
-                if 'postgresql' in db_uri.lower():
-                    create_table_sql = """
-                        CREATE TABLE IF NOT EXISTS bin_locations (
-                            id SERIAL PRIMARY KEY,
-                            bin_code VARCHAR(50) NOT NULL,
-                            warehouse_code VARCHAR(10) NOT NULL,
-                            bin_name VARCHAR(100),
-                            is_active BOOLEAN DEFAULT TRUE,
-                            created_at TIMESTAMP DEFAULT NOW(),
-                            updated_at TIMESTAMP DEFAULT NOW(),
-                            UNIQUE(bin_code, warehouse_code)
-                        )
-                    """
-                elif 'mysql' in db_uri.lower():
-                    create_table_sql = """
-                        CREATE TABLE IF NOT EXISTS bin_locations (
-                            id INT AUTO_INCREMENT PRIMARY KEY,
-                            bin_code VARCHAR(50) NOT NULL,
-                            warehouse_code VARCHAR(10) NOT NULL,
-                            bin_name VARCHAR(100),
-                            is_active BOOLEAN DEFAULT TRUE,
-                            created_at TIMESTAMP DEFAULT NOW(),
-                            updated_at TIMESTAMP DEFAULT NOW() ON UPDATE NOW(),
-                            UNIQUE KEY unique_bin_warehouse (bin_code, warehouse_code)
-                        )
-                    """
-                else:
-                    create_table_sql = """
-                        CREATE TABLE IF NOT EXISTS bin_locations (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            bin_code VARCHAR(50) NOT NULL,
-                            warehouse_code VARCHAR(10) NOT NULL,
-                            bin_name VARCHAR(100),
-                            is_active BOOLEAN DEFAULT 1,
-                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            UNIQUE(bin_code, warehouse_code)
-                        )
-                    """
-
-                db.session.execute(db.text(create_table_sql))
-
-                # Clear cache
-                self._bin_cache = {}
-
-                for bin_data in bins:
-                    bin_code = bin_data.get('BinCode')
-                    wh_code = bin_data.get(
-                        'Warehouse')  # Use 'Warehouse' not 'WarehouseCode'
-
-                    if bin_code and wh_code:
-                        # Upsert bin location - use database-specific syntax
-                        if 'postgresql' in db_uri.lower():
-                            upsert_sql = """
-                                INSERT INTO bin_locations (bin_code, warehouse_code, bin_name, is_active, created_at, updated_at)
-                                VALUES (:bin_code, :warehouse_code, :bin_name, :is_active, NOW(), NOW())
-                                ON CONFLICT (bin_code, warehouse_code) 
-                                DO UPDATE SET 
-                                    bin_name = EXCLUDED.bin_name,
-                                    is_active = EXCLUDED.is_active,
-                                    updated_at = NOW()
-                            """
-                        elif 'mysql' in db_uri.lower():
-                            upsert_sql = """
-                                INSERT INTO bin_locations (bin_code, warehouse_code, bin_name, is_active, created_at, updated_at)
-                                VALUES (:bin_code, :warehouse_code, :bin_name, :is_active, NOW(), NOW())
-                                ON DUPLICATE KEY UPDATE 
-                                    bin_name = VALUES(bin_name),
-                                    is_active = VALUES(is_active),
-                                    updated_at = NOW()
-                            """
-                        else:
-                            # SQLite - use INSERT OR REPLACE
-                            upsert_sql = """
-                                INSERT OR REPLACE INTO bin_locations (bin_code, warehouse_code, bin_name, is_active, created_at, updated_at)
-                                VALUES (:bin_code, :warehouse_code, :bin_name, :is_active, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                            """
-
-                        db.session.execute(
-                            db.text(upsert_sql), {
-                                "bin_code": bin_code,
-                                "warehouse_code": wh_code,
-                                "bin_name": bin_data.get('Description', ''),
-                                "is_active": bin_data.get('Inactive') != 'Y'
-                            })
+                full, state, delta, checkpoint = self._sync_plan('BinLocations', full)
+                started_at = checkpoint['started_at']
+                if full and app.config.get('SAP_BIN_SYNC_PARALLEL', True):
+                    return self._sync_bins_by_warehouse(state, checkpoint)
+
+            # Get bins for specific warehouse or all warehouses, in key order
+            # so a checkpoint can resume after the last committed bin
+            filters = []
+            if warehouse_code:
+                filters.append(f"Warehouse eq '{warehouse_code}'")
+            if delta:
+                filters.append(delta)
+            if checkpoint and checkpoint['last_key']:
+                filters.append(f"BinCode gt '{_odata_quote(checkpoint['last_key'])}'")
+            url = f"{self.base_url}/b1s/v1/BinLocations?$select={select_fields('BinLocations', with_delta=app.config.get('SAP_DELTA_SYNC', True))}&$orderby=BinCode"
+            if filters:
+                url += f"&$filter={' and '.join(filters)}"
+
+            def commit_chunk(rows, count, mark):
+                # Checkpoint after every committed chunk
+                if checkpoint is not None:
+                    self._save_checkpoint(state, dict(
+                        checkpoint, last_key=rows[-1]['bin_code'],
+                        count=checkpoint['count'] + count,
+                        mark=_max_mark(checkpoint['mark'], mark)))
+                db.session.commit()
 
-                        # Cache bin data
-                        cache_key = f"{wh_code}:{bin_code}"
-                        self._bin_cache[cache_key] = {
-                            'BinCode': bin_code,
-                            'WarehouseCode': wh_code,
-                            'Description': bin_data.get('Description', ''),
-                            'Active': bin_data.get('Inactive') != 'Y'
-                        }
+            bin_count, mark = self._upsert_bins(self.iter_collection(url), commit_chunk)
+            if full:
+                self._deactivate_missing_bins(started_at, warehouse_code)
 
-                db.session.commit()
-                logging.info(f"Synced {len(bins)} bin locations from SAP B1")
-                return True
+            if checkpoint is not None:
+                bin_count += checkpoint['count']
+                mark = _max_mark(checkpoint['mark'], mark)
+            self._record_sync(state, full, mark, bin_count)
+            db.session.commit()
+            invalidate('bins')
+            bin_directory.refresh()
+            logging.info(
+                f"Synced {bin_count} bin locations from SAP B1 ({'full' if full else 'incremental'})")
+            return True
 
         except Exception as e:
+            db.session.rollback()
             logging.error(f"Error syncing bins: {str(e)}")
             return False
 
-    def sync_business_partners(self):
-        """Sync business partners (suppliers/customers) from SAP B1"""
+    def _sync_bins_by_warehouse(self, state, checkpoint):
+        """Full bin sync partitioned by warehouse.
+
+        Partitions are fetched concurrently through fan_out (bounded by
+        SAP_MAX_CONCURRENCY) and each is committed on its own together with
+        the checkpoint, so one failing warehouse doesn't roll back the others
+        and the next run only fetches the warehouses still missing. The
+        high-water mark only advances when every partition succeeded.
+        """
+        from app import db
+
+        warehouses = [wh.get('WarehouseCode') for wh in self.iter_collection(
+            f"{self.base_url}/b1s/v1/Warehouses?$select=WarehouseCode")
+            if wh.get('WarehouseCode')]
+        pending = [wh_code for wh_code in warehouses if wh_code not in checkpoint['done']]
+        select = select_fields('BinLocations', with_delta=app.config.get('SAP_DELTA_SYNC', True))
+
+        def fetch(wh_code):
+            try:
+                url = f"{self.base_url}/b1s/v1/BinLocations?$select={select}&$filter=Warehouse eq '{wh_code}'"
+                return wh_code, list(self.iter_collection(url)), None
+            except Exception as e:
+                return wh_code, None, str(e)
+
+        failed = []
+        for wh_code, bins, error in self.fan_out(fetch, pending):
+            if error is None:
+                try:
+                    count, wh_mark = self._upsert_bins(bins)
+                    self._deactivate_missing_bins(checkpoint['started_at'], wh_code)
+                    progress = dict(checkpoint, done=checkpoint['done'] + [wh_code],
+                                    count=checkpoint['count'] + count,
+                                    mark=_max_mark(checkpoint['mark'], wh_mark))
+                    self._save_checkpoint(state, progress)
+                    db.session.commit()
+                    checkpoint = progress
+                    continue
+                except Exception as e:
+                    db.session.rollback()
+                    error = str(e)
+            failed.append(wh_code)
+            logging.error(f"Error syncing bins for warehouse {wh_code}: {error}")
+
+        if not failed:
+            self._record_sync(state, True, checkpoint['mark'], checkpoint['count'])
+            db.session.commit()
+        invalidate('bins')
+        bin_directory.refresh()
+        logging.info(
+            f"Synced {checkpoint['count']} bin locations from SAP B1 (full, {len(warehouses) - len(failed)}/{len(warehouses)} warehouses)")
+        return not failed
+
+    def _ensure_business_partners_table(self):
+        """Create business_partners (not an ORM model) once per process"""
+        global _business_partners_table_ready
+        if _business_partners_table_ready:
+            return
+
+        from app import db
+
+        # Use database-specific syntax
+        dialect = db.engine.dialect.name
+        if dialect == 'postgresql':
+            create_table_sql = """
+                CREATE TABLE IF NOT EXISTS business_partners (
+                    id SERIAL PRIMARY KEY,
+                    card_code VARCHAR(50) UNIQUE NOT NULL,
+                    card_name VARCHAR(200) NOT NULL,
+                    card_type VARCHAR(20) NOT NULL,
+                    phone VARCHAR(50),
+                    email VARCHAR(100),
+                    address TEXT,
+                    is_active BOOLEAN DEFAULT TRUE,
+                    created_at TIMESTAMP DEFAULT NOW(),
+                    updated_at TIMESTAMP DEFAULT NOW()
+                )
+            """
+        elif dialect == 'mysql':
+            create_table_sql = """
+                CREATE TABLE IF NOT EXISTS business_partners (
+                    id INT AUTO_INCREMENT PRIMARY KEY,
+                    card_code VARCHAR(50) UNIQUE NOT NULL,
+                    card_name VARCHAR(200) NOT NULL,
+                    card_type VARCHAR(20) NOT NULL,
+                    phone VARCHAR(50),
+                    email VARCHAR(100),
+                    address TEXT,
+                    is_active BOOLEAN DEFAULT TRUE,
+                    created_at TIMESTAMP DEFAULT NOW(),
+                    updated_at TIMESTAMP DEFAULT NOW() ON UPDATE NOW()
+                )
+            """
+        else:
+            create_table_sql = """
+                CREATE TABLE IF NOT EXISTS business_partners (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    card_code VARCHAR(50) UNIQUE NOT NULL,
+                    card_name VARCHAR(200) NOT NULL,
+                    card_type VARCHAR(20) NOT NULL,
+                    phone VARCHAR(50),
+                    email VARCHAR(100),
+                    address TEXT,
+                    is_active BOOLEAN DEFAULT 1,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """
+
+        db.session.execute(db.text(create_table_sql))
+        db.session.commit()
+        _business_partners_table_ready = True
+
+    def sync_business_partners(self, full=None):
+        """Sync business partners (suppliers/customers) from SAP B1, incrementally
+        unless full=True or a periodic full reconciliation is due. Commits and
+        checkpoints every chunk, so a failed pass resumes where it stopped."""
         if not self.ensure_logged_in():
             logging.warning(
                 "Cannot sync business partners - SAP B1 not available")
             return False
 
+        from app import db
+
         try:
-            # Get suppliers and customers
-            url = f"{self.base_url}/b1s/v1/BusinessPartners?$filter=CardType eq 'cSupplier' or CardType eq 'cCustomer'"
-            response = self.session.get(url)
+            self._ensure_business_partners_table()
+            full, state, delta, checkpoint = self._sync_plan('BusinessPartners', full)
+
+            # Get suppliers and customers, in key order so a checkpoint can
+            # resume after the last committed partner
+            partner_filter = "(CardType eq 'cSupplier' or CardType eq 'cCustomer')"
+            if delta:
+                partner_filter += f" and {delta}"
+            if checkpoint['last_key']:
+                partner_filter += f" and CardCode gt '{_odata_quote(checkpoint['last_key'])}'"
+            url = f"{self.base_url}/b1s/v1/BusinessPartners?$filter={partner_filter}&$select={select_fields('BusinessPartners', with_delta=app.config.get('SAP_DELTA_SYNC', True))}&$orderby=CardCode"
+            partners = self.iter_collection(url)
+
+            partner_count = 0
+            mark = None
+
+            def partner_rows():
+                nonlocal partner_count, mark
+                for partner in partners:
+                    partner_count += 1
+                    mark = _max_mark(mark, _change_mark('BusinessPartners', partner))
+                    if partner.get('CardCode'):
+                        yield {
+                            "card_code": partner.get('CardCode'),
+                            "card_name": partner.get('CardName', ''),
+                            "card_type": partner.get('CardType', ''),
+                            "phone": partner.get('Phone1', ''),
+                            "email": partner.get('EmailAddress', ''),
+                            "address": partner.get('Address', ''),
+                            "is_active": partner.get('Valid') == 'Y'
+                        }
 
-            if response.status_code == 200:
-                partners = response.json().get('value', [])
-
-                from app import db, app
-
-                # Create business_partners table if not exists - use database-specific syntax
-                db_uri = app.config.get('SQLALCHEMY_DATABASE_URI', '')
-
-                if 'postgresql' in db_uri.lower():
-                    create_table_sql = """
-                        CREATE TABLE IF NOT EXISTS business_partners (
-                            id SERIAL PRIMARY KEY,
-                            card_code VARCHAR(50) UNIQUE NOT NULL,
-                            card_name VARCHAR(200) NOT NULL,
-                            card_type VARCHAR(20) NOT NULL,
-                            phone VARCHAR(50),
-                            email VARCHAR(100),
-                            address TEXT,
-                            is_active BOOLEAN DEFAULT TRUE,
-                            created_at TIMESTAMP DEFAULT NOW(),
-                            updated_at TIMESTAMP DEFAULT NOW()
-                        )
-                    """
-                elif 'mysql' in db_uri.lower():
-                    create_table_sql = """
-                        CREATE TABLE IF NOT EXISTS business_partners (
-                            id INT AUTO_INCREMENT PRIMARY KEY,
-                            card_code VARCHAR(50) UNIQUE NOT NULL,
-                            card_name VARCHAR(200) NOT NULL,
-                            card_type VARCHAR(20) NOT NULL,
-                            phone VARCHAR(50),
-                            email VARCHAR(100),
-                            address TEXT,
-                            is_active BOOLEAN DEFAULT TRUE,
-                            created_at TIMESTAMP DEFAULT NOW(),
-                            updated_at TIMESTAMP DEFAULT NOW() ON UPDATE NOW()
-                        )
-                    """
-                else:
-                    create_table_sql = """
-                        CREATE TABLE IF NOT EXISTS business_partners (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            card_code VARCHAR(50) UNIQUE NOT NULL,
-                            card_name VARCHAR(200) NOT NULL,
-                            card_type VARCHAR(20) NOT NULL,
-                            phone VARCHAR(50),
-                            email VARCHAR(100),
-                            address TEXT,
-                            is_active BOOLEAN DEFAULT 1,
-                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                        )
-                    """
+            def commit_chunk(rows):
+                # Checkpoint after every committed chunk
+                self._save_checkpoint(state, dict(
+                    checkpoint, last_key=rows[-1]['card_code'],
+                    count=checkpoint['count'] + partner_count,
+                    mark=_max_mark(checkpoint['mark'], mark)))
+                db.session.commit()
 
-                db.session.execute(db.text(create_table_sql))
+            bulk_upsert('business_partners', partner_rows(), ['card_code'],
+                        on_chunk=commit_chunk)
 
-                for partner in partners:
-                    card_code = partner.get('CardCode')
-                    if card_code:
-                        # Use database-specific upsert syntax
-                        if 'postgresql' in db_uri.lower():
-                            upsert_sql = """
-                                INSERT INTO business_partners (card_code, card_name, card_type, phone, email, address, is_active, created_at, updated_at)
-                                VALUES (:card_code, :card_name, :card_type, :phone, :email, :address, :is_active, NOW(), NOW())
-                                ON CONFLICT (card_code) 
-                                DO UPDATE SET 
-                                    card_name = EXCLUDED.card_name,
-                                    card_type = EXCLUDED.card_type,
-                                    phone = EXCLUDED.phone,
-                                    email = EXCLUDED.email,
-                                    address = EXCLUDED.address,
-                                    is_active = EXCLUDED.is_active,
-                                    updated_at = NOW()
-                            """
-                        elif 'mysql' in db_uri.lower():
-                            upsert_sql = """
-                                INSERT INTO business_partners (card_code, card_name, card_type, phone, email, address, is_active, created_at, updated_at)
-                                VALUES (:card_code, :card_name, :card_type, :phone, :email, :address, :is_active, NOW(), NOW())
-                                ON DUPLICATE KEY UPDATE 
-                                    card_name = VALUES(card_name),
-                                    card_type = VALUES(card_type),
-                                    phone = VALUES(phone),
-                                    email = VALUES(email),
-                                    address = VALUES(address),
-                                    is_active = VALUES(is_active),
-                                    updated_at = NOW()
-                            """
-                        else:
-                            # SQLite - use INSERT OR REPLACE
-                            upsert_sql = """
-                                INSERT OR REPLACE INTO business_partners (card_code, card_name, card_type, phone, email, address, is_active, created_at, updated_at)
-                                VALUES (:card_code, :card_name, :card_type, :phone, :email, :address, :is_active, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                            """
-
-                        db.session.execute(
-                            db.text(upsert_sql), {
-                                "card_code": card_code,
-                                "card_name": partner.get('CardName', ''),
-                                "card_type": partner.get('CardType', ''),
-                                "phone": partner.get('Phone1', ''),
-                                "email": partner.get('EmailAddress', ''),
-                                "address": partner.get('Address', ''),
-                                "is_active": partner.get('Valid') == 'Y'
-                            })
+            partner_count += checkpoint['count']
+            self._record_sync(state, full, _max_mark(checkpoint['mark'], mark), partner_count)
+            db.session.commit()
+            logging.info(
+                f"Synced {partner_count} business partners from SAP B1 ({'full' if full else 'incremental'})")
+            return True
+
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Error syncing business partners: {str(e)}")
+            return False
+
+    def sync_items(self, full=None):
+        """Sync the item master into the local items mirror, incrementally unless
+        full=True or a periodic full reconciliation is due. Commits and
+        checkpoints every chunk, so a failed pass resumes where it stopped."""
+        if not self.ensure_logged_in():
+            logging.warning("Cannot sync items - SAP B1 not available")
+            return False
+
+        from app import db
+
+        try:
+            full, state, delta, checkpoint = self._sync_plan('Items', full)
+
+            # In key order so a checkpoint can resume after the last committed item
+            filters = []
+            if delta:
+                filters.append(delta)
+            if checkpoint['last_key']:
+                filters.append(f"ItemCode gt '{_odata_quote(checkpoint['last_key'])}'")
+            url = f"{self.base_url}/b1s/v1/Items?$select={select_fields('Items', with_delta=app.config.get('SAP_DELTA_SYNC', True))}&$orderby=ItemCode"
+            if filters:
+                url += f"&$filter={' and '.join(filters)}"
+            items = self.iter_collection(url)
+
+            item_count = 0
+            mark = None
+
+            def item_rows():
+                nonlocal item_count, mark
+                for item in items:
+                    item_count += 1
+                    mark = _max_mark(mark, _change_mark('Items', item))
+                    if item.get('ItemCode'):
+                        yield {
+                            "item_code": item.get('ItemCode'),
+                            "item_name": item.get('ItemName', ''),
+                            "inventory_uom": item.get('InventoryUOM'),
+                            "sales_unit": item.get('SalesUnit'),
+                            "uom_group_entry": item.get('UoMGroupEntry'),
+                            "item_type": item.get('ItemType'),
+                            "default_warehouse": item.get('DefaultWarehouse'),
+                            "manage_batch_numbers": item.get('ManageBatchNumbers'),
+                            "manage_serial_numbers": item.get('ManageSerialNumbers'),
+                            "barcode": item.get('BarCode'),
+                            "is_active": item.get('Valid') != 'tNO'
+                        }
 
+            def commit_chunk(rows):
+                # SAP item barcodes go into the barcode index with their items
+                index_item_barcodes(rows)
+                # Checkpoint after every committed chunk
+                self._save_checkpoint(state, dict(
+                    checkpoint, last_key=rows[-1]['item_code'],
+                    count=checkpoint['count'] + item_count,
+                    mark=_max_mark(checkpoint['mark'], mark)))
                 db.session.commit()
-                logging.info(
-                    f"Synced {len(partners)} business partners from SAP B1")
-                return True
+
+            # items is the ItemMaster model's table (created by db.create_all)
+            bulk_upsert('items', item_rows(), ['item_code'], on_chunk=commit_chunk)
+
+            if full:
+                # Deltas can't see items deleted in SAP - deactivate the ones
+                # this pass did not touch
+                now = 'CURRENT_TIMESTAMP' if db.engine.dialect.name == 'sqlite' else 'NOW()'
+                stale = db.session.execute(db.text(f"""
+                    UPDATE items SET is_active = :inactive, updated_at = {now}
+                    WHERE is_active = :active AND updated_at < :started_at
+                """), {"inactive": False, "active": True,
+                       "started_at": checkpoint['started_at']}).rowcount
+                if stale:
+                    logging.info(f"Deactivated {stale} items no longer in SAP B1")
+
+            item_count += checkpoint['count']
+            self._record_sync(state, full, _max_mark(checkpoint['mark'], mark), item_count)
+            db.session.commit()
+            invalidate('items')
+            item_directory.refresh()
+            logging.info(
+                f"Synced {item_count} items from SAP B1 ({'full' if full else 'incremental'})")
+            return True
 
         except Exception as e:
-            logging.error(f"Error syncing business partners: {str(e)}")
+            db.session.rollback()
+            logging.error(f"Error syncing items: {str(e)}")
             return False
 
     def get_warehouse_business_place_id(self, warehouse_code):
         """Get BusinessPlaceID for a warehouse from SAP B1"""
+        cached = get_cache('business_place_ids').get(warehouse_code)
+        if cached is not None:
+            return cached
+
         if not self.ensure_logged_in():
             return 5  # Default fallback
 
@@ -3105,11 +1932,13 @@ class SAPIntegration:
                 '$filter': f"WarehouseCode eq '{warehouse_code}'"
             }
 
-            response = self.session.get(url, params=params)
+            response = self.get(url, params=params)
             if response.status_code == 200:
                 data = response.json()
                 if data.get('value') and len(data['value']) > 0:
-                    return data['value'][0].get('BusinessPlaceID', 5)
+                    business_place_id = data['value'][0].get('BusinessPlaceID', 5)
+                    get_cache('business_place_ids').set(warehouse_code, business_place_id)
+                    return business_place_id
             return 5  # Default fallback
 
         except Exception as e:
@@ -3118,78 +1947,26 @@ class SAPIntegration:
             )
             return 5  # Default fallback
 
-    def generate_external_reference_number(self, grpo_document):
-        """Generate unique external reference number for Purchase Delivery Note"""
-        from datetime import datetime
-
-        # Get current date in YYYYMMDD format
-        date_str = datetime.now().strftime('%Y%m%d')
-
-        # Get sequence number for today
-        try:
-            from app import db
-
-            # Create sequence table if not exists
-            create_sequence_table = """
-                CREATE TABLE IF NOT EXISTS pdn_sequence (
-                    date_key VARCHAR(8) PRIMARY KEY,
-                    sequence_number INTEGER DEFAULT 0
-                )
-            """
-            db.session.execute(db.text(create_sequence_table))
-
-            # Get or create sequence for today
-            result = db.session.execute(
-                db.text(
-                    "SELECT sequence_number FROM pdn_sequence WHERE date_key = :date_key"
-                ), {
-                    "date_key": date_str
-                }).fetchone()
-
-            if result:
-                sequence_num = result[0] + 1
-                db.session.execute(
-                    db.text(
-                        "UPDATE pdn_sequence SET sequence_number = :seq WHERE date_key = :date_key"
-                    ), {
-                        "seq": sequence_num,
-                        "date_key": date_str
-                    })
-            else:
-                sequence_num = 1
-                db.session.execute(
-                    db.text(
-                        "INSERT INTO pdn_sequence (date_key, sequence_number) VALUES (:date_key, :seq)"
-                    ), {
-                        "date_key": date_str,
-                        "seq": sequence_num
-                    })
-
-            db.session.commit()
-
-            # Format: EXT-REF-YYYYMMDD-XXX
-            return f"EXT-REF-{date_str}-{sequence_num:03d}"
-
-        except Exception as e:
-            logging.error(
-                f"Error generating external reference number: {str(e)}")
-            # Fallback to timestamp-based reference
-            timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-            return f"EXT-REF-{timestamp}"
-
     def create_purchase_delivery_note(self, grpo_document):
-        """Create Purchase Delivery Note in SAP B1 with exact JSON structure specified"""
-        if not self.ensure_logged_in():
-            # Return success for offline mode
-            import random
-            return {
-                'success': True,
-                'error': None,
-                'document_number': f'PDN-{random.randint(100000, 999999)}'
-            }
+        """Create Purchase Delivery Note in SAP B1 with exact JSON structure specified
 
-        # Get PO data first to ensure proper field mapping
-        po_data = self.get_purchase_order(grpo_document.po_number)
+        Safe to retry: the PDN is posted at most once per GRN (see
+        sap_posting_ledger.py).
+        """
+        if not self.ensure_logged_in():
+            return self._posting_unavailable(f'GRN {grpo_document.id}')
+
+        key = posting_key('grn', grpo_document.id)
+        return posting_ledger.post_once(
+            key, 'grn', grpo_document.id,
+            lookup=lambda: self.find_posted_document('PurchaseDeliveryNotes', 'NumAtCard', key),
+            post=lambda: self._post_purchase_delivery_note(grpo_document, key))
+
+    def _post_purchase_delivery_note(self, grpo_document, idempotency_key):
+        """Build and POST the Purchase Delivery Note; NumAtCard carries the idempotency key"""
+        # Get PO data first to ensure proper field mapping - fresh, since
+        # other receipts may have changed the open lines since it was cached
+        po_data = self.get_purchase_order(grpo_document.po_number, fresh=True)
         if not po_data:
             return {
                 'success':
@@ -3218,8 +1995,8 @@ class SAPIntegration:
                 'error': 'Missing CardCode or PO DocEntry from SAP B1'
             }
 
-        # Generate unique external reference number
-        external_ref = self.generate_external_reference_number(grpo_document)
+        # The idempotency key is the external reference, so a retry can find this PDN
+        external_ref = idempotency_key
 
         # Get first warehouse code from PO DocumentLines to determine BusinessPlaceID
         first_warehouse_code = None
@@ -3349,12 +2126,14 @@ class SAPIntegration:
         logging.info("=" * 80)
         print(pdn_data)
         try:
-            response = self.session.post(url, json=pdn_data)
+            response = self.post(url, json=pdn_data)
             if response.status_code == 201:
                 result = response.json()
                 logging.info(
                     f"Successfully created Purchase Delivery Note {result.get('DocNum')} for GRPO {grpo_document.id}"
                 )
+                # Open quantities on the PO have changed
+                invalidate('purchase_orders', str(grpo_document.po_number))
                 return {
                     'success':
                     True,
@@ -3370,11 +2149,13 @@ class SAPIntegration:
             else:
                 error_msg = f"SAP B1 error creating Purchase Delivery Note: {response.text}"
                 logging.error(error_msg)
-                return {'success': False, 'error': error_msg}
+                return {'success': False, 'error': error_msg,
+                        'outcome_unknown': response.status_code >= 500}
         except Exception as e:
             error_msg = f"Error creating Purchase Delivery Note in SAP B1: {str(e)}"
             logging.error(error_msg)
-            return {'success': False, 'error': error_msg}
+            return {'success': False, 'error': error_msg,
+                    'outcome_unknown': _may_have_reached_sap(e)}
 
     def post_grpo_to_sap(self, grpo_document):
         """Post approved GRPO to SAP B1 as Purchase Delivery Note"""
@@ -3415,14 +2196,21 @@ class SAPIntegration:
             logging.error(f"Error posting GRPO to SAP: {str(e)}")
             return {'success': False, 'error': str(e)}
 
-    def sync_all_master_data(self):
-        """Sync all master data from SAP B1"""
-        logging.info("Starting full SAP B1 master data synchronization...")
+    def sync_all_master_data(self, full=None):
+        """Sync all master data from SAP B1.
+
+        Bins, business partners and items are synced incrementally from
+        their high-water marks; full=True forces a full reconciliation pass.
+        Warehouses are few and always synced in full.
+        """
+        logging.info(
+            f"Starting {'full' if full else 'incremental'} SAP B1 master data synchronization...")
 
         results = {
             'warehouses': self.sync_warehouses(),
-            'bins': self.sync_bins(),
-            'business_partners': self.sync_business_partners()
+            'bins': self.sync_bins(full=full),
+            'business_partners': self.sync_business_partners(full=full),
+            'items': self.sync_items(full=full)
         }
 
         success_count = sum(1 for result in results.values() if result)
@@ -3433,18 +2221,17 @@ class SAPIntegration:
         return results
 
     def logout(self):
-        """Logout from SAP B1"""
+        """Release the SAP B1 session (pooled sessions stay logged in for reuse)"""
         if self.session_id:
-            try:
-                logout_url = f"{self.base_url}/b1s/v1/Logout"
-                self.session.post(logout_url)
-                self.session_id = None
-                logging.info("Logged out from SAP B1")
-            except Exception as e:
-                logging.error(f"Error logging out from SAP B1: {str(e)}")
+            self.release()
+            logging.info("Released SAP B1 session back to the pool")
 
     def get_warehouses(self):
         """Get all available warehouses"""
+        cached = get_cache('warehouses').get('all')
+        if cached is not None:
+            return cached
+
         if not self.ensure_logged_in():
             # Return mock data for offline mode
             return [
@@ -3454,8 +2241,8 @@ class SAPIntegration:
             ]
 
         try:
-            url = f"{self.base_url}/b1s/v1/Warehouses"
-            response = self.session.get(url)
+            url = f"{self.base_url}/b1s/v1/Warehouses?$select={select_fields('Warehouses')}"
+            response = self.get(url)
             
             if response.status_code == 200:
                 data = response.json()
@@ -3469,6 +2256,7 @@ class SAPIntegration:
                         "DefaultBin": wh.get("DefaultBin", "")
                     })
                 
+                get_cache('warehouses').set('all', formatted_warehouses)
                 return formatted_warehouses
             else:
                 logging.error(f"Failed to get warehouses: {response.status_code}")
@@ -3496,7 +2284,7 @@ class SAPIntegration:
             # }
 
             print(url)
-            response = self.session.get(url)
+            response = self.get(url)
             
             if response.status_code == 200:
                 data = response.json()
@@ -3519,3 +2307,9 @@ class SAPIntegration:
             logging.error(f"Error getting batches for warehouse {item_code}: {str(e)}")
             return []
 
+
+@app.teardown_appcontext
+def release_sap_sessions(exception=None):
+    """Return every SAP B1 session borrowed during this request to the pool"""
+    for sap in g.pop('sap_integrations', []):
+        sap.release()
@@ -0,0 +1,262 @@
+"""
+SAP Posting Outbox
+==================
+
+QC approval no longer waits for SAP B1. The approving request only adds a
+row to sap_outbox in the same transaction as the status change, and a
+dispatcher thread in every web worker (or the standalone worker started
+with ``python sap_outbox.py``) claims queued rows with an atomic UPDATE,
+posts the document to the Service Layer and records the resulting
+DocEntry/DocNum. Failed posts are retried with exponential backoff up to
+SAP_OUTBOX_MAX_ATTEMPTS; the UI polls /api/sap/outbox/... for the outcome.
+Posts go through the idempotency ledger (sap_posting_ledger.py), so a retry
+never creates the document in SAP twice.
+"""
+
+import logging
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from app import app, db
+from models import GRNDocument, InventoryTransfer, SAPOutbox
+from sap_posting_ledger import posting_key
+
+ACTIVE_STATUSES = ('queued', 'processing', 'posted')
+
+
+def _post_grn(sap, entry):
+    grn_doc = GRNDocument.query.get(entry.document_id)
+    if grn_doc is None:
+        return {'success': False, 'error': f'GRN {entry.document_id} no longer exists'}
+    result = sap.create_purchase_delivery_note(grn_doc)
+    if result.get('success'):
+        grn_doc.status = 'posted'
+        grn_doc.sap_document_number = str(result.get('document_number'))
+    return {**result, 'doc_num': result.get('document_number')}
+
+
+def _post_inventory_transfer(sap, entry):
+    transfer = InventoryTransfer.query.get(entry.document_id)
+    if transfer is None:
+        return {'success': False, 'error': f'Inventory transfer {entry.document_id} no longer exists'}
+    result = sap.create_inventory_transfer(transfer)
+    if result.get('success'):
+        transfer.sap_document_number = result.get('document_number')
+    return {**result, 'doc_num': result.get('document_number')}
+
+
+# document_type -> poster(sap, entry); posters update the WMS document on
+# success and return the SAP result with doc_num / doc_entry
+POSTERS = {
+    'grn': _post_grn,
+    'inventory_transfer': _post_inventory_transfer
+}
+
+
+class SAPOutboxDispatcher:
+    """Background poster for documents queued in sap_outbox"""
+
+    def __init__(self, poll_seconds=5, max_attempts=5, retry_backoff_seconds=30,
+                 processing_timeout_minutes=15):
+        self.poll_seconds = poll_seconds
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff_seconds
+        self.processing_timeout = timedelta(minutes=processing_timeout_minutes)
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the dispatcher thread in this process (idempotent)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self._thread = threading.Thread(target=self._loop, name='sap-outbox-dispatcher', daemon=True)
+        self._thread.start()
+        logging.info(f"📮 SAP outbox dispatcher started in {self.worker}")
+
+    def enqueue(self, document_type, document_id, user_id=None):
+        """Queue a document for posting in the caller's transaction (the caller commits)
+
+        Returns (entry, queued); a document that is already queued, being
+        posted or posted is not queued again.
+        """
+        if document_type not in POSTERS:
+            raise ValueError(f"Unknown outbox document type: {document_type}")
+        existing = SAPOutbox.query.filter(
+            SAPOutbox.document_type == document_type,
+            SAPOutbox.document_id == document_id,
+            SAPOutbox.status.in_(ACTIVE_STATUSES)).order_by(SAPOutbox.id.desc()).first()
+        if existing is not None:
+            return existing, False
+
+        entry = SAPOutbox(document_type=document_type, document_id=document_id,
+                          requested_by=user_id, status='queued', next_attempt_at=datetime.utcnow())
+        db.session.add(entry)
+        # Wake this worker's dispatcher once the row is committed
+        db.session.info['sap_outbox_wake'] = True
+        return entry, True
+
+    def retry(self, entry_id):
+        """Re-queue a failed entry for another round of attempts; False if it is not failed"""
+        requeued = SAPOutbox.query.filter_by(id=entry_id, status='failed').update(
+            {'status': 'queued', 'attempts': 0, 'next_attempt_at': datetime.utcnow(),
+             'finished_at': None},
+            synchronize_session=False)
+        db.session.commit()
+        if requeued:
+            self._wake.set()
+        return bool(requeued)
+
+    def dispatch_next(self):
+        """Claim and post the oldest due entry; returns its id or None"""
+        now = datetime.utcnow()
+        entry = SAPOutbox.query.filter(
+            SAPOutbox.status == 'queued', SAPOutbox.next_attempt_at <= now).order_by(
+            SAPOutbox.next_attempt_at, SAPOutbox.id).first()
+        if entry is None:
+            return None
+
+        # Only one worker wins the queued -> processing transition
+        claimed = SAPOutbox.query.filter_by(id=entry.id, status='queued').update(
+            {'status': 'processing', 'attempts': SAPOutbox.attempts + 1, 'started_at': now,
+             'worker': self.worker},
+            synchronize_session=False)
+        db.session.commit()
+        if not claimed:
+            return None
+
+        db.session.refresh(entry)
+        logging.info(f"📤 Posting {entry.document_type} {entry.document_id} to SAP B1 "
+                     f"(outbox {entry.id}, attempt {entry.attempts})")
+        try:
+            from sap_integration import SAPIntegration
+            result = POSTERS[entry.document_type](SAPIntegration(), entry)
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+
+        if result.get('success'):
+            entry.status = 'posted'
+            entry.sap_doc_num = str(result['doc_num']) if result.get('doc_num') is not None else None
+            entry.sap_doc_entry = result.get('doc_entry')
+            entry.last_error = None
+            entry.finished_at = datetime.utcnow()
+            db.session.commit()
+            logging.info(f"✅ Outbox {entry.id}: {entry.document_type} {entry.document_id} "
+                         f"posted as SAP document {entry.sap_doc_num}")
+            return entry.id
+
+        # Drop anything the failed post left half-done before recording the failure
+        db.session.rollback()
+        entry = SAPOutbox.query.get(entry.id)
+        entry.last_error = result.get('error')
+        if result.get('deferred'):
+            # Nothing was posted (in flight elsewhere, or waiting for SAP to settle)
+            entry.status = 'queued'
+            entry.attempts -= 1
+            entry.next_attempt_at = datetime.utcnow() + timedelta(seconds=result['retry_after'])
+            logging.info(f"Outbox {entry.id}: deferred until {entry.next_attempt_at}: {entry.last_error}")
+        elif entry.attempts >= self.max_attempts:
+            entry.status = 'failed'
+            entry.finished_at = datetime.utcnow()
+            logging.error(f"❌ Outbox {entry.id}: giving up after {entry.attempts} attempts: "
+                          f"{entry.last_error}")
+        else:
+            entry.status = 'queued'
+            entry.next_attempt_at = datetime.utcnow() + timedelta(
+                seconds=max(self.retry_backoff * 2 ** (entry.attempts - 1), result.get('retry_after', 0)))
+            logging.warning(f"Outbox {entry.id}: attempt {entry.attempts} failed, retrying at "
+                            f"{entry.next_attempt_at}: {entry.last_error}")
+        db.session.commit()
+        return entry.id
+
+    def _requeue_abandoned(self):
+        # A worker that died mid-post leaves its entry 'processing'. The
+        # posting ledger checks SAP for the document before posting again,
+        # so the entry can simply be retried.
+        cutoff = datetime.utcnow() - self.processing_timeout
+        abandoned = SAPOutbox.query.filter(
+            SAPOutbox.status == 'processing', SAPOutbox.started_at < cutoff).update(
+            {'status': 'queued', 'next_attempt_at': datetime.utcnow(),
+             'last_error': 'Posting abandoned (worker stopped or timed out) - retrying'},
+            synchronize_session=False)
+        db.session.commit()
+        if abandoned:
+            logging.warning(f"Re-queued {abandoned} abandoned SAP outbox entries")
+
+    def tick(self):
+        """One dispatcher pass: housekeeping, then post everything that is due"""
+        with app.app_context():
+            try:
+                self._requeue_abandoned()
+            except Exception as e:
+                db.session.rollback()
+                logging.warning(f"SAP outbox check failed: {str(e)}")
+        # Each post gets its own app context, like the sync scheduler's runs
+        while True:
+            with app.app_context():
+                try:
+                    if self.dispatch_next() is None:
+                        return
+                except Exception as e:
+                    db.session.rollback()
+                    logging.warning(f"SAP outbox dispatch failed: {str(e)}")
+                    return
+
+    def _loop(self):
+        while True:
+            self.tick()
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+
+    def wake(self):
+        self._wake.set()
+
+
+def entry_status(entry):
+    """Outbox entry as returned by the status APIs"""
+    def iso(value):
+        return value.isoformat() if value else None
+
+    return {
+        'id': entry.id,
+        'document_type': entry.document_type,
+        'document_id': entry.document_id,
+        'idempotency_key': posting_key(entry.document_type, entry.document_id),
+        'status': entry.status,
+        'attempts': entry.attempts,
+        'next_attempt_at': iso(entry.next_attempt_at) if entry.status == 'queued' else None,
+        'sap_doc_entry': entry.sap_doc_entry,
+        'sap_doc_num': entry.sap_doc_num,
+        'error': entry.last_error,
+        'created_at': iso(entry.created_at),
+        'finished_at': iso(entry.finished_at)
+    }
+
+
+sap_outbox = SAPOutboxDispatcher(
+    poll_seconds=app.config.get('SAP_OUTBOX_POLL_SECONDS', 5),
+    max_attempts=app.config.get('SAP_OUTBOX_MAX_ATTEMPTS', 5),
+    retry_backoff_seconds=app.config.get('SAP_OUTBOX_RETRY_BACKOFF_SECONDS', 30))
+
+
+@event.listens_for(db.session, 'after_commit')
+def _wake_dispatcher(session):
+    if session.info.pop('sap_outbox_wake', False):
+        sap_outbox.wake()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_wake(session):
+    session.info.pop('sap_outbox_wake', None)
+
+
+if __name__ == "__main__":
+    # Standalone dispatcher - run the web workers with SAP_OUTBOX_DISPATCHER=off
+    from sap_outbox import sap_outbox as dispatcher
+    dispatcher.start()
+    dispatcher._thread.join()
@@ -0,0 +1,152 @@
+"""
+SAP Posting Ledger
+==================
+
+Makes posting a WMS document to SAP B1 safe to retry. Every post carries a
+stable idempotency key derived from the WMS document (WMS-GRN-12,
+WMS-TR-7), written to a reference field SAP stores on the created document:
+NumAtCard on Purchase Delivery Notes, JournalMemo on Stock Transfers. The
+sap_posting_keys ledger tracks each key in short transactions of its own,
+independent of the caller's session:
+
+- a key already posted returns the recorded SAP document instead of posting again
+- a key in flight in another worker is not posted concurrently
+- before any retry SAP is searched for a document carrying the key, and a
+  match is recorded as posted rather than created a second time
+- after a timeout or dropped connection SAP may still be working on the
+  post, so the retry waits SAP_POSTING_SETTLE_SECONDS before that search
+"""
+
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update
+
+from app import app, db
+from models import SAPPostingKey
+from number_allocator import insert_ignore
+
+# document_type -> key code used in the idempotency key
+KEY_CODES = {
+    'grn': 'GRN',
+    'inventory_transfer': 'TR'
+}
+
+
+def posting_key(document_type, document_id):
+    """Idempotency key SAP postings of a WMS document carry, e.g. WMS-GRN-12"""
+    prefix = app.config.get('SAP_POSTING_KEY_PREFIX', 'WMS')
+    return f"{prefix}-{KEY_CODES[document_type]}-{document_id}"
+
+
+class PostingLedger:
+    """Duplicate suppression for SAP postings, keyed by idempotency key"""
+
+    def __init__(self, settle_seconds=120, request_timeout=60):
+        self.settle = timedelta(seconds=settle_seconds)
+        # An in_flight key older than this belongs to a worker that died mid-post
+        self.in_flight_timeout = timedelta(seconds=request_timeout + settle_seconds)
+        self.table = SAPPostingKey.__table__
+
+    def post_once(self, key, document_type, document_id, lookup, post):
+        """Post a document under key unless SAP already has it
+
+        lookup() returns the SAP document ({'DocEntry', 'DocNum'}) carrying
+        the key, or None, and raises if SAP cannot be searched. post() sends
+        the document and returns the SAPIntegration result dict, with
+        outcome_unknown set when SAP may have created it anyway. Results
+        that did not post anything are marked deferred with a retry_after
+        in seconds.
+        """
+        now = datetime.utcnow()
+        entry = self._entry(key, document_type, document_id, now)
+
+        if entry['status'] == 'posted':
+            logging.info(f"♻️ {key} already posted to SAP B1 as {entry['sap_doc_num']} - not posting again")
+            return self._posted_result(key, entry['sap_doc_entry'], entry['sap_doc_num'], already_posted=True)
+        if entry['status'] == 'in_flight' and entry['updated_at'] > now - self.in_flight_timeout:
+            return self._deferred(key, f"{key} is being posted to SAP B1 by another worker",
+                                  self.settle.total_seconds())
+        if entry['status'] == 'unknown' and entry['last_attempt_at'] > now - self.settle:
+            wait = (entry['last_attempt_at'] + self.settle - now).total_seconds()
+            return self._deferred(key, f"Outcome of the last post of {key} is unknown - "
+                                       f"checking SAP B1 again in {wait:.0f}s", wait)
+
+        # Compare-and-set on attempts: only one worker claims the key
+        with db.engine.begin() as conn:
+            claimed = conn.execute(update(self.table).where(
+                self.table.c.idempotency_key == key,
+                self.table.c.attempts == entry['attempts']).values(
+                status='in_flight', attempts=self.table.c.attempts + 1, last_attempt_at=now,
+                updated_at=now)).rowcount
+        if not claimed:
+            return self._deferred(key, f"{key} is being posted to SAP B1 by another worker",
+                                  self.settle.total_seconds())
+
+        if entry['last_attempt_at'] is not None:
+            # An earlier post may have reached SAP - look for it before posting again
+            try:
+                found = lookup()
+            except Exception as e:
+                previous = 'failed' if entry['status'] == 'failed' else 'unknown'
+                self._finish(key, previous, last_attempt_at=entry['last_attempt_at'],
+                             last_error=f"SAP B1 lookup failed: {str(e)}")
+                return self._deferred(key, f"Could not check SAP B1 for {key}: {str(e)}",
+                                      self.settle.total_seconds())
+            if found:
+                doc_num = str(found.get('DocNum'))
+                self._finish(key, 'posted', sap_doc_entry=found.get('DocEntry'), sap_doc_num=doc_num,
+                             last_error=None)
+                logging.warning(f"♻️ {key} was already in SAP B1 as {doc_num} from an earlier "
+                                f"attempt - recorded it instead of posting again")
+                return self._posted_result(key, found.get('DocEntry'), doc_num, already_posted=True)
+
+        try:
+            result = post()
+        except Exception as e:
+            result = {'success': False, 'error': str(e), 'outcome_unknown': True}
+
+        if result.get('success'):
+            doc_num = result.get('document_number')
+            self._finish(key, 'posted', sap_doc_entry=result.get('doc_entry'),
+                         sap_doc_num=str(doc_num) if doc_num is not None else None, last_error=None)
+        elif result.get('outcome_unknown'):
+            self._finish(key, 'unknown', last_error=result.get('error'))
+            result = {**result, 'retry_after': self.settle.total_seconds()}
+        else:
+            self._finish(key, 'failed', last_error=result.get('error'))
+        return {**result, 'idempotency_key': key}
+
+    def _entry(self, key, document_type, document_id, now):
+        with db.engine.begin() as conn:
+            conn.execute(insert_ignore(conn.dialect.name, self.table).values(
+                idempotency_key=key, document_type=document_type, document_id=document_id,
+                status='pending', attempts=0, created_at=now, updated_at=now))
+            return conn.execute(select(self.table).where(
+                self.table.c.idempotency_key == key)).mappings().first()
+
+    def _finish(self, key, status, **values):
+        with db.engine.begin() as conn:
+            conn.execute(update(self.table).where(self.table.c.idempotency_key == key).values(
+                status=status, updated_at=datetime.utcnow(), **values))
+
+    @staticmethod
+    def _posted_result(key, doc_entry, doc_num, already_posted=False):
+        return {
+            'success': True,
+            'document_number': doc_num,
+            'doc_entry': doc_entry,
+            'idempotency_key': key,
+            'already_posted': already_posted,
+            'message': f'{key} is posted to SAP B1 as document {doc_num}'
+        }
+
+    @staticmethod
+    def _deferred(key, error, retry_after):
+        return {'success': False, 'error': error, 'deferred': True,
+                'retry_after': retry_after, 'idempotency_key': key}
+
+
+posting_ledger = PostingLedger(
+    settle_seconds=app.config.get('SAP_POSTING_SETTLE_SECONDS', 120),
+    request_timeout=app.config.get('SAP_REQUEST_TIMEOUT', 60))
@@ -0,0 +1,200 @@
+"""
+SAP B1 Service Layer Session Pool
+=================================
+
+Keeps a small pool of logged-in Service Layer sessions (B1SESSION cookies)
+per worker process and hands them out to SAPIntegration instances, so a
+request no longer pays for a full /Login round trip before its first call.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import requests
+
+# SAP B1 default when the Login response does not report SessionTimeout
+DEFAULT_SESSION_TIMEOUT_MINUTES = 30
+
+# Treat a session as expired slightly before SAP does
+EXPIRY_MARGIN_SECONDS = 60
+
+
+class PooledSession:
+    """A logged-in requests.Session together with its SAP session metadata"""
+
+    def __init__(self, session, session_id, timeout_minutes):
+        self.session = session
+        self.session_id = session_id
+        self.idle_timeout = timeout_minutes * 60
+        self.last_used = time.monotonic()
+
+    def touch(self):
+        """Mark the session as used now (SAP resets its idle timer on every call)"""
+        self.last_used = time.monotonic()
+
+    def is_expired(self):
+        """Check if SAP has most likely dropped the session for being idle"""
+        idle_for = time.monotonic() - self.last_used
+        return idle_for >= self.idle_timeout - EXPIRY_MARGIN_SECONDS
+
+
+class SAPSessionPool:
+    """Thread-safe pool of logged-in SAP B1 Service Layer sessions"""
+
+    def __init__(self, base_url, username, password, company_db, max_size=4,
+                 login_timeout=10):
+        self.base_url = base_url
+        self.username = username
+        self.password = password
+        self.company_db = company_db
+        self.max_size = max_size
+        self.login_timeout = login_timeout
+
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._checked_out = 0
+        self.logins = 0
+        self.reuses = 0
+
+    def _new_session(self):
+        session = requests.Session()
+        session.verify = False  # For development, in production use proper SSL
+        return session
+
+    def _login(self, session):
+        """Perform a Service Layer login on the given requests.Session"""
+        login_url = f"{self.base_url}/b1s/v1/Login"
+        login_data = {
+            "UserName": self.username,
+            "Password": self.password,
+            "CompanyDB": self.company_db
+        }
+
+        try:
+            response = session.post(login_url, json=login_data,
+                                    timeout=self.login_timeout)
+            if response.status_code == 200:
+                payload = response.json()
+                with self._lock:
+                    self.logins += 1
+                logging.info("Successfully logged in to SAP B1")
+                return payload.get('SessionId'), payload.get(
+                    'SessionTimeout', DEFAULT_SESSION_TIMEOUT_MINUTES)
+            logging.warning(
+                f"SAP B1 login failed: {response.text}. Running in offline mode.")
+        except Exception as e:
+            logging.warning(
+                f"SAP B1 login error: {str(e)}. Running in offline mode.")
+        return None, None
+
+    def acquire(self):
+        """Check out a logged-in session, logging in only if none is reusable"""
+        while True:
+            with self._lock:
+                pooled = self._idle.popleft() if self._idle else None
+                if pooled is not None:
+                    self._checked_out += 1
+            if pooled is None:
+                break
+            if not pooled.is_expired():
+                with self._lock:
+                    self.reuses += 1
+                pooled.touch()
+                return pooled
+            # Idle past SAP's SessionTimeout - log the same session in again
+            if self.renew(pooled):
+                return pooled
+            with self._lock:
+                self._checked_out -= 1
+
+        session = self._new_session()
+        session_id, timeout_minutes = self._login(session)
+        if not session_id:
+            session.close()
+            return None
+
+        pooled = PooledSession(session, session_id, timeout_minutes)
+        with self._lock:
+            self._checked_out += 1
+        return pooled
+
+    def release(self, pooled):
+        """Return a session to the pool, logging out any surplus beyond max_size"""
+        if pooled is None:
+            return
+        with self._lock:
+            self._checked_out = max(self._checked_out - 1, 0)
+            if len(self._idle) < self.max_size:
+                self._idle.append(pooled)
+                return
+        self._logout(pooled)
+
+    def renew(self, pooled):
+        """Log an existing session in again after SAP rejected or expired it"""
+        session_id, timeout_minutes = self._login(pooled.session)
+        if not session_id:
+            return False
+        pooled.session_id = session_id
+        pooled.idle_timeout = timeout_minutes * 60
+        pooled.touch()
+        return True
+
+    def _logout(self, pooled):
+        try:
+            pooled.session.post(f"{self.base_url}/b1s/v1/Logout",
+                                timeout=self.login_timeout)
+        except Exception as e:
+            logging.debug(f"Error logging out pooled SAP B1 session: {str(e)}")
+        finally:
+            pooled.session.close()
+
+    def close(self):
+        """Log out every idle session (used on shutdown)"""
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+        for pooled in idle:
+            self._logout(pooled)
+
+    def stats(self):
+        """Pool counters for diagnostics"""
+        with self._lock:
+            return {
+                'idle': len(self._idle),
+                'checked_out': self._checked_out,
+                'max_size': self.max_size,
+                'logins': self.logins,
+                'reuses': self.reuses
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_limiters = {}
+
+
+def get_session_pool(base_url, username, password, company_db, max_size=4):
+    """Get the process-wide session pool for one SAP B1 company database"""
+    # Keyed by pid too, so forked gunicorn workers never share sockets
+    key = (os.getpid(), base_url, company_db, username)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = SAPSessionPool(base_url, username, password, company_db,
+                                  max_size=max_size)
+            _pools[key] = pool
+        return pool
+
+
+def get_concurrency_limiter(base_url, max_concurrent=4):
+    """Get the process-wide semaphore capping parallel calls to one SAP server"""
+    key = (os.getpid(), base_url)
+    with _pools_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = threading.BoundedSemaphore(max_concurrent)
+            _limiters[key] = limiter
+        return limiter
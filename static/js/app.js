@@ -305,6 +305,48 @@ function generateUUID() {
     });
 }
 
+// Show the SAP posting status of a QC-approved document and poll while
+// the outbox dispatcher is still posting it; reloads the page once posted
+function watchSapPosting(documentType, documentId, elementId, intervalMs = 3000) {
+    const element = document.getElementById(elementId);
+    if (!element) {
+        return;
+    }
+
+    let wasPending = false;
+    const check = () => {
+        fetch(`/api/sap/outbox/${documentType}/${documentId}`)
+            .then(response => response.json())
+            .then(data => {
+                const entry = data.outbox;
+                if (!entry) {
+                    return;
+                }
+                element.classList.remove('d-none', 'alert-info', 'alert-success', 'alert-danger');
+                if (entry.status === 'queued' || entry.status === 'processing') {
+                    wasPending = true;
+                    element.classList.add('alert-info');
+                    element.textContent = entry.attempts > 0 && entry.error
+                        ? `Posting to SAP B1 - retrying after error: ${entry.error}`
+                        : 'Posting to SAP B1...';
+                    setTimeout(check, intervalMs);
+                } else if (entry.status === 'posted') {
+                    if (wasPending) {
+                        location.reload();
+                        return;
+                    }
+                    element.classList.add('alert-success');
+                    element.textContent = `Posted to SAP B1 as document ${entry.sap_doc_num}`;
+                } else if (entry.status === 'failed') {
+                    element.classList.add('alert-danger');
+                    element.textContent = `Posting to SAP B1 failed: ${entry.error}`;
+                }
+            })
+            .catch(error => console.error('Error checking SAP posting status:', error));
+    };
+    check();
+}
+
 // Keyboard shortcuts
 document.addEventListener('keydown', (e) => {
     // Ctrl+Alt+S for scan
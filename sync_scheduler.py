@@ -0,0 +1,203 @@
+"""
+SAP Master Data Sync Scheduler
+==============================
+
+Runs sync_all_master_data off the request path. Each run is a row in
+sap_sync_runs: the dashboard button only enqueues one, and a background
+thread in every web worker (or the standalone worker started with
+``python sync_scheduler.py``) claims queued runs with an atomic UPDATE, so
+each run executes in exactly one process. A queued or running run holds the
+unique active_slot, so the database refuses a second active run even when
+several workers enqueue at once. A scheduled run is enqueued every
+SAP_SYNC_INTERVAL_MINUTES.
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from app import app, db
+from models import SAPSyncRun, SAPSyncState
+
+
+class SyncScheduler:
+    """Background executor for queued and periodic master data syncs"""
+
+    def __init__(self, sync_interval_minutes=60, poll_seconds=15, run_timeout_minutes=120):
+        self.sync_interval = timedelta(minutes=sync_interval_minutes)
+        self.poll_seconds = poll_seconds
+        self.run_timeout = timedelta(minutes=run_timeout_minutes)
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the scheduler thread in this process (idempotent)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self._thread = threading.Thread(target=self._loop, name='sap-sync-scheduler', daemon=True)
+        self._thread.start()
+        logging.info(f"🕒 SAP sync scheduler started in {self.worker}")
+
+    def enqueue(self, trigger='manual', full=None, user_id=None):
+        """Queue a sync run; returns the already queued or running run if there is one"""
+        while True:
+            pending = SAPSyncRun.query.filter(
+                SAPSyncRun.status.in_(['queued', 'running'])).order_by(SAPSyncRun.id).first()
+            if pending is not None:
+                return pending, False
+
+            run = SAPSyncRun(trigger=trigger, full=full, requested_by=user_id, status='queued',
+                             active_slot=1)
+            db.session.add(run)
+            try:
+                db.session.commit()
+                break
+            except IntegrityError:
+                # Another worker enqueued between our check and insert - return its run
+                db.session.rollback()
+        self._wake.set()
+        logging.info(f"🕒 Queued SAP sync run {run.id} ({trigger})")
+        return run, True
+
+    def run_pending(self):
+        """Claim and execute the oldest queued run; returns its id or None"""
+        run = SAPSyncRun.query.filter_by(status='queued').order_by(SAPSyncRun.id).first()
+        if run is None:
+            return None
+
+        # Only one worker wins the queued -> running transition
+        claimed = SAPSyncRun.query.filter_by(id=run.id, status='queued').update(
+            {'status': 'running', 'started_at': datetime.utcnow(), 'worker': self.worker},
+            synchronize_session=False)
+        db.session.commit()
+        if not claimed:
+            return None
+
+        run_id, full = run.id, run.full
+        logging.info(f"🔄 Running SAP sync run {run_id} in {self.worker}")
+        results, error = {}, None
+        try:
+            from sap_integration import SAPIntegration
+            results = SAPIntegration().sync_all_master_data(full=full)
+        except Exception as e:
+            error = str(e)
+            logging.error(f"SAP sync run {run_id} failed: {error}")
+
+        if error is None and results and all(results.values()):
+            status = 'success'
+        elif error is None and any(results.values()):
+            status = 'partial'
+        else:
+            status = 'failed'
+
+        # Drop anything a failed sync left uncommitted before recording the outcome
+        db.session.rollback()
+        SAPSyncRun.query.filter_by(id=run_id).update(
+            {'status': status, 'active_slot': None, 'results': json.dumps(results), 'error': error,
+             'finished_at': datetime.utcnow()},
+            synchronize_session=False)
+        db.session.commit()
+        logging.info(f"✅ SAP sync run {run_id} finished: {status}")
+        return run_id
+
+    def _enqueue_if_due(self):
+        if not self.sync_interval:
+            return
+        latest = SAPSyncRun.query.order_by(SAPSyncRun.queued_at.desc()).first()
+        if latest is None or datetime.utcnow() - latest.queued_at >= self.sync_interval:
+            self.enqueue(trigger='schedule')
+
+    def _fail_abandoned_runs(self):
+        # A worker that died mid-run leaves its run 'running' forever
+        cutoff = datetime.utcnow() - self.run_timeout
+        abandoned = SAPSyncRun.query.filter(
+            SAPSyncRun.status == 'running', SAPSyncRun.started_at < cutoff).update(
+            {'status': 'failed', 'active_slot': None,
+             'error': 'Run abandoned (worker stopped or timed out)', 'finished_at': datetime.utcnow()},
+            synchronize_session=False)
+        db.session.commit()
+        if abandoned:
+            logging.warning(f"Marked {abandoned} abandoned SAP sync runs as failed")
+
+    def tick(self):
+        """One scheduler pass: housekeeping, periodic enqueue, then run what is queued"""
+        with app.app_context():
+            try:
+                self._fail_abandoned_runs()
+                self._enqueue_if_due()
+            except Exception as e:
+                db.session.rollback()
+                logging.warning(f"SAP sync scheduler check failed: {str(e)}")
+        # Each run gets its own app context, so SAP sessions and the
+        # per-context read memo are released when it ends
+        while True:
+            with app.app_context():
+                try:
+                    if self.run_pending() is None:
+                        return
+                except Exception as e:
+                    db.session.rollback()
+                    logging.warning(f"SAP sync scheduler run failed: {str(e)}")
+                    return
+
+    def _loop(self):
+        while True:
+            self.tick()
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+
+    def status(self, limit=10):
+        """Scheduler, recent runs and per-entity sync state for the status API"""
+        def iso(value):
+            return value.isoformat() if value else None
+
+        runs = SAPSyncRun.query.order_by(SAPSyncRun.id.desc()).limit(limit).all()
+        states = SAPSyncState.query.order_by(SAPSyncState.entity).all()
+        return {
+            'scheduler': {
+                'running_here': self._thread is not None and self._thread.is_alive(),
+                'worker': self.worker,
+                'sync_interval_minutes': int(self.sync_interval.total_seconds() // 60)
+            },
+            'runs': [{
+                'id': run.id,
+                'trigger': run.trigger,
+                'full': run.full,
+                'status': run.status,
+                'worker': run.worker,
+                'results': json.loads(run.results) if run.results else None,
+                'error': run.error,
+                'queued_at': iso(run.queued_at),
+                'started_at': iso(run.started_at),
+                'finished_at': iso(run.finished_at),
+                'duration_seconds': (run.finished_at - run.started_at).total_seconds()
+                if run.started_at and run.finished_at else None
+            } for run in runs],
+            'entities': [{
+                'entity': state.entity,
+                'last_update_date': state.last_update_date,
+                'last_update_time': state.last_update_time,
+                'last_sync_at': iso(state.last_sync_at),
+                'last_full_sync_at': iso(state.last_full_sync_at),
+                'last_sync_count': state.last_sync_count
+            } for state in states]
+        }
+
+
+sync_scheduler = SyncScheduler(
+    sync_interval_minutes=app.config.get('SAP_SYNC_INTERVAL_MINUTES', 60),
+    poll_seconds=app.config.get('SAP_SYNC_POLL_SECONDS', 15))
+
+
+if __name__ == "__main__":
+    # Standalone sync worker - run the web workers with SAP_SYNC_SCHEDULER=off
+    from sync_scheduler import sync_scheduler as scheduler
+    scheduler.start()
+    scheduler._thread.join()
@@ -0,0 +1,40 @@
+import os
+import tempfile
+
+import pytest
+
+# Configure before the app is imported: a throwaway SQLite database, SAP B1
+# unconfigured (offline mode) and no background threads
+_db_dir = tempfile.mkdtemp(prefix='wms-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_db_dir, 'wms.db')}"
+os.environ['SAP_B1_SERVER'] = ''
+os.environ['SAP_SYNC_SCHEDULER'] = 'off'
+os.environ['SAP_OUTBOX_DISPATCHER'] = 'off'
+
+import main  # noqa: E402,F401 - registers the routes
+from app import app as flask_app, db  # noqa: E402
+from models import User  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app():
+    flask_app.config['TESTING'] = True
+    return flask_app
+
+
+@pytest.fixture(scope='session')
+def admin_id(app):
+    with app.app_context():
+        user = User(username='test-admin', email='test-admin@example.com',
+                    password_hash='x', role='admin')
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+
+@pytest.fixture
+def client(app, admin_id):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(admin_id)
+    return client
@@ -0,0 +1,40 @@
+"""Document numbers are unique across workers reserving blocks concurrently"""
+
+import threading
+
+from models import DocumentNumberSeries
+from number_allocator import DOCUMENT_SERIES, NumberAllocator
+
+DEFAULTS = {'prefix': 'T-', 'year_suffix': False}
+
+
+def test_new_series_starts_at_initial_value(app):
+    allocator = NumberAllocator(block_size=3)
+    with app.app_context():
+        numbers = [allocator.next_value(DOCUMENT_SERIES, 'ALLOC-NEW', DEFAULTS)[0] for _ in range(7)]
+        assert numbers == list(range(1, 8))
+        # Three blocks of three: the counter is past the last reserved number
+        assert DocumentNumberSeries.query.filter_by(document_type='ALLOC-NEW').one().current_number == 10
+    assert allocator.reserved_blocks == 3
+
+
+def test_workers_never_hand_out_the_same_number(app):
+    # One allocator per simulated worker process, all sharing the series row
+    allocators = [NumberAllocator(block_size=5) for _ in range(4)]
+    numbers, lock = [], threading.Lock()
+
+    def worker(allocator):
+        with app.app_context():
+            for _ in range(25):
+                number, _ = allocator.next_value(DOCUMENT_SERIES, 'ALLOC-RACE', DEFAULTS)
+                with lock:
+                    numbers.append(number)
+
+    threads = [threading.Thread(target=worker, args=(allocator,)) for allocator in allocators]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(numbers) == 100
+    assert len(set(numbers)) == 100
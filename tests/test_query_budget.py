@@ -0,0 +1,76 @@
+"""Detail and QC pages must stay within their @query_budget however many
+documents and lines they show, so an N+1 relationship load fails here."""
+
+import pytest
+
+from app import db
+from models import (GRNDocument, GRNItem, InventoryCount, InventoryCountItem, InventoryTransfer,
+                    InventoryTransferItem, PickList, PickListItem, User)
+from query_budget import QueryBudgetExceeded, assert_max_queries
+
+# Statements a request issues outside the view: flask-login loading current_user
+REQUEST_OVERHEAD = 1
+DOCUMENTS = 5
+LINES = 6
+
+
+@pytest.fixture(scope='module')
+def documents(app):
+    with app.app_context():
+        # Creators and approvers other than the logged-in user, so their
+        # rows are not already in the session when the page renders
+        users = [User(username=f'budget-user-{i}', email=f'budget-user-{i}@example.com',
+                      password_hash='x', role='user') for i in range(2 * DOCUMENTS)]
+        db.session.add_all(users)
+        db.session.flush()
+        ids = {}
+        for i in range(DOCUMENTS):
+            creator, approver = users[2 * i].id, users[2 * i + 1].id
+            grn = GRNDocument(po_number=f'PO-{i}', user_id=creator, qc_user_id=approver,
+                              status='submitted')
+            transfer = InventoryTransfer(transfer_request_number=f'TR-{i}', user_id=creator,
+                                         status='submitted', from_warehouse='WH1', to_warehouse='WH2')
+            pick_list = PickList(sales_order_number=f'SO-{i}', pick_list_number=f'PL-{i}',
+                                 user_id=creator, approver_id=approver)
+            count = InventoryCount(count_number=f'CNT-{i}', warehouse_code='WH1', bin_location='WH1-A',
+                                   user_id=creator)
+            db.session.add_all([grn, transfer, pick_list, count])
+            db.session.flush()
+            for j in range(LINES):
+                item_code = f'ITEM-{j}'
+                db.session.add_all([
+                    GRNItem(grn_document_id=grn.id, item_code=item_code, item_name=item_code,
+                            received_quantity=1, unit_of_measure='EA', bin_location='WH1-A'),
+                    InventoryTransferItem(inventory_transfer_id=transfer.id, item_code=item_code,
+                                          item_name=item_code, quantity=1, requested_quantity=1,
+                                          remaining_quantity=1, unit_of_measure='EA',
+                                          from_bin='WH1-A', to_bin='WH2-A'),
+                    PickListItem(pick_list_id=pick_list.id, item_code=item_code, item_name=item_code,
+                                 quantity=1, unit_of_measure='EA', bin_location='WH1-A'),
+                    InventoryCountItem(inventory_count_id=count.id, item_code=item_code,
+                                       item_name=item_code, system_quantity=1, counted_quantity=1,
+                                       variance=0, unit_of_measure='EA')
+                ])
+        db.session.commit()
+        ids.update(grn=grn.id, transfer=transfer.id, pick_list=pick_list.id, count=count.id)
+        return ids
+
+
+@pytest.mark.parametrize('endpoint, url', [
+    ('qc_dashboard', '/qc_dashboard'),
+    ('grn_detail', '/grn/{grn}'),
+    ('inventory_transfer_detail', '/inventory_transfer/{transfer}'),
+    ('pick_list_detail', '/pick_list/{pick_list}'),
+    ('inventory_counting_detail', '/inventory_counting/{count}'),
+])
+def test_page_within_query_budget(app, client, documents, endpoint, url):
+    budget = app.view_functions[endpoint].query_budget
+    with assert_max_queries(budget + REQUEST_OVERHEAD):
+        response = client.get(url.format(**documents))
+    assert response.status_code == 200
+
+
+def test_guard_fails_when_budget_exceeded(client, documents):
+    with pytest.raises(QueryBudgetExceeded):
+        with assert_max_queries(1):
+            client.get('/qc_dashboard')
@@ -0,0 +1,210 @@
+"""SAP posting outbox dispatcher behaviour"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+import sap_outbox
+from app import db
+from models import GRNDocument, GRNItem, InventoryTransfer, InventoryTransferItem, SAPOutbox
+from sap_outbox import SAPOutboxDispatcher
+
+
+@pytest.fixture(autouse=True)
+def empty_outbox(app):
+    """Each test dispatches only the entries it queued"""
+    with app.app_context():
+        SAPOutbox.query.delete()
+        db.session.commit()
+
+
+@pytest.fixture
+def dispatcher():
+    return SAPOutboxDispatcher(poll_seconds=1, max_attempts=3, retry_backoff_seconds=0)
+
+
+@pytest.fixture
+def grn_entry(app, admin_id, dispatcher):
+    """An approved GRN queued for posting; yields the outbox entry id"""
+    with app.app_context():
+        grn = GRNDocument(po_number='PO-OUTBOX', user_id=admin_id, status='approved')
+        db.session.add(grn)
+        db.session.flush()
+        db.session.add(GRNItem(grn_document_id=grn.id, item_code='ITEM-1', item_name='ITEM-1',
+                               received_quantity=1, unit_of_measure='EA', bin_location='WH1-A',
+                               qc_status='approved'))
+        entry, _ = dispatcher.enqueue('grn', grn.id, user_id=admin_id)
+        db.session.commit()
+        return entry.id
+
+
+@pytest.fixture
+def transfer_entry(app, admin_id, dispatcher):
+    with app.app_context():
+        transfer = InventoryTransfer(transfer_request_number='TR-OUTBOX', user_id=admin_id,
+                                     status='qc_approved', from_warehouse='WH1', to_warehouse='WH2')
+        db.session.add(transfer)
+        db.session.flush()
+        db.session.add(InventoryTransferItem(inventory_transfer_id=transfer.id, item_code='ITEM-1',
+                                             item_name='ITEM-1', quantity=1, requested_quantity=1,
+                                             remaining_quantity=1, unit_of_measure='EA',
+                                             from_bin='WH1-A', to_bin='WH2-A'))
+        entry, _ = dispatcher.enqueue('inventory_transfer', transfer.id, user_id=admin_id)
+        db.session.commit()
+        return entry.id
+
+
+def test_sap_outage_is_not_recorded_as_posted(app, monkeypatch, dispatcher, grn_entry, transfer_entry):
+    # Nothing listens on port 9, so every SAP login fails
+    for key, value in {'SAP_B1_SERVER': 'http://127.0.0.1:9', 'SAP_B1_USERNAME': 'manager',
+                       'SAP_B1_PASSWORD': 'secret', 'SAP_B1_COMPANY_DB': 'TEST'}.items():
+        monkeypatch.setitem(app.config, key, value)
+
+    with app.app_context():
+        while dispatcher.dispatch_next() is not None:
+            pass
+
+        for entry_id in (grn_entry, transfer_entry):
+            entry = db.session.get(SAPOutbox, entry_id)
+            assert entry.status in ('queued', 'failed')
+            assert entry.sap_doc_num is None
+            assert 'not available' in entry.last_error
+        grn = db.session.get(GRNDocument, db.session.get(SAPOutbox, grn_entry).document_id)
+        assert grn.status == 'approved'
+        assert grn.sap_document_number is None
+
+
+def test_manual_post_goes_through_the_outbox(app, client, grn_entry):
+    with app.app_context():
+        grn_id = db.session.get(SAPOutbox, grn_entry).document_id
+
+    # The GRN is already queued: a manual post must not send it again
+    client.post(f'/post_grn_to_sap/{grn_id}')
+    with app.app_context():
+        entries = SAPOutbox.query.filter_by(document_type='grn', document_id=grn_id).all()
+        assert [entry.id for entry in entries] == [grn_entry]
+
+        # Once that posting has failed for good, a manual post queues a new one
+        SAPOutbox.query.filter_by(id=grn_entry).update({'status': 'failed'})
+        db.session.commit()
+    client.post(f'/post_grn_to_sap/{grn_id}')
+    with app.app_context():
+        statuses = [entry.status for entry in SAPOutbox.query.filter_by(
+            document_type='grn', document_id=grn_id).order_by(SAPOutbox.id)]
+        assert statuses == ['failed', 'queued']
+
+
+def _post_as(monkeypatch, *results):
+    """Replace the GRN poster with one returning results in turn; returns the call log"""
+    calls = []
+
+    def poster(sap, entry):
+        calls.append(entry.id)
+        return results[min(len(calls), len(results)) - 1]
+
+    monkeypatch.setitem(sap_outbox.POSTERS, 'grn', poster)
+    return calls
+
+
+def test_successful_post_records_the_sap_document(app, monkeypatch, dispatcher, grn_entry):
+    calls = _post_as(monkeypatch, {'success': True, 'doc_num': 4711, 'doc_entry': 12})
+
+    with app.app_context():
+        assert dispatcher.dispatch_next() == grn_entry
+        assert dispatcher.dispatch_next() is None
+        entry = db.session.get(SAPOutbox, grn_entry)
+        assert (entry.status, entry.attempts) == ('posted', 1)
+        assert (entry.sap_doc_num, entry.sap_doc_entry) == ('4711', 12)
+        assert entry.finished_at is not None
+    assert calls == [grn_entry]
+
+
+def test_failed_post_is_retried_until_max_attempts(app, monkeypatch, dispatcher, grn_entry):
+    calls = _post_as(monkeypatch, {'success': False, 'error': 'Quantity exceeds open quantity'})
+
+    with app.app_context():
+        for attempt in range(1, dispatcher.max_attempts):
+            assert dispatcher.dispatch_next() == grn_entry
+            entry = db.session.get(SAPOutbox, grn_entry)
+            assert (entry.status, entry.attempts) == ('queued', attempt)
+        assert dispatcher.dispatch_next() == grn_entry
+        assert dispatcher.dispatch_next() is None
+        entry = db.session.get(SAPOutbox, grn_entry)
+        assert (entry.status, entry.attempts) == ('failed', dispatcher.max_attempts)
+        assert entry.last_error == 'Quantity exceeds open quantity'
+
+        # A manual retry starts a fresh round of attempts
+        assert dispatcher.retry(grn_entry)
+        entry = db.session.get(SAPOutbox, grn_entry)
+        assert (entry.status, entry.attempts) == ('queued', 0)
+    assert len(calls) == dispatcher.max_attempts
+
+
+def test_failed_post_backs_off_exponentially(app, monkeypatch, grn_entry):
+    dispatcher = SAPOutboxDispatcher(max_attempts=5, retry_backoff_seconds=30)
+    _post_as(monkeypatch, {'success': False, 'error': 'Service Layer returned 500'})
+
+    with app.app_context():
+        for attempt, backoff in ((1, 30), (2, 60)):
+            before = datetime.utcnow()
+            assert dispatcher.dispatch_next() == grn_entry
+            entry = db.session.get(SAPOutbox, grn_entry)
+            assert entry.attempts == attempt
+            assert entry.next_attempt_at >= before + timedelta(seconds=backoff)
+            # Not due yet
+            assert dispatcher.dispatch_next() is None
+            entry.next_attempt_at = datetime.utcnow()
+            db.session.commit()
+
+
+def test_deferred_post_is_rescheduled_without_using_an_attempt(app, monkeypatch, dispatcher,
+                                                               grn_entry):
+    calls = _post_as(monkeypatch,
+                     {'success': False, 'deferred': True, 'retry_after': 120,
+                      'error': 'WMS-GRN-1 is being posted to SAP B1 by another worker'},
+                     {'success': True, 'doc_num': 4712, 'doc_entry': 13})
+
+    with app.app_context():
+        before = datetime.utcnow()
+        assert dispatcher.dispatch_next() == grn_entry
+        entry = db.session.get(SAPOutbox, grn_entry)
+        assert (entry.status, entry.attempts) == ('queued', 0)
+        assert entry.next_attempt_at >= before + timedelta(seconds=120)
+        assert dispatcher.dispatch_next() is None
+
+        entry.next_attempt_at = datetime.utcnow()
+        db.session.commit()
+        assert dispatcher.dispatch_next() == grn_entry
+        entry = db.session.get(SAPOutbox, grn_entry)
+        assert (entry.status, entry.attempts, entry.sap_doc_num) == ('posted', 1, '4712')
+    assert calls == [grn_entry, grn_entry]
+
+
+def test_abandoned_post_is_requeued(app, monkeypatch, dispatcher, grn_entry):
+    _post_as(monkeypatch, {'success': True, 'doc_num': 4713, 'doc_entry': 14})
+
+    with app.app_context():
+        # A worker claimed the entry and died before recording the outcome
+        SAPOutbox.query.filter_by(id=grn_entry).update(
+            {'status': 'processing', 'attempts': 1, 'worker': 'gone:1',
+             'started_at': datetime.utcnow() - dispatcher.processing_timeout - timedelta(minutes=1)})
+        db.session.commit()
+        assert dispatcher.dispatch_next() is None
+
+        dispatcher._requeue_abandoned()
+        entry = db.session.get(SAPOutbox, grn_entry)
+        assert entry.status == 'queued'
+        assert 'abandoned' in entry.last_error
+
+        assert dispatcher.dispatch_next() == grn_entry
+        entry = db.session.get(SAPOutbox, grn_entry)
+        assert (entry.status, entry.attempts) == ('posted', 2)
+
+
+def test_recent_processing_entry_is_left_alone(app, dispatcher, grn_entry):
+    with app.app_context():
+        SAPOutbox.query.filter_by(id=grn_entry).update(
+            {'status': 'processing', 'attempts': 1, 'started_at': datetime.utcnow()})
+        db.session.commit()
+        dispatcher._requeue_abandoned()
+        assert db.session.get(SAPOutbox, grn_entry).status == 'processing'
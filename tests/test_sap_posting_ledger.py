@@ -0,0 +1,173 @@
+"""Posting ledger: a WMS document reaches SAP B1 at most once, however often
+the post is retried"""
+
+import itertools
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from models import SAPPostingKey
+from sap_posting_ledger import PostingLedger, posting_key
+
+_document_ids = itertools.count(1)
+
+
+@pytest.fixture
+def key(app):
+    """A fresh idempotency key per test; yields (key, document_id)"""
+    document_id = next(_document_ids)
+    with app.app_context():
+        return posting_key('grn', document_id), document_id
+
+
+class FakeSAP:
+    """lookup()/post() pair recording calls; post results are returned in turn"""
+
+    def __init__(self, *results, found=None):
+        self.results = list(results)
+        self.found = found
+        self.posts = 0
+        self.lookups = 0
+
+    def lookup(self):
+        self.lookups += 1
+        if isinstance(self.found, Exception):
+            raise self.found
+        return self.found
+
+    def post(self):
+        self.posts += 1
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def _post(ledger, key, sap):
+    return ledger.post_once(key[0], 'grn', key[1], sap.lookup, sap.post)
+
+
+def _ledger_row(key):
+    return SAPPostingKey.query.filter_by(idempotency_key=key[0]).one()
+
+
+def test_posting_key_format(app):
+    with app.app_context():
+        assert posting_key('grn', 12) == 'WMS-GRN-12'
+        assert posting_key('inventory_transfer', 7) == 'WMS-TR-7'
+
+
+def test_posted_key_is_not_posted_again(app, key):
+    ledger = PostingLedger(settle_seconds=0)
+    sap = FakeSAP({'success': True, 'document_number': 5001, 'doc_entry': 41})
+
+    with app.app_context():
+        first = _post(ledger, key, sap)
+        assert first['success'] and first['idempotency_key'] == key[0]
+        second = _post(ledger, key, sap)
+        assert second['success'] and second['already_posted']
+        assert (second['document_number'], second['doc_entry']) == ('5001', 41)
+        row = _ledger_row(key)
+        assert (row.status, row.attempts, row.sap_doc_num) == ('posted', 1, '5001')
+    # The first post is never preceded by a lookup
+    assert (sap.posts, sap.lookups) == (1, 0)
+
+
+def test_failed_post_checks_sap_before_retrying(app, key):
+    ledger = PostingLedger(settle_seconds=0)
+    sap = FakeSAP({'success': False, 'error': 'Quantity exceeds open quantity'},
+                  {'success': True, 'document_number': 5002, 'doc_entry': 42})
+
+    with app.app_context():
+        result = _post(ledger, key, sap)
+        assert not result['success'] and 'deferred' not in result
+        assert _ledger_row(key).status == 'failed'
+
+        assert _post(ledger, key, sap)['success']
+        row = _ledger_row(key)
+        assert (row.status, row.attempts, row.last_error) == ('posted', 2, None)
+    assert (sap.posts, sap.lookups) == (2, 1)
+
+
+def test_unknown_outcome_waits_for_sap_to_settle(app, key):
+    ledger = PostingLedger(settle_seconds=120)
+    sap = FakeSAP(TimeoutError('Read timed out'))
+
+    with app.app_context():
+        result = _post(ledger, key, sap)
+        assert not result['success'] and result['outcome_unknown']
+        assert result['retry_after'] == 120
+        assert _ledger_row(key).status == 'unknown'
+
+        # Too early to tell whether SAP created the document: neither look nor post
+        retry = _post(ledger, key, sap)
+        assert retry['deferred'] and 0 < retry['retry_after'] <= 120
+    assert (sap.posts, sap.lookups) == (1, 0)
+
+
+def test_document_created_despite_timeout_is_recorded_not_reposted(app, key):
+    ledger = PostingLedger(settle_seconds=0)
+    sap = FakeSAP(TimeoutError('Read timed out'), found={'DocEntry': 43, 'DocNum': 5003})
+
+    with app.app_context():
+        assert _post(ledger, key, sap)['outcome_unknown']
+        result = _post(ledger, key, sap)
+        assert result['success'] and result['already_posted']
+        assert result['document_number'] == '5003'
+        row = _ledger_row(key)
+        assert (row.status, row.sap_doc_entry, row.sap_doc_num) == ('posted', 43, '5003')
+    assert (sap.posts, sap.lookups) == (1, 1)
+
+
+def test_failed_lookup_defers_instead_of_posting(app, key):
+    ledger = PostingLedger(settle_seconds=0)
+    sap = FakeSAP(TimeoutError('Read timed out'), found=ConnectionError('SAP B1 unreachable'))
+
+    with app.app_context():
+        _post(ledger, key, sap)
+        result = _post(ledger, key, sap)
+        assert result['deferred'] and 'Could not check SAP B1' in result['error']
+        row = _ledger_row(key)
+        assert row.status == 'unknown'
+        assert 'lookup failed' in row.last_error
+
+        # Once SAP can be searched again and has no document, it is posted
+        sap.found = None
+        sap.results.append({'success': True, 'document_number': 5004, 'doc_entry': 44})
+        assert _post(ledger, key, sap)['success']
+    assert (sap.posts, sap.lookups) == (2, 2)
+
+
+def test_key_in_flight_elsewhere_is_not_posted_concurrently(app, key):
+    ledger = PostingLedger(settle_seconds=0)
+    concurrent = []
+
+    def post():
+        # Another worker picks the document up while this post is in flight
+        concurrent.append(_post(ledger, key, FakeSAP({'success': True})))
+        return {'success': True, 'document_number': 5005, 'doc_entry': 45}
+
+    with app.app_context():
+        assert ledger.post_once(key[0], 'grn', key[1], lambda: None, post)['success']
+        assert concurrent[0]['deferred']
+        assert 'another worker' in concurrent[0]['error']
+        assert _ledger_row(key).attempts == 1
+
+
+def test_stale_in_flight_key_is_taken_over(app, key):
+    ledger = PostingLedger(settle_seconds=0, request_timeout=60)
+    sap = FakeSAP({'success': True, 'document_number': 5006, 'doc_entry': 46})
+
+    with app.app_context():
+        # A worker died mid-post long ago
+        stale = datetime.utcnow() - timedelta(minutes=10)
+        db.session.add(SAPPostingKey(idempotency_key=key[0], document_type='grn',
+                                     document_id=key[1], status='in_flight', attempts=1,
+                                     last_attempt_at=stale, updated_at=stale))
+        db.session.commit()
+
+        assert _post(ledger, key, sap)['success']
+        assert _ledger_row(key).status == 'posted'
+    # Its post may have reached SAP, so SAP is searched first
+    assert (sap.posts, sap.lookups) == (1, 1)
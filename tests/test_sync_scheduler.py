@@ -0,0 +1,67 @@
+"""At most one SAP sync run is queued or running at a time"""
+
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from models import SAPSyncRun
+from sync_scheduler import SyncScheduler
+
+
+@pytest.fixture
+def scheduler(app):
+    with app.app_context():
+        SAPSyncRun.query.delete()
+        db.session.commit()
+    return SyncScheduler(sync_interval_minutes=0)
+
+
+def test_enqueue_returns_the_active_run(app, scheduler):
+    with app.app_context():
+        run, queued = scheduler.enqueue(trigger='manual')
+        assert queued
+        again, queued_again = scheduler.enqueue(trigger='schedule')
+        assert (again.id, queued_again) == (run.id, False)
+        assert SAPSyncRun.query.count() == 1
+
+
+def test_database_refuses_a_second_active_run(app, scheduler):
+    with app.app_context():
+        scheduler.enqueue()
+        # A worker that skipped the check still cannot add a second active run
+        db.session.add(SAPSyncRun(trigger='manual', status='queued', active_slot=1))
+        with pytest.raises(IntegrityError):
+            db.session.commit()
+        db.session.rollback()
+
+
+def test_finished_run_frees_the_slot(app, monkeypatch, scheduler):
+    import sap_integration
+    monkeypatch.setattr(sap_integration.SAPIntegration, 'sync_all_master_data',
+                        lambda self, full=None: {'items': True, 'warehouses': True})
+
+    with app.app_context():
+        run, _ = scheduler.enqueue()
+        assert scheduler.run_pending() == run.id
+        finished = db.session.get(SAPSyncRun, run.id)
+        db.session.refresh(finished)
+        assert (finished.status, finished.active_slot) == ('success', None)
+
+        second, queued = scheduler.enqueue()
+        assert queued and second.id != run.id
+
+
+def test_abandoned_run_frees_the_slot(app, scheduler):
+    with app.app_context():
+        run, _ = scheduler.enqueue()
+        SAPSyncRun.query.filter_by(id=run.id).update(
+            {'status': 'running', 'started_at': datetime.utcnow() - scheduler.run_timeout - timedelta(minutes=1)})
+        db.session.commit()
+
+        scheduler._fail_abandoned_runs()
+        abandoned = db.session.get(SAPSyncRun, run.id)
+        db.session.refresh(abandoned)
+        assert (abandoned.status, abandoned.active_slot) == ('failed', None)
+        assert scheduler.enqueue()[1]